@@ -4,15 +4,46 @@ ClawOS 分层记忆系统
 实现 L1(短期) → L2(中期) → L3(长期) → L4(程序) 四层记忆架构
 """
 
+import fcntl
+import heapq
 import json
+import math
+import mmap
+import operator
 import os
 import sqlite3
 import hashlib
+import struct
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from collections import Counter, OrderedDict, deque
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, BinaryIO, Iterable, Iterator, Tuple
 from dataclasses import dataclass, asdict
 
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except ImportError:
+    # 向量检索退回纯 Python 实现, 不支持 IVF 近似索引
+    HAS_NUMPY = False
+
+try:
+    import yaml
+
+    HAS_YAML = True
+except ImportError:
+    # 只能解析 JSON 工作流
+    HAS_YAML = False
+
 # ============================================================================
 # 记忆类型
 # ============================================================================
@@ -31,36 +62,127 @@ class MemoryEntry:
     def to_dict(self):
         return asdict(self)
 
+# ============================================================================
+# 内容指纹 (去重)
+# ============================================================================
+
+def normalize_content(content: str) -> str:
+    """去重前的规范化: NFKC (全角转半角等)、小写、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", content).lower().split())
+
+
+def content_hash(content: str) -> str:
+    """规范化内容的 SHA-1, 相同内容 (忽略大小写和空白差异) 得到相同的值"""
+    return hashlib.sha1(normalize_content(content).encode('utf-8')).hexdigest()
+
+
+SIMHASH_BITS = 64
+
+
+def _shingles(content: str) -> Counter:
+    """规范化内容的字符 3-gram (中英文通用)"""
+    text = normalize_content(content)
+    return Counter(text[i:i + 3] for i in range(max(1, len(text) - 2)))
+
+
+def shingle_similarity(a: str, b: str) -> float:
+    """两段内容 3-gram 集合的 Jaccard 相似度"""
+    x, y = set(_shingles(a)), set(_shingles(b))
+    return len(x & y) / len(x | y) if x or y else 1.0
+
+
+def simhash(content: str) -> int:
+    """
+    64 位 SimHash, 以 3-gram 为特征
+    
+    内容相近的文本指纹的海明距离小, 用于 L3 的近似重复检测。
+    """
+    grams = _shingles(content)
+    weights = [0] * SIMHASH_BITS
+    for gram, count in grams.items():
+        h = int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'little')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if h >> bit & 1 else -count
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
 # ============================================================================
 # L1: 短期记忆 (内存)
 # ============================================================================
 
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数: ASCII 约 4 字符一个 token, 其余 (中文等) 按 1 字符一个 token"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
 class ShortTermMemory:
-    """短期记忆 - 会话期间的临时存储"""
+    """
+    短期记忆 - 会话期间的临时存储
     
-    def __init__(self, session_id: str, max_items: int = 100):
+    上下文是一个双端队列, 同时按条数 (max_items) 和估算 token 数 (max_tokens)
+    限额, 超出时从最旧的一端 O(1) 淘汰; 每条的 token 数在写入时算好。
+    """
+    
+    def __init__(self, session_id: str, max_items: int = 100, max_tokens: int = 8000):
         self.session_id = session_id
         self.max_items = max_items
-        self.context: List[Dict] = []
+        self.max_tokens = max_tokens
+        self.context: deque = deque()
+        # 与 context 一一对应的 token 估算
+        self._item_tokens: deque = deque()
+        self.tokens = 0
         self.working_memory: Dict[str, Any] = {}
         self.created_at = datetime.now()
     
     def add_context(self, item: Dict):
         """添加上下文项"""
-        self.context.append({
+        item = {
             **item,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        tokens = estimate_tokens(json.dumps(item, ensure_ascii=False))
+        self.context.append(item)
+        self._item_tokens.append(tokens)
+        self.tokens += tokens
         
-        # FIFO 淘汰
-        if len(self.context) > self.max_items:
-            self.context.pop(0)
+        # FIFO 淘汰, 最新的一条总是保留
+        while len(self.context) > 1 and (
+                len(self.context) > self.max_items or self.tokens > self.max_tokens):
+            self._evict()
     
-    def get_context(self, limit: Optional[int] = None) -> List[Dict]:
-        """获取上下文"""
-        if limit:
-            return self.context[-limit:]
-        return self.context.copy()
+    def _evict(self):
+        self.context.popleft()
+        self.tokens -= self._item_tokens.popleft()
+    
+    def trim(self, max_items: int):
+        """只保留最近的 max_items 条"""
+        while len(self.context) > max_items:
+            self._evict()
+    
+    def get_context(self, limit: Optional[int] = None,
+                    max_tokens: Optional[int] = None) -> List[Dict]:
+        """
+        获取上下文 (按时间先后)
+        
+        Args:
+            limit: 最多返回最近的条数
+            max_tokens: 只返回放得进该 token 预算的最近若干条
+        """
+        if not limit and max_tokens is None:
+            return list(self.context)
+        
+        items = []
+        budget = max_tokens
+        for item, tokens in zip(reversed(self.context), reversed(self._item_tokens)):
+            if limit and len(items) >= limit:
+                break
+            if budget is not None:
+                if tokens > budget:
+                    break
+                budget -= tokens
+            items.append(item)
+        items.reverse()
+        return items
     
     def set_working(self, key: str, value: Any):
         """设置工作记忆"""
@@ -73,6 +195,8 @@ class ShortTermMemory:
     def clear(self):
         """清空短期记忆"""
         self.context.clear()
+        self._item_tokens.clear()
+        self.tokens = 0
         self.working_memory.clear()
     
     def summarize(self) -> Dict:
@@ -80,6 +204,7 @@ class ShortTermMemory:
         return {
             "session_id": self.session_id,
             "context_count": len(self.context),
+            "context_tokens": self.tokens,
             "working_keys": list(self.working_memory.keys()),
             "age_minutes": (datetime.now() - self.created_at).seconds / 60
         }
@@ -88,17 +213,133 @@ class ShortTermMemory:
 # L2: 中期记忆 (SQLite)
 # ============================================================================
 
+class SQLiteEngine:
+    """
+    SQLite 连接管理 - 每个线程一个长连接
+    
+    连接以 WAL 模式打开 (读写互不阻塞), 并复用 sqlite3 内置的预编译语句缓存;
+    写事务用 BEGIN IMMEDIATE 开始, 并发写入方在 busy_timeout 内排队等待,
+    而不是立即报 "database is locked"。同一数据库文件在进程内共享一个引擎。
+    
+    每打开一个新连接时, 顺带关闭已退出线程留下的连接, 短命线程不会让连接越积越多。
+    """
+    
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        # WAL 下 NORMAL 只在 checkpoint 时 fsync, 断电最多丢失最近的事务, 不会损坏
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=268435456",
+    )
+    BUSY_TIMEOUT = 5.0
+    STATEMENT_CACHE_SIZE = 256
+    
+    _engines: Dict[Path, 'SQLiteEngine'] = {}
+    _engines_lock = threading.Lock()
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def shared(cls, db_path: Path) -> 'SQLiteEngine':
+        """获取该数据库文件在本进程内共享的引擎"""
+        db_path = Path(db_path).expanduser().resolve()
+        with cls._engines_lock:
+            engine = cls._engines.get(db_path)
+            if engine is None:
+                engine = cls._engines[db_path] = cls(db_path)
+            return engine
+    
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的连接 (fork 之后在子进程里重新打开)"""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(
+                self.db_path, timeout=self.BUSY_TIMEOUT,
+                isolation_level=None, check_same_thread=False,
+                cached_statements=self.STATEMENT_CACHE_SIZE
+            )
+            conn.row_factory = sqlite3.Row
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            local.conn, local.pid, local.depth = conn, os.getpid(), 0
+            with self._lock:
+                if self._pid != os.getpid():
+                    # fork 继承来的是父进程的连接, 子进程既不能用也不该关
+                    self._connections, self._pid = {}, os.getpid()
+                for thread in [t for t in self._connections if not t.is_alive()]:
+                    self._connections.pop(thread).close()
+                self._connections[threading.current_thread()] = conn
+        return local.conn
+    
+    @contextmanager
+    def transaction(self):
+        """写事务: 正常退出时提交, 异常时回滚; 嵌套调用并入最外层事务"""
+        conn = self.connection()
+        local = self._local
+        if local.depth:
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+        
+        conn.execute("BEGIN IMMEDIATE")
+        local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            local.depth = 0
+    
+    def close(self):
+        """关闭本引擎打开的所有连接"""
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
 class MediumTermMemory:
     """中期记忆 - 持久化结构化存储"""
     
+    # 数据库结构版本 (PRAGMA user_version), 旧库打开时由 _migrate 逐级升级
+    SCHEMA_VERSION = 3
+    
+    # trigram 分词只能检索不短于 3 个字符的词, 更短的词退回 LIKE 过滤
+    FTS_MIN_TERM = 3
+    
+    # 访问热度: 按 HEAT_HALF_LIFE 指数衰减的访问次数。heat 列存的是以 HEAT_EPOCH
+    # 为基准放大后的值 (每次访问加 heat_weight(访问时刻)), 更新只是加一个常数,
+    # 按热度排序也无需逐行衰减; 除以 heat_weight() 即为当前热度。
+    # 权重在 HEAT_EPOCH 之后约 19 年 (1024 个半衰期) 超出 float 范围。
+    HEAT_HALF_LIFE = 7 * 86400
+    HEAT_EPOCH = datetime(2026, 1, 1).timestamp()
+    # 当前热度低于此值视为冷数据
+    COLD_HEAT = 0.5
+    
     def __init__(self, db_path: str = "~/clawos/memory/medium.db"):
         self.db_path = Path(db_path).expanduser()
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.engine = SQLiteEngine.shared(self.db_path)
+        # SQLite 未编译 FTS5 时为 False, 检索退回 LIKE 扫描
+        self.fts = False
         self._init_db()
     
     def _init_db(self):
         """初始化数据库"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.engine.transaction() as conn:
             # 任务历史
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS task_history (
@@ -146,14 +387,106 @@ class MediumTermMemory:
             conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_type ON memories(memory_type)")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_importance ON memories(importance)")
             
-            conn.commit()
+            self._migrate(conn)
+            self.fts = self._ensure_fts(conn)
+    
+    def _migrate(self, conn: sqlite3.Connection):
+        """
+        把旧版本数据库升级到 SCHEMA_VERSION
+        
+        v1 (全文索引) 不在这里: 它取决于 SQLite 是否编译了 FTS5, 由 _ensure_fts
+        在每次打开时检查。
+        """
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        
+        if version < 2:
+            # v2: 访问热度, 按已有的访问计数和最后访问时间回填
+            conn.execute("ALTER TABLE memories ADD COLUMN heat REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_heat ON memories(heat)")
+            conn.create_function("heat_weight", 1, self._heat_weight_at, deterministic=True)
+            conn.execute("""
+                UPDATE memories SET heat = access_count * heat_weight(last_accessed)
+                WHERE access_count > 0
+            """)
+        
+        if version < 3:
+            # v3: 规范化内容的哈希, 写入时据此合并重复。已有数据中的重复由 dedup
+            # 合并, 所以这里不加唯一约束
+            conn.execute("ALTER TABLE memories ADD COLUMN content_hash TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_content_hash ON memories(content_hash)")
+            conn.create_function("hash_content", 1, content_hash, deterministic=True)
+            conn.execute("UPDATE memories SET content_hash = hash_content(content)")
+        
+        conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    
+    def _ensure_fts(self, conn: sqlite3.Connection) -> bool:
+        """
+        确保 memories 的全文索引存在 (trigram 分词, 中英文都支持子串检索)
+        
+        每次打开都检查, 而不是只在升级到 v1 时建一次: 在没有 FTS5 的 SQLite 上
+        打开过的数据库, 换到有 FTS5 的环境后会补建索引并回填已有记忆。
+        
+        索引是外部内容表, 按 memories 的隐式 rowid 关联。VACUUM 可能给没有
+        INTEGER PRIMARY KEY 的表重新编号 rowid, 所以整理数据库要用 vacuum(),
+        它随后会重建索引。
+        
+        Returns:
+            全文索引是否可用
+        """
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'memories_fts'"
+        ).fetchone():
+            return True
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE memories_fts USING fts5(
+                    content, content='memories', content_rowid='rowid',
+                    tokenize='trigram'
+                )
+            """)
+        except sqlite3.OperationalError:
+            # SQLite 未编译 FTS5
+            return False
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+                INSERT INTO memories_fts(rowid, content) VALUES (new.rowid, new.content);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+                INSERT INTO memories_fts(memories_fts, rowid, content)
+                VALUES ('delete', old.rowid, old.content);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF content ON memories BEGIN
+                INSERT INTO memories_fts(memories_fts, rowid, content)
+                VALUES ('delete', old.rowid, old.content);
+                INSERT INTO memories_fts(rowid, content) VALUES (new.rowid, new.content);
+            END
+        """)
+        # 回填已有记忆
+        conn.execute("INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')")
+        return True
+    
+    def vacuum(self):
+        """
+        整理数据库文件, 然后重建全文索引
+        
+        VACUUM 可能重新编号 memories 的 rowid, 全文索引不重建就会指向别的行。
+        两步之间的检索可能返回错位的结果。
+        """
+        self.engine.connection().execute("VACUUM")
+        if self.fts:
+            with self.engine.transaction() as conn:
+                conn.execute("INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')")
     
     def record_task(self, task_id: str, task_type: str, description: str,
                     status: str = "pending", result: Any = None, metadata: dict = None):
         """记录任务"""
         now = datetime.now().isoformat()
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self.engine.transaction() as conn:
             conn.execute("""
                 INSERT OR REPLACE INTO task_history
                 (id, type, description, status, created_at, completed_at, result, metadata)
@@ -164,13 +497,12 @@ class MediumTermMemory:
                 json.dumps(result) if result else None,
                 json.dumps(metadata) if metadata else None
             ))
-            conn.commit()
     
     def update_task(self, task_id: str, status: str, result: Any = None):
         """更新任务状态"""
         now = datetime.now().isoformat()
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self.engine.transaction() as conn:
             conn.execute("""
                 UPDATE task_history
                 SET status = ?, completed_at = ?, result = ?
@@ -180,93 +512,255 @@ class MediumTermMemory:
                 json.dumps(result) if result else None,
                 task_id
             ))
-            conn.commit()
     
     def get_recent_tasks(self, limit: int = 100, task_type: str = None) -> List[dict]:
         """获取最近的任务"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            if task_type:
-                rows = conn.execute("""
-                    SELECT * FROM task_history
-                    WHERE type = ?
-                    ORDER BY created_at DESC LIMIT ?
-                """, (task_type, limit)).fetchall()
-            else:
-                rows = conn.execute("""
-                    SELECT * FROM task_history
-                    ORDER BY created_at DESC LIMIT ?
-                """, (limit,)).fetchall()
-            
-            return [dict(row) for row in rows]
+        conn = self.engine.connection()
+        
+        if task_type:
+            rows = conn.execute("""
+                SELECT * FROM task_history
+                WHERE type = ?
+                ORDER BY created_at DESC LIMIT ?
+            """, (task_type, limit)).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT * FROM task_history
+                ORDER BY created_at DESC LIMIT ?
+            """, (limit,)).fetchall()
+        
+        return [dict(row) for row in rows]
+    
+    # 用 upsert 而不是 INSERT OR REPLACE: REPLACE 会换 rowid 且不触发删除触发器,
+    # 全文索引会残留旧内容
+    _STORE_MEMORY_SQL = """
+        INSERT INTO memories
+        (id, content, memory_type, importance, source, created_at, 
+         last_accessed, access_count, metadata, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            content = excluded.content,
+            content_hash = excluded.content_hash,
+            memory_type = excluded.memory_type,
+            importance = excluded.importance,
+            source = excluded.source,
+            created_at = excluded.created_at,
+            last_accessed = excluded.last_accessed,
+            access_count = excluded.access_count,
+            metadata = excluded.metadata
+    """
+    
+    @classmethod
+    def heat_weight(cls, ts: Optional[float] = None) -> float:
+        """时刻 ts (默认现在) 的一次访问计入 heat 列的量"""
+        if ts is None:
+            ts = time.time()
+        return 2.0 ** ((ts - cls.HEAT_EPOCH) / cls.HEAT_HALF_LIFE)
+    
+    @classmethod
+    def _heat_weight_at(cls, timestamp: Optional[str]) -> float:
+        try:
+            return cls.heat_weight(datetime.fromisoformat(timestamp).timestamp())
+        except (TypeError, ValueError):
+            return cls.heat_weight()
+    
+    def touch(self, ids: List[str]):
+        """记录一次访问: 访问计数 +1, 热度累加"""
+        if not ids:
+            return
+        with self.engine.transaction() as conn:
+            conn.execute(f"""
+                UPDATE memories
+                SET access_count = access_count + 1, last_accessed = ?, heat = heat + ?
+                WHERE id IN ({",".join("?" * len(ids))})
+            """, [datetime.now().isoformat(), self.heat_weight(), *ids])
+    
+    @staticmethod
+    def _memory_row(entry: MemoryEntry) -> tuple:
+        return (
+            entry.id, entry.content, entry.memory_type, entry.importance,
+            entry.source, entry.timestamp, entry.timestamp,
+            entry.access_count, json.dumps(entry.metadata), content_hash(entry.content)
+        )
     
     def store_memory(self, entry: MemoryEntry):
         """存储记忆"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.engine.transaction() as conn:
+            conn.execute(self._STORE_MEMORY_SQL, self._memory_row(entry))
+    
+    def bulk_store_memories(self, entries: List[MemoryEntry]) -> int:
+        """在一个事务中批量存储记忆, 返回写入条数"""
+        with self.engine.transaction() as conn:
+            conn.executemany(self._STORE_MEMORY_SQL, map(self._memory_row, entries))
+        return len(entries)
+    
+    def find_duplicate(self, content: str) -> Optional[str]:
+        """返回规范化后内容相同的已有记忆 ID"""
+        row = self.engine.connection().execute(
+            "SELECT id FROM memories WHERE content_hash = ? LIMIT 1", (content_hash(content),)
+        ).fetchone()
+        return row["id"] if row else None
+    
+    def merge_duplicate(self, entry: MemoryEntry, boost: float) -> Optional[MemoryEntry]:
+        """
+        内容相同的记忆已存在时, 把 entry 合并进去
+        
+        已有条目的重要性取两者较大值再加 boost (不超过 1.0), 并记一次访问。
+        
+        Returns:
+            合并后的已有条目; 没有重复时返回 None (entry 不会被写入)
+        """
+        digest = content_hash(entry.content)
+        with self.engine.transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM memories WHERE content_hash = ? LIMIT 1", (digest,)
+            ).fetchone()
+            if row is None:
+                return None
             conn.execute("""
-                INSERT OR REPLACE INTO memories
-                (id, content, memory_type, importance, source, created_at, 
-                 last_accessed, access_count, metadata)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                entry.id, entry.content, entry.memory_type, entry.importance,
-                entry.source, entry.timestamp, entry.timestamp,
-                entry.access_count, json.dumps(entry.metadata)
-            ))
-            conn.commit()
+                UPDATE memories
+                SET importance = min(1.0, max(importance, ?) + ?),
+                    access_count = access_count + 1, last_accessed = ?, heat = heat + ?
+                WHERE id = ?
+            """, (entry.importance, boost, datetime.now().isoformat(),
+                  self.heat_weight(), row["id"]))
+            merged = conn.execute("SELECT * FROM memories WHERE id = ?", (row["id"],)).fetchone()
+        return self._row_to_entry(merged)
     
-    def search_memories(self, query: str, memory_type: str = None, 
-                        limit: int = 10) -> List[MemoryEntry]:
-        """搜索记忆 (简单文本匹配)"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            search_pattern = f"%{query}%"
-            
-            if memory_type:
-                rows = conn.execute("""
-                    SELECT * FROM memories
-                    WHERE content LIKE ? AND memory_type = ?
-                    ORDER BY importance DESC, last_accessed DESC
-                    LIMIT ?
-                """, (search_pattern, memory_type, limit)).fetchall()
-            else:
-                rows = conn.execute("""
-                    SELECT * FROM memories
-                    WHERE content LIKE ?
-                    ORDER BY importance DESC, last_accessed DESC
-                    LIMIT ?
-                """, (search_pattern, limit)).fetchall()
-            
-            results = []
-            for row in rows:
-                # 更新访问计数
+    def dedup(self, prefer: Optional[set] = None) -> Dict[str, str]:
+        """
+        合并已有数据中内容相同的记忆 (一次性整理)
+        
+        每组保留一条: 优先 prefer 中的 ID (如已在 L3 的记忆), 其次最早创建的。
+        保留条目的重要性取组内最大值, 访问计数和热度累加。
+        
+        Returns:
+            {被合并删除的 ID: 保留的 ID}
+        """
+        prefer = prefer or set()
+        digests = [row[0] for row in self.engine.connection().execute("""
+            SELECT content_hash FROM memories WHERE content_hash IS NOT NULL
+            GROUP BY content_hash HAVING COUNT(*) > 1
+        """)]
+        
+        merged: Dict[str, str] = {}
+        # 每组一个短事务
+        for digest in digests:
+            with self.engine.transaction() as conn:
+                rows = conn.execute(
+                    "SELECT * FROM memories WHERE content_hash = ? ORDER BY created_at, rowid",
+                    (digest,)
+                ).fetchall()
+                if len(rows) < 2:
+                    continue
+                rows.sort(key=lambda r: r["id"] not in prefer)
+                keep, duplicates = rows[0], rows[1:]
                 conn.execute("""
                     UPDATE memories
-                    SET access_count = access_count + 1, last_accessed = ?
+                    SET importance = ?, access_count = ?, heat = ?, last_accessed = ?
                     WHERE id = ?
-                """, (datetime.now().isoformat(), row["id"]))
-                
-                results.append(MemoryEntry(
-                    id=row["id"],
-                    content=row["content"],
-                    memory_type=row["memory_type"],
-                    importance=row["importance"],
-                    source=row["source"],
-                    timestamp=row["created_at"],
-                    metadata=json.loads(row["metadata"]) if row["metadata"] else {},
-                    access_count=row["access_count"] + 1
+                """, (
+                    max(r["importance"] for r in rows),
+                    sum(r["access_count"] or 0 for r in rows),
+                    sum(r["heat"] for r in rows),
+                    max(r["last_accessed"] or "" for r in rows),
+                    keep["id"]
                 ))
-            
-            conn.commit()
-            return results
+                ids = [r["id"] for r in duplicates]
+                conn.execute(f"DELETE FROM memories WHERE id IN ({','.join('?' * len(ids))})", ids)
+                merged.update((i, keep["id"]) for i in ids)
+        return merged
+    
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> MemoryEntry:
+        return MemoryEntry(
+            id=row["id"],
+            content=row["content"],
+            memory_type=row["memory_type"],
+            importance=row["importance"],
+            source=row["source"],
+            timestamp=row["created_at"],
+            metadata=json.loads(row["metadata"]) if row["metadata"] else {},
+            access_count=row["access_count"]
+        )
+    
+    @staticmethod
+    def _like_snippet(content: str, term: str, width: int = 16) -> str:
+        pos = content.lower().find(term.lower()) if term else -1
+        if pos < 0:
+            return content[:width * 2]
+        start = max(0, pos - width)
+        end = pos + len(term)
+        return ("…" if start else "") + content[start:pos] + \
+            f"[{content[pos:end]}]" + content[end:end + width] + \
+            ("…" if end + width < len(content) else "")
+    
+    def search(self, query: str, memory_type: str = None,
+               limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        全文检索记忆, 按 BM25 相关度排序
+        
+        查询按空白切分为词, 所有词都须出现 (AND)。长度不小于 FTS_MIN_TERM 的词走
+        全文索引, 更短的词在索引结果上用 LIKE 过滤; 全部是短词时退回 LIKE 扫描。
+        
+        Returns:
+            [{"entry": MemoryEntry, "score": 相关度 (越大越相关), "snippet": 命中片段}]
+        """
+        terms = query.split()
+        indexed = [t for t in terms if len(t) >= self.FTS_MIN_TERM] if self.fts else []
+        filters = [t for t in terms if t not in indexed]
+        params: List[Any] = []
+        
+        if indexed:
+            sql = """
+                SELECT m.*, -bm25(memories_fts) AS score,
+                       snippet(memories_fts, 0, '[', ']', '…', 16) AS snippet
+                FROM memories_fts JOIN memories m ON m.rowid = memories_fts.rowid
+                WHERE memories_fts MATCH ?
+            """
+            params.append(" ".join('"' + t.replace('"', '""') + '"' for t in indexed))
+            order = "ORDER BY score DESC, m.importance DESC"
+        else:
+            sql = "SELECT m.*, 0.0 AS score, NULL AS snippet FROM memories m WHERE 1"
+            order = "ORDER BY m.importance DESC, m.last_accessed DESC"
+        
+        for term in filters:
+            sql += " AND m.content LIKE ?"
+            params.append(f"%{term}%")
+        if memory_type:
+            sql += " AND m.memory_type = ?"
+            params.append(memory_type)
+        sql += f" {order} LIMIT ?"
+        params.append(limit)
+        
+        # 查询在 WAL 快照上进行, 不占用写锁
+        rows = self.engine.connection().execute(sql, params).fetchall()
+        if not rows:
+            return []
+        
+        # 一条语句批量更新访问计数和热度
+        self.touch([row["id"] for row in rows])
+        
+        results = []
+        for row in rows:
+            entry = self._row_to_entry(row)
+            entry.access_count += 1
+            snippet = row["snippet"]
+            if snippet is None:
+                snippet = self._like_snippet(entry.content, filters[0] if filters else "")
+            results.append({"entry": entry, "score": row["score"], "snippet": snippet})
+        return results
+    
+    def search_memories(self, query: str, memory_type: str = None, 
+                        limit: int = 10) -> List[MemoryEntry]:
+        """搜索记忆 (全文检索, 见 search)"""
+        return [r["entry"] for r in self.search(query, memory_type, limit)]
     
     def save_session_summary(self, session_id: str, summary: str, key_points: List[str]):
         """保存会话摘要"""
         now = datetime.now()
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self.engine.transaction() as conn:
             conn.execute("""
                 INSERT INTO session_summaries
                 (id, session_id, date, summary, key_points, created_at)
@@ -276,27 +770,23 @@ class MediumTermMemory:
                 session_id, now.date().isoformat(), summary,
                 json.dumps(key_points), now.isoformat()
             ))
-            conn.commit()
     
     def compress(self, days_old: int = 30):
         """压缩旧数据"""
         cutoff = (datetime.now() - timedelta(days=days_old)).isoformat()
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self.engine.transaction() as conn:
             # 删除旧的已处理任务
-            conn.execute("""
+            deleted = conn.execute("""
                 DELETE FROM task_history
                 WHERE status = 'completed' AND completed_at < ?
-            """, (cutoff,))
+            """, (cutoff,)).rowcount
             
-            # 删除不重要的旧记忆
-            conn.execute("""
+            # 删除不重要、近期也没有被访问的旧记忆
+            deleted += conn.execute("""
                 DELETE FROM memories
-                WHERE importance < 0.3 AND created_at < ?
-            """, (cutoff,))
-            
-            deleted = conn.total_changes
-            conn.commit()
+                WHERE importance < 0.3 AND created_at < ? AND heat < ?
+            """, (cutoff, self.COLD_HEAT * self.heat_weight())).rowcount
         
         return deleted
 
@@ -304,88 +794,834 @@ class MediumTermMemory:
 # L3: 长期记忆 (向量存储 - 简化版)
 # ============================================================================
 
+class VectorStore:
+    """
+    单文件向量存储 - 所有 embedding 追加到一个 float32 矩阵文件, 通过 mmap 读取
+    
+    布局 (<prefix> 为文件前缀):
+        <prefix>.f32      行优先的 float32 矩阵, 每行一个归一化后的向量
+        <prefix>.ids      与矩阵行一一对应的记忆 ID, 每行一个
+        <prefix>.json     维度等元数据
+        <prefix>.ivf.npz  可选的 IVF 近似索引 (聚类中心 + 按簇排序的行号)
+    
+    写入只追加; 同一 ID 重复写入时以最后一行为准, 删除是追加一行墓碑 (ID 前加
+    TOMBSTONE 前缀, 向量全零)。向量写入前归一化, 点积即余弦相似度。有 NumPy 时整块矩阵乘法, 否则退回纯 Python 逐行计算。
+    
+    行号 -> ID 表在第一次检索/读取时才载入内存; add 只需知道行数 (从上次计数处
+    往后数换行), read_row 按行号直接读取, 这两者都不载入 ID 表。
+    
+    行数达到 IVF_THRESHOLD 后 search 使用 IVF 索引, 只扫描与查询最近的
+    IVF_NPROBE 个簇; 建索引之后追加的行在索引之外精确扫描, 积累到
+    IVF_REBUILD_RATIO 后重建。search 从不在锁内跑 k-means: 索引缺失或过旧时
+    在后台线程里 (重新) 建立, 建好之前继续用旧索引, 没有索引就精确扫描。
+    build_index 可以提前同步建立。
+    """
+    
+    IVF_THRESHOLD = 50_000
+    IVF_NPROBE = 8
+    IVF_ITERATIONS = 10
+    IVF_REBUILD_RATIO = 0.5
+    TOMBSTONE = "-"
+    # 分块计算, 限制建索引时的内存占用
+    _CHUNK_ROWS = 65536
+    
+    def __init__(self, prefix: Path):
+        self.data_path = Path(f"{prefix}.f32")
+        self.ids_path = Path(f"{prefix}.ids")
+        self.meta_path = Path(f"{prefix}.json")
+        self.ivf_path = Path(f"{prefix}.ivf.npz")
+        
+        self.dim: Optional[int] = None
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)["dim"]
+        
+        self._ids: List[str] = []
+        self._latest: Dict[str, int] = {}
+        # 被同 ID 后续写入覆盖或删除的行, 以及墓碑行
+        self._stale: List[int] = []
+        self._ids_offset = 0
+        # ids 文件中 _count_offset 之前有 _count 个完整行 (不载入 ID 表的行计数)
+        self._count = 0
+        self._count_offset = 0
+        self._ivf = None
+        self._ivf_mtime = None
+        # 正在后台建立 IVF 索引的线程
+        self._ivf_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    # ---- 写入 ----
+    
+    @staticmethod
+    def _normalize(vector: List[float]) -> List[float]:
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else list(vector)
+    
+    def add(self, memory_id: str, vector: List[float]) -> int:
+        """追加一个向量, 返回其行号"""
+        vector = self._normalize(vector)
+        with self._lock, open(self.ids_path, 'ab') as ids:
+            fcntl.flock(ids.fileno(), fcntl.LOCK_EX)
+            if self.dim is None:
+                self._init_dim(len(vector))
+            if len(vector) != self.dim:
+                raise ValueError(f"Embedding dimension {len(vector)} != {self.dim}")
+            return self._append(ids, memory_id, vector)
+    
+    def remove(self, memory_id: str) -> bool:
+        """删除一个向量 (追加墓碑), 返回是否存在"""
+        with self._lock, open(self.ids_path, 'ab') as ids:
+            fcntl.flock(ids.fileno(), fcntl.LOCK_EX)
+            self._refresh()
+            if memory_id not in self._latest:
+                return False
+            self._append(ids, self.TOMBSTONE + memory_id, [0.0] * self.dim)
+            return True
+    
+    def _append(self, ids, line: str, vector: List[float]) -> int:
+        """在 ids 文件锁内追加一行向量和对应的 ID, 返回行号"""
+        rows = self._count_rows(ids)
+        row_bytes = self.dim * 4
+        with open(self.data_path, 'ab') as data:
+            # 上次写入在 ID 落盘前中断时, 丢弃多出的半截行
+            if data.tell() != rows * row_bytes:
+                data.truncate(rows * row_bytes)
+            data.write(array('f', vector).tobytes())
+        encoded = line.encode('utf-8') + b"\n"
+        ids.write(encoded)
+        ids.flush()
+        self._count += 1
+        self._count_offset += len(encoded)
+        return rows
+    
+    def _count_rows(self, ids) -> int:
+        """
+        ids 文件中完整的行数 (调用方持有 ids 文件锁)
+        
+        只读上次计数之后新增的部分。文件末尾没有换行的半个 ID 是写入中断留下的,
+        截掉, 否则下一行会接在它后面。
+        """
+        if self._ids_offset > self._count_offset:
+            self._count, self._count_offset = len(self._ids), self._ids_offset
+        end = pos = self._count_offset
+        with open(self.ids_path, 'rb') as f:
+            f.seek(pos)
+            while True:
+                block = f.read(1 << 20)
+                if not block:
+                    break
+                lines = block.count(b"\n")
+                if lines:
+                    self._count += lines
+                    end = pos + block.rfind(b"\n") + 1
+                pos += len(block)
+        if pos != end:
+            ids.truncate(end)
+        self._count_offset = end
+        return self._count
+    
+    def _init_dim(self, dim: int):
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)["dim"]
+            return
+        self.dim = dim
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({"dim": dim, "dtype": "float32"}, f)
+    
+    # ---- 读取 ----
+    
+    def _refresh(self):
+        """读入其他进程 (或本进程) 新追加的 ID"""
+        try:
+            size = self.ids_path.stat().st_size
+        except FileNotFoundError:
+            return
+        if size <= self._ids_offset:
+            return
+        with open(self.ids_path, 'rb') as f:
+            f.seek(self._ids_offset)
+            chunk = f.read(size - self._ids_offset)
+        # 只处理完整的行
+        chunk = chunk[:chunk.rfind(b"\n") + 1]
+        self._ids_offset += len(chunk)
+        for line in chunk.splitlines():
+            memory_id = line.decode('utf-8')
+            row = len(self._ids)
+            self._ids.append(memory_id)
+            if memory_id.startswith(self.TOMBSTONE):
+                memory_id = memory_id[len(self.TOMBSTONE):]
+                self._stale.append(row)
+                row = None
+            previous = self._latest.pop(memory_id, None)
+            if previous is not None:
+                self._stale.append(previous)
+            if row is not None:
+                self._latest[memory_id] = row
+    
+    def _rows(self) -> int:
+        self._refresh()
+        if not self.dim or not self.data_path.exists():
+            return 0
+        return min(len(self._ids), self.data_path.stat().st_size // (self.dim * 4))
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._rows() - len(self._stale)
+    
+    def __contains__(self, memory_id: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return memory_id in self._latest
+    
+    def read_row(self, row: int) -> Optional[List[float]]:
+        """按行号读取一个 (归一化后的) 向量, 不载入 ID 表; 行号由 add 返回"""
+        if not self.dim:
+            return None
+        row_bytes = self.dim * 4
+        try:
+            with open(self.data_path, 'rb') as f:
+                data = os.pread(f.fileno(), row_bytes, row * row_bytes)
+        except FileNotFoundError:
+            return None
+        return array('f', data).tolist() if len(data) == row_bytes else None
+    
+    def get(self, memory_id: str) -> Optional[List[float]]:
+        """读取一个 (归一化后的) 向量"""
+        with self._lock:
+            self._refresh()
+            row = self._latest.get(memory_id)
+            if row is None or row >= self._rows():
+                return None
+            row_bytes = self.dim * 4
+            with open(self.data_path, 'rb') as f:
+                data = os.pread(f.fileno(), row_bytes, row * row_bytes)
+        return array('f', data).tolist()
+    
+    def search(self, query: List[float], k: int = 10,
+               exact: bool = False) -> List[tuple]:
+        """
+        余弦相似度 top-k
+        
+        Args:
+            query: 查询向量
+            k: 返回条数
+            exact: 为 True 时不使用 IVF 近似索引
+        
+        Returns:
+            [(记忆 ID, 相似度)], 按相似度降序
+        """
+        with self._lock:
+            n = self._rows()
+            if n == 0 or k <= 0:
+                return []
+            if len(query) != self.dim:
+                raise ValueError(f"Query dimension {len(query)} != {self.dim}")
+            query = self._normalize(query)
+            if HAS_NUMPY:
+                hits = self._search_numpy(query, k, n, exact)
+            else:
+                hits = self._search_python(query, k, n)
+            return [(self._ids[row], score) for row, score in hits]
+    
+    def _search_python(self, query: List[float], k: int, n: int) -> List[tuple]:
+        stale = set(self._stale)
+        dim = self.dim
+        with open(self.data_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            with memoryview(buf) as raw, raw[:n * dim * 4].cast('f') as matrix:
+                scored = (
+                    (sum(map(operator.mul, query, matrix[row * dim:(row + 1) * dim])), row)
+                    for row in range(n) if row not in stale
+                )
+                top = heapq.nlargest(k, scored)
+        return [(row, score) for score, row in top]
+    
+    def _search_numpy(self, query: List[float], k: int, n: int, exact: bool) -> List[tuple]:
+        matrix = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(n, self.dim))
+        q = np.asarray(query, dtype=np.float32)
+        
+        rows = None
+        ivf = self._load_ivf(n) if not exact and n >= self.IVF_THRESHOLD else None
+        if ivf is not None:
+            # 最近的 nprobe 个簇 + 建索引之后追加的行
+            centroid_scores = ivf["centroids"] @ q
+            probe = np.argsort(-centroid_scores)[:self.IVF_NPROBE]
+            order, offsets = ivf["order"], ivf["offsets"]
+            parts = [order[offsets[c]:offsets[c + 1]] for c in probe]
+            parts.append(np.arange(int(ivf["rows"]), n))
+            rows = np.sort(np.concatenate(parts))
+        
+        scores = (matrix[rows] if rows is not None else matrix) @ q
+        if self._stale:
+            stale = np.asarray(self._stale)
+            if rows is None:
+                scores[stale] = -np.inf
+            else:
+                scores[np.isin(rows, stale)] = -np.inf
+        
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]) if rows is not None else int(i), float(scores[i]))
+                for i in top if scores[i] != -np.inf]
+    
+    # ---- IVF 近似索引 (需要 NumPy) ----
+    
+    def _load_ivf(self, n: int):
+        """
+        当前可用的 IVF 索引 (调用方持有 _lock)
+        
+        索引缺失或过旧时启动后台重建, 本次照旧返回已有的索引 (可能为 None)。
+        """
+        try:
+            mtime = self.ivf_path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime != self._ivf_mtime:
+            with np.load(self.ivf_path) as data:
+                self._ivf = {key: data[key] for key in data.files}
+            self._ivf_mtime = mtime
+        
+        if self._ivf is None or \
+                n - int(self._ivf["rows"]) > int(self._ivf["rows"]) * self.IVF_REBUILD_RATIO:
+            if self._ivf_thread is None:
+                self._ivf_thread = threading.Thread(
+                    target=self._rebuild_ivf, args=(n,), name="ivf-build", daemon=True
+                )
+                self._ivf_thread.start()
+        return self._ivf
+    
+    def _rebuild_ivf(self, n: int):
+        """后台线程: 建立前 n 行的索引, 期间 search 不受阻塞"""
+        try:
+            ivf = self._build_ivf(n)
+            with self._lock:
+                if self._ivf is None or int(self._ivf["rows"]) < n:
+                    self._save_ivf(ivf)
+        finally:
+            with self._lock:
+                self._ivf_thread = None
+    
+    def build_index(self):
+        """立即 (重新) 建立 IVF 索引; k-means 在锁外进行, 不阻塞 search"""
+        if not HAS_NUMPY:
+            raise RuntimeError("IVF index requires numpy")
+        with self._lock:
+            n = self._rows()
+        if n:
+            ivf = self._build_ivf(n)
+            with self._lock:
+                self._save_ivf(ivf)
+    
+    def _build_ivf(self, n: int) -> Dict[str, Any]:
+        """球面 k-means: 在采样上迭代聚类中心, 再分块把所有行分配到最近的簇"""
+        matrix = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(n, self.dim))
+        nlist = max(1, int(math.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(matrix[np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        
+        for _ in range(self.IVF_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # 空簇保留原中心
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, self._CHUNK_ROWS):
+            end = min(n, start + self._CHUNK_ROWS)
+            assign[start:end] = np.argmax(matrix[start:end] @ centroids.T, axis=1)
+        order = np.argsort(assign, kind='stable')
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+        
+        return {"centroids": centroids.astype(np.float32), "order": order,
+                "offsets": offsets, "rows": np.int64(n)}
+    
+    def _save_ivf(self, ivf: Dict[str, Any]):
+        """启用并保存索引 (调用方持有 _lock)"""
+        self._ivf = ivf
+        tmp = self.ivf_path.with_name(f".{self.ivf_path.name}.tmp.npz")
+        np.savez(tmp, **ivf)
+        os.replace(tmp, self.ivf_path)
+        self._ivf_mtime = self.ivf_path.stat().st_mtime
+
+
 class LongTermMemory:
-    """长期记忆 - 语义搜索存储"""
+    """
+    长期记忆 - 语义搜索存储
+    
+    每条记忆一个 <id>.json 内容文件; 索引 (index.ndjson) 和 embedding (VectorStore)
+    都只追加写入, 插入代价与已有记忆数量无关。删除时向索引追加 {"id", "deleted": true}。
+    
+    索引项带内容的 SimHash 指纹; 指纹按 16 位分成 4 段建倒排, 海明距离不超过
+    NEAR_DUP_BITS (≤ 3) 的指纹至少有一段相同, 近似重复检测只需比较同段的候选。
+    短文本的指纹区分度有限 (只差一个数字的两句话也可能落在阈值内), 候选再用
+    3-gram Jaccard 相似度 (≥ NEAR_DUP_SIMILARITY) 确认。
+    
+    索引项和指纹倒排在第一次用到时载入, 之后常驻内存, 占用与记忆条数成正比
+    (每条约 1.5 KB)。import_entries 直接追加 index.ndjson, 并释放已载入的索引,
+    下次用到时重新载入。索引、指纹倒排等内存结构由 _lock 保护 (TieringJob 的
+    后台线程与 remember/recall 并发读写); 遍历索引请用 metas() 取快照。
+    
+    内容文件记录 embedding 在向量存储中的行号 (vector_row), 导出时按行号直接
+    读取向量, 不需要载入向量 ID 表。
+    """
+    
+    NEAR_DUP_BITS = 3
+    NEAR_DUP_SIMILARITY = 0.9
+    # 目录中不是记忆内容的 .json 文件
+    _RESERVED_FILES = ("index", "vectors")
+    _BAND_BITS = 16
     
     def __init__(self, storage_path: str = "~/clawos/memory/longterm"):
         self.storage_path = Path(storage_path).expanduser()
         self.storage_path.mkdir(parents=True, exist_ok=True)
-        self.index_path = self.storage_path / "index.json"
-        self._load_index()
+        self.index_path = self.storage_path / "index.ndjson"
+        self.vectors = VectorStore(self.storage_path / "vectors")
+        # 可重入: merge / dedup 内部还会调用 _append_index、remove 等
+        self._lock = threading.RLock()
+        legacy = self.storage_path / "index.json"
+        if legacy.exists() and not self.index_path.exists():
+            self._migrate_legacy_index(legacy)
+        self._unload_index()
+    
+    @property
+    def index(self) -> Dict[str, Any]:
+        """{"memories": 按写入位置排列的索引项, "updated": 最后更新时间}"""
+        with self._lock:
+            self._ensure_index()
+            return self._index
+    
+    def _ensure_index(self):
+        """按需载入索引 (调用方持有 _lock)"""
+        if self._positions is None:
+            self._load_index()
+    
+    def _unload_index(self):
+        """释放内存中的索引, 下次用到时从 index.ndjson 重新载入"""
+        with self._lock:
+            self._index: Optional[Dict[str, Any]] = None
+            self._positions: Optional[Dict[str, int]] = None
+            self._fingerprints: Dict[str, int] = {}
+            self._bands: List[Dict[int, set]] = []
     
     def _load_index(self):
         """加载索引"""
-        if self.index_path.exists():
+        with self._lock:
+            self._index = {"memories": [], "updated": None}
+            # ID -> 在 index["memories"] 中的位置
+            self._positions: Dict[str, int] = {}
+            self._fingerprints: Dict[str, int] = {}
+            self._bands: List[Dict[int, set]] = \
+                [{} for _ in range(SIMHASH_BITS // self._BAND_BITS)]
+            if not self.index_path.exists():
+                return
+            memories: Dict[str, Dict] = {}
             with open(self.index_path, 'r', encoding='utf-8') as f:
-                self.index = json.load(f)
-        else:
-            self.index = {"memories": [], "updated": None}
+                for line in f:
+                    try:
+                        meta = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中断留下的半行
+                        continue
+                    # 同一 ID 以最后一行为准, 更新不改变位置; 删除后重新写入的排在末尾
+                    if meta.get("deleted"):
+                        memories.pop(meta["id"], None)
+                    else:
+                        memories[meta["id"]] = meta
+            self._index["memories"] = list(memories.values())
+            self._positions = {memory_id: i for i, memory_id in enumerate(memories)}
+            for meta in self._index["memories"]:
+                if "simhash" in meta:
+                    self._index_fingerprint(meta["id"], int(meta["simhash"], 16))
     
-    def _save_index(self):
-        """保存索引"""
-        self.index["updated"] = datetime.now().isoformat()
-        with open(self.index_path, 'w', encoding='utf-8') as f:
-            json.dump(self.index, f, indent=2, ensure_ascii=False)
+    def _migrate_legacy_index(self, legacy: Path):
+        """旧版 index.json (每次插入整体重写) 转为 index.ndjson, 并把内容文件里的 embedding 导入向量存储"""
+        with open(legacy, 'r', encoding='utf-8') as f:
+            memories = json.load(f).get("memories", [])
+        
+        tmp = self.index_path.with_name(f".{self.index_path.name}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as out:
+            for meta in memories:
+                out.write(json.dumps(meta, ensure_ascii=False) + "\n")
+                if not meta.get("has_embedding") or meta["id"] in self.vectors:
+                    continue
+                memory_file = self.storage_path / f"{meta['id']}.json"
+                if memory_file.exists():
+                    with open(memory_file, 'r', encoding='utf-8') as f:
+                        embedding = json.load(f).get("embedding")
+                    if embedding:
+                        self.vectors.add(meta["id"], embedding)
+        os.replace(tmp, self.index_path)
+        legacy.rename(legacy.with_name("index.json.migrated"))
     
-    def store(self, entry: MemoryEntry, embedding: List[float] = None):
-        """存储长期记忆"""
-        # 保存记忆内容
-        memory_file = self.storage_path / f"{entry.id}.json"
-        with open(memory_file, 'w', encoding='utf-8') as f:
+    def _append_index(self, meta: Dict[str, Any]):
+        """追加一条索引; 已有的 ID 原位替换"""
+        with self._lock:
+            self._ensure_index()
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+            pos = self._positions.get(meta["id"])
+            if pos is None:
+                self._positions[meta["id"]] = len(self._index["memories"])
+                self._index["memories"].append(meta)
+            else:
+                self._index["memories"][pos] = meta
+            if "simhash" in meta:
+                self._index_fingerprint(meta["id"], int(meta["simhash"], 16))
+            self._index["updated"] = datetime.now().isoformat()
+    
+    def __contains__(self, memory_id: str) -> bool:
+        with self._lock:
+            self._ensure_index()
+            return memory_id in self._positions
+    
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_index()
+            return len(self._positions)
+    
+    def _meta(self, memory_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_index()
+            pos = self._positions.get(memory_id)
+            return None if pos is None else self._index["memories"][pos]
+    
+    def metas(self, start: int = 0, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+        """索引项 (按写入位置) 的快照, 遍历期间其他线程的写入不影响它"""
+        with self._lock:
+            self._ensure_index()
+            return self._index["memories"][start:stop]
+    
+    def remove(self, memory_ids: List[str]) -> int:
+        """删除记忆 (内容文件、embedding, 并追加索引墓碑), 返回删除条数"""
+        with self._lock:
+            self._ensure_index()
+            memory_ids = [i for i in dict.fromkeys(memory_ids) if i in self._positions]
+            if not memory_ids:
+                return 0
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                for memory_id in memory_ids:
+                    f.write(json.dumps({"id": memory_id, "deleted": True}) + "\n")
+            
+            removed = set(memory_ids)
+            self._index["memories"] = [m for m in self._index["memories"] if m["id"] not in removed]
+            self._positions = {m["id"]: i for i, m in enumerate(self._index["memories"])}
+            for memory_id in memory_ids:
+                self._unindex_fingerprint(memory_id)
+            self._index["updated"] = datetime.now().isoformat()
+        
+        for memory_id in memory_ids:
+            self.vectors.remove(memory_id)
+            (self.storage_path / f"{memory_id}.json").unlink(missing_ok=True)
+        return len(memory_ids)
+    
+    def iter_entries(self) -> Iterator[MemoryEntry]:
+        """逐个读取内容文件 (不经过内存中的索引), 供导出等全量遍历使用"""
+        for entry, _ in self._iter_files():
+            yield entry
+    
+    def iter_with_embeddings(self) -> Iterator[Tuple[MemoryEntry, Optional[List[float]]]]:
+        """
+        逐个读取内容文件及其 embedding, 不载入索引
+        
+        embedding 按内容文件记录的行号读取; 旧版本写入的内容文件没有行号, 这时
+        退回按 ID 查找 (会载入向量 ID 表)。
+        """
+        for entry, data in self._iter_files():
+            if "vector_row" not in data:
+                yield entry, self.vectors.get(entry.id)
+            elif data["vector_row"] is None:
+                yield entry, None
+            else:
+                yield entry, self.vectors.read_row(data["vector_row"])
+    
+    def _iter_files(self) -> Iterator[Tuple[MemoryEntry, Dict[str, Any]]]:
+        with os.scandir(self.storage_path) as it:
+            for item in it:
+                memory_id, ext = os.path.splitext(item.name)
+                if ext != ".json" or memory_id in self._RESERVED_FILES or not item.is_file():
+                    continue
+                try:
+                    with open(item.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    yield MemoryEntry(**data["entry"]), data
+                except (OSError, ValueError, KeyError, TypeError):
+                    # 写入中的文件或其他 JSON
+                    continue
+    
+    def _entry_path(self, memory_id: str) -> str:
+        # 每条记忆一次的路径拼接不经过 pathlib: 它会驻留 (intern) 每个文件名,
+        # 批量导入时驻留表随条数增长
+        return os.path.join(self.storage_path, f"{memory_id}.json")
+    
+    def _read_file(self, memory_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._entry_path(memory_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # 不存在, 或已被其他线程删除
+            return None
+    
+    def _load_entry(self, memory_id: str) -> Optional[MemoryEntry]:
+        data = self._read_file(memory_id)
+        return None if data is None else MemoryEntry(**data["entry"])
+    
+    def _write_entry(self, entry: MemoryEntry, vector_row: Optional[int]):
+        # 先写临时文件再替换, 并发读取的线程不会读到写了一半的内容
+        memory_file = self._entry_path(entry.id)
+        tmp = os.path.join(self.storage_path, f".{entry.id}.json.{threading.get_ident()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump({
                 "entry": entry.to_dict(),
-                "embedding": embedding
+                "vector_row": vector_row
             }, f, indent=2, ensure_ascii=False)
-        
-        # 更新索引
-        self.index["memories"].append({
+        os.replace(tmp, memory_file)
+    
+    @staticmethod
+    def _entry_meta(entry: MemoryEntry, **extra) -> Dict[str, Any]:
+        return {
             "id": entry.id,
             "type": entry.memory_type,
             "importance": entry.importance,
             "timestamp": entry.timestamp,
-            "has_embedding": embedding is not None
-        })
-        self._save_index()
+            **extra,
+            "simhash": f"{simhash(entry.content):016x}"
+        }
     
-    def search_by_keywords(self, keywords: List[str], limit: int = 10) -> List[MemoryEntry]:
-        """关键词搜索 (简化版，实际应使用向量搜索)"""
+    def store(self, entry: MemoryEntry, embedding: List[float] = None):
+        """存储长期记忆"""
+        # embedding 存入向量存储, 内容文件记下它的行号
+        row = self.vectors.add(entry.id, embedding) if embedding is not None else None
+        self._write_entry(entry, row)
+        
+        # 更新索引
+        self._append_index(self._entry_meta(
+            entry,
+            stored_at=datetime.now().isoformat(),
+            has_embedding=embedding is not None
+        ))
+    
+    def import_entries(self, items: Iterable[Tuple[MemoryEntry, Optional[List[float]]]]) -> int:
+        """
+        批量写入 (快照导入用), 返回实际写入条数
+        
+        内容文件和 embedding 都已相同的条目跳过。比较只读内容文件和向量存储的
+        对应行, 索引项最后一次性追加到 index.ndjson, 不载入索引, 内存占用只与
+        这一批的条数有关。
+        """
+        metas = []
+        for entry, embedding in items:
+            data = self._read_file(entry.id)
+            if data is not None and MemoryEntry(**data["entry"]) == entry:
+                if embedding is None:
+                    continue
+                row = data.get("vector_row")
+                stored = self.vectors.read_row(row) if row is not None else None
+                if stored is not None and all(
+                    abs(a - b) < 1e-6 for a, b in zip(stored, VectorStore._normalize(embedding))
+                ):
+                    continue
+            row = self.vectors.add(entry.id, embedding) if embedding is not None else None
+            self._write_entry(entry, row)
+            metas.append(self._entry_meta(
+                entry,
+                stored_at=datetime.now().isoformat(),
+                has_embedding=embedding is not None
+            ))
+        
+        if metas:
+            with self._lock:
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    f.write("".join(json.dumps(meta, ensure_ascii=False) + "\n" for meta in metas))
+                # 已载入的索引不再是最新的, 下次用到时重新载入
+                self._unload_index()
+        return len(metas)
+    
+    # ---- 近似重复 ----
+    
+    # 以下两个方法由调用方持有 _lock
+    
+    def _index_fingerprint(self, memory_id: str, fingerprint: int):
+        self._unindex_fingerprint(memory_id)
+        self._fingerprints[memory_id] = fingerprint
+        mask = (1 << self._BAND_BITS) - 1
+        for i, band in enumerate(self._bands):
+            band.setdefault(fingerprint >> (i * self._BAND_BITS) & mask, set()).add(memory_id)
+    
+    def _unindex_fingerprint(self, memory_id: str):
+        fingerprint = self._fingerprints.pop(memory_id, None)
+        if fingerprint is None:
+            return
+        mask = (1 << self._BAND_BITS) - 1
+        for i, band in enumerate(self._bands):
+            key = fingerprint >> (i * self._BAND_BITS) & mask
+            band[key].discard(memory_id)
+            if not band[key]:
+                del band[key]
+    
+    def _nearest(self, content: str, fingerprint: int) -> Optional[str]:
+        """指纹距离最近且内容相似度达标的已索引记忆"""
+        mask = (1 << self._BAND_BITS) - 1
+        candidates = {}
+        with self._lock:
+            self._ensure_index()
+            for i, band in enumerate(self._bands):
+                for memory_id in band.get(fingerprint >> (i * self._BAND_BITS) & mask, ()):
+                    bits = bin(fingerprint ^ self._fingerprints[memory_id]).count("1")
+                    if bits <= self.NEAR_DUP_BITS:
+                        candidates[memory_id] = bits
+        
+        # 内容比较在锁外进行
+        for memory_id in sorted(candidates, key=candidates.get):
+            entry = self._load_entry(memory_id)
+            if entry is not None and \
+                    shingle_similarity(content, entry.content) >= self.NEAR_DUP_SIMILARITY:
+                return memory_id
+        return None
+    
+    def find_near_duplicate(self, content: str) -> Optional[str]:
+        """返回与 content 近似重复的记忆 ID"""
+        return self._nearest(content, simhash(content))
+    
+    def merge(self, memory_id: str, importance: float, boost: float = 0.0,
+              access_count: int = 1) -> Optional[MemoryEntry]:
+        """
+        把重复写入合并到已有记忆
+        
+        重要性取两者较大值再加 boost (不超过 1.0), 访问计数加 access_count。
+        """
+        # 读-改-写内容文件期间持锁, 并发的合并不会互相覆盖
+        with self._lock:
+            data = self._read_file(memory_id)
+            if data is None:
+                return None
+            entry = MemoryEntry(**data["entry"])
+            entry.importance = min(1.0, max(entry.importance, importance) + boost)
+            entry.access_count += access_count
+            self._write_entry(entry, data.get("vector_row"))
+            
+            meta = self._meta(memory_id) or {}
+            self._append_index(self._entry_meta(
+                entry,
+                stored_at=meta.get("stored_at", entry.timestamp),
+                has_embedding=meta.get("has_embedding", False)
+            ))
+            return entry
+    
+    def dedup(self) -> Dict[str, str]:
+        """
+        合并已有的近似重复记忆 (一次性整理)
+        
+        按写入顺序处理, 较早的记忆保留; 没有指纹的旧索引项先补算指纹。
+        整理期间持锁: 指纹倒排会被暂时清空重建。
+            
+        Returns:
+            {被合并删除的 ID: 保留的 ID}
+        """
+        with self._lock:
+            self._ensure_index()
+            backfill = []
+            for meta in self._index["memories"]:
+                if "simhash" not in meta:
+                    entry = self._load_entry(meta["id"])
+                    if entry is not None:
+                        backfill.append(self._entry_meta(entry, **{
+                            k: v for k, v in meta.items()
+                            if k in ("stored_at", "has_embedding")
+                        }))
+            if backfill:
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    for meta in backfill:
+                        f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+                self._load_index()
+            
+            fingerprints = dict(self._fingerprints)
+            for memory_id in list(fingerprints):
+                self._unindex_fingerprint(memory_id)
+            
+            merged: Dict[str, str] = {}
+            for meta in list(self._index["memories"]):
+                fingerprint = fingerprints.get(meta["id"])
+                entry = self._load_entry(meta["id"])
+                if fingerprint is None or entry is None:
+                    continue
+                keep = self._nearest(entry.content, fingerprint)
+                if keep is None:
+                    self._index_fingerprint(meta["id"], fingerprint)
+                else:
+                    merged[meta["id"]] = keep
+            
+            for memory_id, keep in merged.items():
+                duplicate = self._load_entry(memory_id)
+                if duplicate is not None:
+                    self.merge(keep, duplicate.importance, access_count=duplicate.access_count)
+            self.remove(list(merged))
+            return merged
+    
+    def search_by_vector(self, query_vec: List[float], k: int = 10) -> List[Dict[str, Any]]:
+        """
+        向量相似度搜索
+        
+        Args:
+            query_vec: 查询向量 (维度须与已存 embedding 一致)
+            k: 返回条数
+        
+        Returns:
+            [{"entry": MemoryEntry, "score": 余弦相似度}], 按相似度降序
+        """
+        results = []
+        for memory_id, score in self.vectors.search(query_vec, k):
+            entry = self._load_entry(memory_id)
+            if entry is not None:
+                results.append({"entry": entry, "score": score})
+        return results
+    
+    def keyword_search(self, keywords: List[str], limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        关键词搜索, 返回 [{"entry": MemoryEntry, "score": 命中的关键词数}]
+        
+        (简化版, 逐个打开内容文件; 有 embedding 时应使用 search_by_vector)
+        """
         results = []
         
-        for mem_meta in self.index["memories"]:
-            memory_file = self.storage_path / f"{mem_meta['id']}.json"
-            if not memory_file.exists():
+        for mem_meta in self.metas():
+            entry = self._load_entry(mem_meta['id'])
+            if entry is None:
                 continue
+            content = entry.content.lower()
             
-            with open(memory_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                content = data["entry"]["content"].lower()
-                
-                # 简单关键词匹配
-                score = sum(1 for kw in keywords if kw.lower() in content)
-                if score > 0:
-                    results.append({
-                        "entry": MemoryEntry(**data["entry"]),
-                        "score": score
-                    })
+            # 简单关键词匹配
+            score = sum(1 for kw in keywords if kw.lower() in content)
+            if score > 0:
+                results.append({
+                    "entry": entry,
+                    "score": score
+                })
         
         # 按分数排序
         results.sort(key=lambda x: x["score"], reverse=True)
-        return [r["entry"] for r in results[:limit]]
+        return results[:limit]
+    
+    def search_by_keywords(self, keywords: List[str], limit: int = 10) -> List[MemoryEntry]:
+        """关键词搜索 (简化版，实际应使用向量搜索)"""
+        return [r["entry"] for r in self.keyword_search(keywords, limit)]
     
     def get_by_type(self, memory_type: str, limit: int = 20) -> List[MemoryEntry]:
         """按类型获取记忆"""
         results = []
         
-        for mem_meta in self.index["memories"]:
+        for mem_meta in self.metas():
             if mem_meta["type"] == memory_type:
-                memory_file = self.storage_path / f"{mem_meta['id']}.json"
-                if memory_file.exists():
-                    with open(memory_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        results.append(MemoryEntry(**data["entry"]))
-                        
-                        if len(results) >= limit:
-                            break
+                entry = self._load_entry(mem_meta['id'])
+                if entry is not None:
+                    results.append(entry)
+                    
+                    if len(results) >= limit:
+                        break
         
         return results
 
@@ -394,64 +1630,206 @@ class LongTermMemory:
 # ============================================================================
 
 class ProceduralMemory:
-    """程序记忆 - 技能和工作流"""
+    """
+    程序记忆 - 技能和工作流
+    
+    SKILL.md 与工作流文件按 (mtime, size) 校验缓存, 文件在 git pull 后变化会自动
+    重新读取; 同一文件在 CHECK_INTERVAL 秒内的重复访问不再 stat。缓存按 LRU
+    最多保留 CACHE_SIZE 项。工作流缓存的是解析后的对象 (definition)。
+    """
+    
+    CACHE_SIZE = 128
+    CHECK_INTERVAL = 2.0
+    WORKFLOW_SUFFIXES = (".yaml", ".yml", ".json")
     
     def __init__(self, skills_path: str = "~/openclaw/skills",
                  workflows_path: str = "~/clawos/workflows"):
         self.skills_path = Path(skills_path).expanduser()
         self.workflows_path = Path(workflows_path).expanduser()
-        self._cache: Dict[str, Any] = {}
+        # (kind, name) -> {"path", "stamp", "checked", "value"}
+        self._cache: OrderedDict = OrderedDict()
+        self._manifest: Dict[str, Dict] = {}
+        # 技能根目录的 mtime 及各 SKILL.md 的 (mtime, size), 用于判断清单是否过期
+        self._manifest_root: Optional[int] = None
+        self._manifest_stamps: Dict[str, Optional[tuple]] = {}
+        self._manifest_checked = 0.0
+        self._lock = threading.Lock()
     
-    def get_skill(self, skill_name: str) -> Optional[Dict]:
-        """获取技能"""
-        if skill_name in self._cache:
-            return self._cache[skill_name]
-        
-        skill_path = self.skills_path / skill_name / "SKILL.md"
-        if not skill_path.exists():
+    # ---- 缓存 ----
+    
+    @staticmethod
+    def _stamp(path: Path) -> Optional[tuple]:
+        try:
+            st = path.stat()
+        except OSError:
             return None
+        return (st.st_mtime_ns, st.st_size)
+    
+    def _cached(self, key: tuple, path: Path, load) -> Optional[Dict]:
+        """返回 path 的缓存内容, 文件变化或被删除时重新加载"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached["path"] == path and \
+                    now - cached["checked"] < self.CHECK_INTERVAL:
+                self._cache.move_to_end(key)
+                return cached["value"]
         
-        with open(skill_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        self._cache[skill_name] = {
-            "name": skill_name,
-            "path": str(skill_path),
-            "content": content
-        }
+        stamp = self._stamp(path)
+        if stamp is None:
+            with self._lock:
+                self._cache.pop(key, None)
+            return None
+        if cached is not None and cached["path"] == path and cached["stamp"] == stamp:
+            value = cached["value"]
+        else:
+            value = load(path)
         
-        return self._cache[skill_name]
+        with self._lock:
+            self._cache[key] = {"path": path, "stamp": stamp, "checked": now, "value": value}
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return value
     
-    def get_workflow(self, workflow_name: str) -> Optional[Dict]:
-        """获取工作流"""
-        if workflow_name in self._cache:
-            return self._cache[workflow_name]
+    def invalidate(self):
+        """清空缓存和技能清单"""
+        with self._lock:
+            self._cache.clear()
+            self._manifest = {}
+            self._manifest_root = None
+            self._manifest_stamps = {}
+            self._manifest_checked = 0.0
+    
+    # ---- 技能 ----
+    
+    def get_skill(self, skill_name: str) -> Optional[Dict]:
+        """获取技能"""
+        skill_path = self.skills_path / skill_name / "SKILL.md"
         
-        workflow_path = self.workflows_path / f"{workflow_name}.yaml"
-        if not workflow_path.exists():
-            workflow_path = self.workflows_path / f"{workflow_name}.json"
+        def load(path: Path) -> Dict:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            return {
+                "name": skill_name,
+                "path": str(path),
+                "content": content
+            }
         
-        if not workflow_path.exists():
-            return None
+        return self._cached(("skill", skill_name), skill_path, load)
+    
+    @staticmethod
+    def _skill_summary(skill_md: Path) -> Dict:
+        """读取 SKILL.md 开头的 frontmatter (name / description)"""
+        summary = {}
+        with open(skill_md, 'r', encoding='utf-8') as f:
+            if f.readline().strip() != "---":
+                return summary
+            for line in f:
+                line = line.strip()
+                if line == "---":
+                    break
+                key, sep, value = line.partition(":")
+                if sep and key.strip() in ("name", "description"):
+                    summary[key.strip()] = value.strip()
+        return summary
+    
+    def skills_manifest(self) -> Dict[str, Dict]:
+        """
+        技能清单: {技能名: {"path", "description"}}
         
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        技能根目录的 mtime 变化后重新列出技能目录; 每项按其 SKILL.md 的
+        (mtime, size) 校验 (原地编辑 SKILL.md 不会改变目录的 mtime), 只重新
+        读取变化了的 SKILL.md。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._manifest_checked < self.CHECK_INTERVAL:
+                return dict(self._manifest)
+            root, manifest, stamps = \
+                self._manifest_root, dict(self._manifest), dict(self._manifest_stamps)
         
-        self._cache[workflow_name] = {
-            "name": workflow_name,
-            "path": str(workflow_path),
-            "content": content
-        }
+        root_stamp = self._stamp(self.skills_path)
+        if root_stamp is None:
+            root, manifest, stamps = None, {}, {}
+        else:
+            if root != root_stamp[0]:
+                root = root_stamp[0]
+                names = [d.name for d in self.skills_path.iterdir() if d.is_dir()]
+                stamps = {name: stamps.get(name) for name in names}
+                manifest = {name: entry for name, entry in manifest.items() if name in stamps}
+            for name in list(stamps):
+                skill_md = self.skills_path / name / "SKILL.md"
+                md_stamp = self._stamp(skill_md)
+                if md_stamp is None:
+                    # 目录已删除或 (暂时) 没有 SKILL.md
+                    stamps[name] = None
+                    manifest.pop(name, None)
+                    continue
+                if stamps[name] == md_stamp and name in manifest:
+                    continue
+                stamps[name] = md_stamp
+                try:
+                    summary = self._skill_summary(skill_md)
+                except OSError:
+                    stamps[name] = None
+                    manifest.pop(name, None)
+                    continue
+                manifest[name] = {
+                    "path": str(skill_md),
+                    "description": summary.get("description", "")
+                }
         
-        return self._cache[workflow_name]
+        with self._lock:
+            self._manifest_root, self._manifest, self._manifest_stamps = root, manifest, stamps
+            self._manifest_checked = now
+        return dict(manifest)
     
     def list_skills(self) -> List[str]:
         """列出所有可用技能"""
-        if not self.skills_path.exists():
-            return []
+        return sorted(self.skills_manifest())
+    
+    # ---- 工作流 ----
+    
+    @staticmethod
+    def _parse_workflow(path: Path, content: str) -> Any:
+        if path.suffix == ".json":
+            return json.loads(content)
+        if not HAS_YAML:
+            raise RuntimeError("PyYAML is required to parse YAML workflows")
+        return yaml.safe_load(content)
+    
+    def get_workflow(self, workflow_name: str) -> Optional[Dict]:
+        """
+        获取工作流
         
-        return [d.name for d in self.skills_path.iterdir() 
-                if d.is_dir() and (d / "SKILL.md").exists()]
+        Returns:
+            {"name", "path", "content", "definition"}, definition 为解析后的
+            YAML/JSON 对象; 解析失败时为 None 并附带 "error"
+        """
+        for suffix in self.WORKFLOW_SUFFIXES:
+            workflow_path = self.workflows_path / f"{workflow_name}{suffix}"
+            if workflow_path.exists():
+                break
+        else:
+            return None
+        
+        def load(path: Path) -> Dict:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            workflow = {
+                "name": workflow_name,
+                "path": str(path),
+                "content": content,
+                "definition": None
+            }
+            try:
+                workflow["definition"] = self._parse_workflow(path, content)
+            except Exception as e:
+                workflow["error"] = str(e)
+            return workflow
+        
+        return self._cached(("workflow", workflow_name), workflow_path, load)
     
     def list_workflows(self) -> List[str]:
         """列出所有可用工作流"""
@@ -459,26 +1837,314 @@ class ProceduralMemory:
             return []
         
         return [f.stem for f in self.workflows_path.iterdir() 
-                if f.suffix in [".yaml", ".json"]]
+                if f.suffix in self.WORKFLOW_SUFFIXES]
+
+# ============================================================================
+# 分层调度 (L2 ↔ L3)
+# ============================================================================
+
+class TieringJob:
+    """
+    按访问热度在 L2 与 L3 之间调度记忆
+    
+    一轮调度依次执行三个阶段, 每个阶段按游标分批推进:
+        promote  当前热度 ≥ PROMOTE_HEAT 且不在 L3 的 L2 记忆写入 L3
+        demote   进入 L3 超过 DEMOTE_AFTER_DAYS 且热度 < DEMOTE_HEAT 的记忆移出 L3
+                 (保证 L2 中有副本)
+        drop     创建超过 DROP_AFTER_DAYS、热度 < DROP_HEAT 且重要性
+                 < DROP_IMPORTANCE 的 L2 记忆删除 (在 L3 中的不删)
+    
+    run_slice 在给定时间片内处理尽可能多的批次后返回, 每批是一个短事务,
+    不会长时间占用写锁; 未完成的阶段下次从游标处继续。
+    """
+    
+    PROMOTE_HEAT = 3.0
+    DEMOTE_HEAT = MediumTermMemory.COLD_HEAT
+    DEMOTE_AFTER_DAYS = 14
+    DROP_HEAT = 0.1
+    DROP_IMPORTANCE = 0.5
+    DROP_AFTER_DAYS = 30
+    BATCH_SIZE = 100
+    PHASES = ("promote", "demote", "drop")
+    
+    def __init__(self, l2: MediumTermMemory, l3: LongTermMemory):
+        self.l2 = l2
+        self.l3 = l3
+        self.phase = 0
+        self._cursor = None
+        self.cycles = 0
+        self.totals = {"promoted": 0, "demoted": 0, "dropped": 0}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    # ---- 时间片 ----
+    
+    def run_slice(self, budget: float = 0.05) -> Dict[str, Any]:
+        """
+        执行一个时间片
+        
+        Args:
+            budget: 时间片长度 (秒); 至少处理一批
+        
+        Returns:
+            本时间片的 {"promoted", "demoted", "dropped", "cycle_done"}
+        """
+        deadline = time.monotonic() + budget
+        stats = {"promoted": 0, "demoted": 0, "dropped": 0, "cycle_done": False}
+        while True:
+            phase = self.PHASES[self.phase]
+            done = getattr(self, f"_{phase}_batch")(stats)
+            if done:
+                self.phase += 1
+                self._cursor = None
+                if self.phase == len(self.PHASES):
+                    self.phase = 0
+                    self.cycles += 1
+                    stats["cycle_done"] = True
+                    break
+            if time.monotonic() >= deadline:
+                break
+        for key in self.totals:
+            self.totals[key] += stats[key]
+        return stats
+    
+    def run_cycle(self, budget: float = 0.05) -> Dict[str, int]:
+        """按时间片跑完当前这一轮, 返回本轮合计"""
+        totals = {"promoted": 0, "demoted": 0, "dropped": 0}
+        while True:
+            stats = self.run_slice(budget)
+            for key in totals:
+                totals[key] += stats[key]
+            if stats["cycle_done"]:
+                return totals
+    
+    def start(self, interval: float = 1.0, budget: float = 0.05):
+        """
+        在后台线程中每 interval 秒执行一个时间片
+        
+        L3 的索引和指纹倒排由 LongTermMemory 内部加锁, 可与其他线程的
+        remember / recall 并发。
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.run_slice(budget)
+                except Exception as e:
+                    print(f"Tiering slice failed: {e}")
+        
+        self._thread = threading.Thread(target=loop, name="memory-tiering", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: Optional[float] = None):
+        """停止后台线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    # ---- 各阶段 ----
+    
+    def _promote_batch(self, stats: Dict) -> bool:
+        # 按 (heat, rowid) 从热到冷分页
+        weight = self.l2.heat_weight()
+        sql = "SELECT rowid, * FROM memories WHERE heat >= ?"
+        params: List[Any] = [self.PROMOTE_HEAT * weight]
+        if self._cursor is not None:
+            sql += " AND (heat, rowid) < (?, ?)"
+            params.extend(self._cursor)
+        sql += " ORDER BY heat DESC, rowid DESC LIMIT ?"
+        params.append(self.BATCH_SIZE)
+        rows = self.l2.engine.connection().execute(sql, params).fetchall()
+        
+        for row in rows:
+            if row["id"] not in self.l3:
+                self.l3.store(self.l2._row_to_entry(row))
+                stats["promoted"] += 1
+        if rows:
+            self._cursor = (rows[-1]["heat"], rows[-1]["rowid"])
+        return len(rows) < self.BATCH_SIZE
+    
+    def _demote_batch(self, stats: Dict) -> bool:
+        # 按 L3 索引的位置分页; 移出的记忆会从列表中去掉, 游标随之回退
+        start = self._cursor or 0
+        metas = self.l3.metas(start, start + self.BATCH_SIZE)
+        cutoff = (datetime.now() - timedelta(days=self.DEMOTE_AFTER_DAYS)).isoformat()
+        candidates = [m["id"] for m in metas
+                      if (m.get("stored_at") or m["timestamp"]) < cutoff]
+        
+        cold = []
+        if candidates:
+            conn = self.l2.engine.connection()
+            heat = dict(conn.execute(f"""
+                SELECT id, heat FROM memories WHERE id IN ({",".join("?" * len(candidates))})
+            """, candidates).fetchall())
+            threshold = self.DEMOTE_HEAT * self.l2.heat_weight()
+            cold = [i for i in candidates if heat.get(i, 0.0) < threshold]
+            
+            # 只在 L3 中的记忆先写回 L2 (L2 已有相同内容的除外)
+            missing = [e for e in map(self.l3._load_entry, (i for i in cold if i not in heat))
+                       if e is not None and self.l2.find_duplicate(e.content) is None]
+            if missing:
+                self.l2.bulk_store_memories(missing)
+            stats["demoted"] += self.l3.remove(cold)
+        
+        self._cursor = start + len(metas) - len(cold)
+        return len(metas) < self.BATCH_SIZE
+    
+    def _drop_batch(self, stats: Dict) -> bool:
+        # 按 (heat, rowid) 从冷到热分页, 删除的行不影响游标
+        sql = """
+            SELECT rowid, id, heat FROM memories
+            WHERE heat < ? AND importance < ? AND created_at < ?
+        """
+        params: List[Any] = [
+            self.DROP_HEAT * self.l2.heat_weight(), self.DROP_IMPORTANCE,
+            (datetime.now() - timedelta(days=self.DROP_AFTER_DAYS)).isoformat()
+        ]
+        if self._cursor is not None:
+            sql += " AND (heat, rowid) > (?, ?)"
+            params.extend(self._cursor)
+        sql += " ORDER BY heat, rowid LIMIT ?"
+        params.append(self.BATCH_SIZE)
+        rows = self.l2.engine.connection().execute(sql, params).fetchall()
+        
+        ids = [row["id"] for row in rows if row["id"] not in self.l3]
+        if ids:
+            with self.l2.engine.transaction() as conn:
+                stats["dropped"] += conn.execute(f"""
+                    DELETE FROM memories WHERE id IN ({",".join("?" * len(ids))})
+                """, ids).rowcount
+        if rows:
+            self._cursor = (rows[-1]["heat"], rows[-1]["rowid"])
+        return len(rows) < self.BATCH_SIZE
+
+# ============================================================================
+# 快照 (跨节点导出/导入)
+# ============================================================================
+
+# 帧: magic "CM", 类型, 序号, 压缩后长度, 原始内容的 SHA-256; 之后是 zlib 压缩的内容
+_SNAPSHOT_FRAME = struct.Struct("<2sBII32s")
+_SNAPSHOT_MAGIC = b"CM"
+_SNAPSHOT_HEADER = 1
+_SNAPSHOT_CHUNK = 2
+_SNAPSHOT_END = 3
+SNAPSHOT_VERSION = 1
+# L2 中随快照迁移的表
+SNAPSHOT_TABLES = ("memories", "task_history", "session_summaries")
+
+
+def _snapshot_frame(kind: int, seq: int, payload: bytes) -> bytes:
+    data = zlib.compress(payload, 6)
+    return _SNAPSHOT_FRAME.pack(
+        _SNAPSHOT_MAGIC, kind, seq, len(data), hashlib.sha256(payload).digest()
+    ) + data
+
+
+def _read_snapshot_frames(src: BinaryIO):
+    """逐帧读取快照, 产出 (类型, 序号, 读取内容的函数); 不调用读取函数即跳过该帧"""
+    while True:
+        head = src.read(_SNAPSHOT_FRAME.size)
+        if not head:
+            return
+        if len(head) < _SNAPSHOT_FRAME.size:
+            raise ValueError("Truncated snapshot frame header")
+        magic, kind, seq, length, digest = _SNAPSHOT_FRAME.unpack(head)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("Not a memory snapshot (bad frame magic)")
+        data = src.read(length)
+        if len(data) < length:
+            raise ValueError(f"Truncated snapshot frame {seq}")
+        
+        def payload(data=data, digest=digest, seq=seq) -> bytes:
+            try:
+                raw = zlib.decompress(data)
+            except zlib.error as e:
+                raise ValueError(f"Corrupt snapshot frame {seq}: {e}") from None
+            if hashlib.sha256(raw).digest() != digest:
+                raise ValueError(f"Checksum mismatch in snapshot frame {seq}")
+            return raw
+        
+        yield kind, seq, payload
 
 # ============================================================================
 # 分层记忆管理器
 # ============================================================================
 
+class RecallResult(list):
+    """
+    recall 的结果列表
+    
+    partial 为 True 表示有层级未在期限内返回、查询出错或因上次查询仍未结束而被
+    跳过, missing 列出这些层级。
+    """
+    
+    def __init__(self, items=(), partial: bool = False, missing: List[str] = ()):
+        super().__init__(items)
+        self.partial = partial
+        self.missing = list(missing)
+
+
 class HierarchicalMemory:
     """分层记忆管理器 - 统一管理四层记忆"""
     
+    # 重复写入时已有记忆重要性的增量
+    MERGE_BOOST = 0.05
+    
+    # recall 查询 L2/L3 的线程池: 每层一个, 进程内所有实例共享。每层最多同时
+    # 进行 RECALL_WORKERS 个查询, 超时的查询仍占着名额时该层直接跳过, 不排队,
+    # 卡住的层不会拖慢其他层
+    RECALL_WORKERS = 2
+    _recall_pools: Dict[str, ThreadPoolExecutor] = {}
+    _recall_slots: Dict[str, threading.BoundedSemaphore] = {}
+    _recall_pool_lock = threading.Lock()
+    # L2 只有 LIKE 过滤、没有 BM25 分数时的相关度
+    LIKE_RELEVANCE = 0.5
+    
     def __init__(self, session_id: str):
         self.l1 = ShortTermMemory(session_id)
         self.l2 = MediumTermMemory()
         self.l3 = LongTermMemory()
         self.l4 = ProceduralMemory()
+        self.tiering = TieringJob(self.l2, self.l3)
+    
+    @classmethod
+    def _submit(cls, tier: str, fn, *args) -> Optional[Future]:
+        """在 tier 的线程池中执行 fn; 该层查询名额已满时返回 None"""
+        with cls._recall_pool_lock:
+            if tier not in cls._recall_pools:
+                cls._recall_pools[tier] = ThreadPoolExecutor(
+                    max_workers=cls.RECALL_WORKERS, thread_name_prefix=f"recall-{tier}")
+                cls._recall_slots[tier] = threading.BoundedSemaphore(cls.RECALL_WORKERS)
+            pool, slots = cls._recall_pools[tier], cls._recall_slots[tier]
+        
+        if not slots.acquire(blocking=False):
+            return None
+        try:
+            future = pool.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # 完成、出错或被取消时归还名额
+        future.add_done_callback(lambda _: slots.release())
+        return future
     
     def remember(self, content: str, memory_type: str = "knowledge",
-                 importance: float = 0.5, source: str = "user"):
-        """存储记忆 - 自动路由到合适的层级"""
+                 importance: float = 0.5, source: str = "user") -> MemoryEntry:
+        """
+        存储记忆 - 自动路由到合适的层级
+        
+        ID 由规范化内容的哈希得出。L2 已有相同内容时合并到已有条目 (重要性取
+        较大值再加 MERGE_BOOST, 记一次访问), 写入 L3 前再做近似重复检测。
+        
+        Returns:
+            新写入或被合并的记忆
+        """
         entry = MemoryEntry(
-            id=hashlib.md5(f"{content}{datetime.now()}".encode()).hexdigest()[:12],
+            id=content_hash(content)[:12],
             content=content,
             memory_type=memory_type,
             importance=importance,
@@ -486,57 +2152,129 @@ class HierarchicalMemory:
             timestamp=datetime.now().isoformat(),
             metadata={}
         )
+        merged = self.l2.merge_duplicate(entry, self.MERGE_BOOST)
         
         # 总是存入 L1
         self.l1.add_context({
             "type": "memory",
-            "entry_id": entry.id,
+            "entry_id": (merged or entry).id,
             "content": content[:200]  # 截断
         })
         
+        if merged is not None:
+            if merged.id in self.l3:
+                self.l3.merge(merged.id, merged.importance)
+            elif merged.importance >= 0.7:
+                self._store_l3(merged)
+            return merged
+        
         # 根据重要性决定存储层级
         if importance >= 0.3:
             self.l2.store_memory(entry)
         
         if importance >= 0.7:
+            return self._store_l3(entry)
+        return entry
+    
+    def _store_l3(self, entry: MemoryEntry) -> MemoryEntry:
+        """写入 L3; 已有近似重复的记忆时合并到该记忆"""
+        near = self.l3.find_near_duplicate(entry.content)
+        if near is None or near == entry.id:
             self.l3.store(entry)
+            return entry
+        self.l2.touch([near])
+        return self.l3.merge(near, entry.importance, self.MERGE_BOOST) or entry
     
-    def recall(self, query: str, limit: int = 10) -> List[Dict]:
-        """检索记忆 - 从各层汇总"""
-        results = []
-        
-        # 1. 检查 L1 上下文
-        context = self.l1.get_context(limit=3)
-        for item in context:
+    def dedup(self) -> Dict[str, int]:
+        """一次性合并 L3 的近似重复和 L2 的内容重复, 返回各层合并掉的条数"""
+        l3_merged = self.l3.dedup()
+        # 已在 L3 的 ID 优先保留, 两层的副本保持对应
+        l2_merged = self.l2.dedup(prefer={m["id"] for m in self.l3.metas()})
+        return {"l2_merged": len(l2_merged), "l3_merged": len(l3_merged)}
+    
+    # 各层返回 [(记忆 ID, 内容, 相关度)], 相关度是 [0, 1] 内的绝对分数, 不随
+    # 同层其他结果变化, 可以跨层比较
+    
+    def _recall_l1(self, query: str) -> List[tuple]:
+        # 整个查询出现在最近的上下文中
+        hits = []
+        for item in self.l1.get_context(limit=3):
             if query.lower() in str(item).lower():
-                results.append({
-                    "source": "L1",
-                    "content": item,
-                    "relevance": 1.0
-                })
+                hits.append((item.get("entry_id"), item, 1.0))
+        return hits
+    
+    def _recall_l2(self, query: str) -> List[tuple]:
+        # BM25 分数 s ≥ 0 映射为 s / (1 + s)
+        hits = []
+        for r in self.l2.search(query, limit=5):
+            score = max(r["score"], 0.0)
+            relevance = score / (1 + score) if score > 0 else self.LIKE_RELEVANCE
+            hits.append((r["entry"].id, r["entry"].to_dict(), relevance))
+        return hits
+    
+    def _recall_l3(self, query: str) -> List[tuple]:
+        # 命中的查询词占比
+        keywords = query.split()
+        hits = self.l3.keyword_search(keywords, limit=5)
+        # L3 命中同样计入热度 (记录在 L2 的同一条记忆上)
+        self.l2.touch([r["entry"].id for r in hits])
+        return [(r["entry"].id, r["entry"].to_dict(), r["score"] / len(keywords))
+                for r in hits]
+    
+    def recall(self, query: str, limit: int = 10,
+               timeout: Optional[float] = None) -> RecallResult:
+        """
+        检索记忆 - 并行查询各层, 按相关度汇总
         
-        # 2. 搜索 L2
-        l2_results = self.l2.search_memories(query, limit=5)
-        for entry in l2_results:
-            results.append({
-                "source": "L2",
-                "content": entry.to_dict(),
-                "relevance": 0.8
-            })
+        L1 在调用线程内查询, L2/L3 在各自的线程池中并行查询。超过 timeout 仍未
+        返回的层级不再等待: 尚未开始的查询被取消, 已在执行的在后台结束并占用该层
+        名额; 名额用尽的层级本次直接跳过。这些情况结果都标记为 partial。
+        同一条记忆在多个层级命中时只保留相关度较高的一条 (相同时保留较浅的层级)。
         
-        # 3. 搜索 L3
-        keywords = query.split()
-        l3_results = self.l3.search_by_keywords(keywords, limit=5)
-        for entry in l3_results:
-            results.append({
-                "source": "L3",
-                "content": entry.to_dict(),
-                "relevance": 0.6
-            })
-        
-        # 按相关性排序
+        Args:
+            query: 查询文本
+            limit: 最多返回条数
+            timeout: 等待 L2/L3 的最长秒数; None 表示等待全部完成
+        
+        Returns:
+            RecallResult: [{"source", "content", "relevance"}], relevance 为 [0, 1] 的相关度
+        """
+        futures = {
+            "L2": self._submit("L2", self._recall_l2, query),
+            "L3": self._submit("L3", self._recall_l3, query),
+        }
+        missing = [tier for tier, future in futures.items() if future is None]
+        futures = {tier: future for tier, future in futures.items() if future is not None}
+        tiers = {"L1": self._recall_l1(query)}
+        
+        wait(futures.values(), timeout=timeout)
+        for tier, future in futures.items():
+            if not future.done():
+                future.cancel()
+                missing.append(tier)
+                continue
+            try:
+                tiers[tier] = future.result()
+            except Exception as e:
+                print(f"Recall from {tier} failed: {e}")
+                missing.append(tier)
+        
+        results = []
+        seen: Dict[str, Dict] = {}
+        for tier in ("L1", "L2", "L3"):
+            for key, content, relevance in tiers.get(tier, []):
+                result = {"source": tier, "content": content, "relevance": relevance}
+                if key is not None:
+                    if key in seen:
+                        if relevance > seen[key]["relevance"]:
+                            seen[key].update(result)
+                        continue
+                    seen[key] = result
+                results.append(result)
+        
+        # 稳定排序: 分数相同时保持 L1 → L2 → L3 的顺序
         results.sort(key=lambda x: x["relevance"], reverse=True)
-        return results[:limit]
+        return RecallResult(results[:limit], partial=bool(missing), missing=sorted(missing))
     
     def get_skill(self, skill_name: str) -> Optional[Dict]:
         """获取技能 (L4)"""
@@ -555,12 +2293,160 @@ class HierarchicalMemory:
         """完成任务"""
         self.l2.update_task(task_id, "completed", result)
     
+    # ---- 快照 ----
+    
+    SNAPSHOT_CHUNK_RECORDS = 1000
+    
+    def export_stream(self) -> Iterator[bytes]:
+        """
+        把 L2 的表和 L3 的记忆 (含 embedding) 导出为快照流
+        
+        快照由帧组成: 头 (快照 ID 等)、若干数据块、尾 (各部分条数)。每个数据块是
+        最多 SNAPSHOT_CHUNK_RECORDS 行的 NDJSON, 单独 zlib 压缩并带 SHA-256。
+        L2 用游标分批读取, L3 遍历内容文件并按其中的行号读取 embedding, 不载入
+        L3 索引和向量 ID 表, 内存中只保留一个数据块。旧版本写入的内容文件没有
+        行号, 这部分 embedding 按 ID 查找, 会载入向量 ID 表。
+        
+        Yields:
+            依次写入文件或网络即可的字节串
+        """
+        snapshot_id = uuid.uuid4().hex
+        yield _snapshot_frame(_SNAPSHOT_HEADER, 0, json.dumps({
+            "format": "clawos-memory",
+            "version": SNAPSHOT_VERSION,
+            "snapshot_id": snapshot_id,
+            "created": datetime.now().isoformat(),
+            "schema_version": MediumTermMemory.SCHEMA_VERSION
+        }).encode('utf-8'))
+        
+        counts = {"L2": 0, "L3": 0}
+        seq = 0
+        lines: List[str] = []
+        
+        def records() -> Iterator[tuple]:
+            conn = self.l2.engine.connection()
+            for table in SNAPSHOT_TABLES:
+                cursor = conn.execute(f"SELECT * FROM {table}")
+                while True:
+                    rows = cursor.fetchmany(self.SNAPSHOT_CHUNK_RECORDS)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield "L2", {"tier": "L2", "table": table, "row": dict(row)}
+            for entry, embedding in self.l3.iter_with_embeddings():
+                yield "L3", {"tier": "L3", "entry": entry.to_dict(), "embedding": embedding}
+        
+        for tier, record in records():
+            lines.append(json.dumps(record, ensure_ascii=False))
+            counts[tier] += 1
+            if len(lines) >= self.SNAPSHOT_CHUNK_RECORDS:
+                seq += 1
+                yield _snapshot_frame(_SNAPSHOT_CHUNK, seq, "\n".join(lines).encode('utf-8'))
+                lines = []
+        if lines:
+            seq += 1
+            yield _snapshot_frame(_SNAPSHOT_CHUNK, seq, "\n".join(lines).encode('utf-8'))
+        
+        yield _snapshot_frame(_SNAPSHOT_END, seq + 1, json.dumps({
+            "snapshot_id": snapshot_id, "chunks": seq, "records": counts
+        }).encode('utf-8'))
+    
+    def import_stream(self, src: BinaryIO, state_path: Optional[Path] = None) -> Dict[str, Any]:
+        """
+        导入 export_stream 生成的快照
+        
+        每个数据块校验 SHA-256 后在一个 L2 事务中写入 (已存在的行按 ID 覆盖),
+        L3 中内容相同的记忆跳过, 因此重复导入结果不变。已完成的块号记录在
+        state_path (默认 L2 数据库旁的 .import-<快照 ID>.json); 中断后用同一快照
+        重新调用会跳过这些块, 导入完成后删除该文件。
+        
+        内存: 一次只解压、解析一个数据块 (≤ SNAPSHOT_CHUNK_RECORDS 条), L2 行直接
+        写入 SQLite, L3 记忆经 LongTermMemory.import_entries 直接追加到磁盘上的
+        索引, 不载入 L3 索引, 占用与快照大小无关。
+        
+        Args:
+            src: 以二进制方式打开的快照
+            state_path: 断点记录文件
+        
+        Returns:
+            {"snapshot_id", "chunks", "skipped_chunks", "L2", "L3"}
+        """
+        stats = {"snapshot_id": None, "chunks": 0, "skipped_chunks": 0, "L2": 0, "L3": 0}
+        done = 0
+        columns: Dict[str, List[str]] = {}
+        
+        for kind, seq, payload in _read_snapshot_frames(src):
+            if kind == _SNAPSHOT_HEADER:
+                header = json.loads(payload())
+                if header.get("format") != "clawos-memory" or \
+                        header.get("version", 0) > SNAPSHOT_VERSION:
+                    raise ValueError(f"Unsupported snapshot: {header}")
+                stats["snapshot_id"] = header["snapshot_id"]
+                if state_path is None:
+                    state_path = self.l2.db_path.parent / f".import-{header['snapshot_id']}.json"
+                state_path = Path(state_path)
+                if state_path.exists():
+                    done = json.loads(state_path.read_text())["chunk"]
+            
+            elif kind == _SNAPSHOT_CHUNK:
+                if stats["snapshot_id"] is None:
+                    raise ValueError("Snapshot chunk before header")
+                if seq <= done:
+                    stats["skipped_chunks"] += 1
+                    continue
+                records = [json.loads(line) for line in payload().decode('utf-8').splitlines()]
+                self._import_chunk(records, columns, stats)
+                stats["chunks"] += 1
+                tmp = state_path.with_name(f"{state_path.name}.tmp")
+                tmp.write_text(json.dumps({"snapshot_id": stats["snapshot_id"], "chunk": seq}))
+                os.replace(tmp, state_path)
+            
+            elif kind == _SNAPSHOT_END:
+                trailer = json.loads(payload())
+                if trailer["chunks"] != stats["chunks"] + stats["skipped_chunks"]:
+                    raise ValueError(
+                        f"Snapshot has {trailer['chunks']} chunks, "
+                        f"read {stats['chunks'] + stats['skipped_chunks']}"
+                    )
+                if state_path is not None:
+                    state_path.unlink(missing_ok=True)
+                return stats
+        
+        raise ValueError("Truncated snapshot (missing end frame)")
+    
+    def _import_chunk(self, records: List[Dict], columns: Dict[str, List[str]], stats: Dict):
+        with self.l2.engine.transaction() as conn:
+            for record in records:
+                if record["tier"] != "L2":
+                    continue
+                table, row = record["table"], record["row"]
+                if table not in SNAPSHOT_TABLES:
+                    continue
+                if table not in columns:
+                    columns[table] = [r["name"] for r in conn.execute(f"PRAGMA table_info({table})")]
+                if table == "memories" and not row.get("content_hash"):
+                    # 旧版本导出的快照
+                    row["content_hash"] = content_hash(row.get("content") or "")
+                names = [c for c in columns[table] if c in row]
+                conn.execute(f"""
+                    INSERT INTO {table} ({", ".join(names)})
+                    VALUES ({", ".join("?" * len(names))})
+                    ON CONFLICT(id) DO UPDATE SET
+                    {", ".join(f"{c} = excluded.{c}" for c in names if c != "id")}
+                """, [row[c] for c in names])
+                stats["L2"] += 1
+        
+        stats["L3"] += self.l3.import_entries(
+            (MemoryEntry(**record["entry"]), record.get("embedding"))
+            for record in records if record["tier"] == "L3"
+        )
+    
     def compress(self):
         """压缩各层记忆"""
         # L1 压缩
         if len(self.l1.context) > 50:
             # 保留最近的 30 条
-            self.l1.context = self.l1.context[-30:]
+            self.l1.trim(30)
         
         # L2 压缩
         deleted = self.l2.compress(days_old=30)
@@ -580,8 +2466,14 @@ if __name__ == "__main__":
     parser.add_argument("--recall", help="Recall memories")
     parser.add_argument("--type", default="knowledge", help="Memory type")
     parser.add_argument("--importance", type=float, default=0.5, help="Importance 0-1")
+    parser.add_argument("--timeout", type=float, help="Recall deadline in seconds")
     parser.add_argument("--session", default="cli", help="Session ID")
     parser.add_argument("--compress", action="store_true", help="Compress old memories")
+    parser.add_argument("--tier", action="store_true", help="Run one L2/L3 tiering cycle")
+    parser.add_argument("--dedup", action="store_true", help="Merge duplicate memories in L2/L3")
+    parser.add_argument("--export", metavar="PATH", help="Write an L2/L3 snapshot to PATH")
+    parser.add_argument("--import", dest="import_path", metavar="PATH",
+                        help="Import (or resume importing) a snapshot from PATH")
     parser.add_argument("--stats", action="store_true", help="Show memory stats")
     
     args = parser.parse_args()
@@ -593,13 +2485,34 @@ if __name__ == "__main__":
         print(f"Stored: {args.remember[:50]}...")
     
     elif args.recall:
-        results = memory.recall(args.recall)
+        results = memory.recall(args.recall, timeout=args.timeout)
+        if results.partial:
+            print(f"Partial result, missing: {', '.join(results.missing)}")
         print(json.dumps(results, indent=2, ensure_ascii=False))
     
     elif args.compress:
         stats = memory.compress()
         print(f"Compressed: {stats}")
     
+    elif args.tier:
+        stats = memory.tiering.run_cycle()
+        print(f"Tiered: {stats}")
+    
+    elif args.dedup:
+        stats = memory.dedup()
+        print(f"Deduplicated: {stats}")
+    
+    elif args.export:
+        with open(args.export, 'wb') as f:
+            for chunk in memory.export_stream():
+                f.write(chunk)
+        print(f"Exported to {args.export}")
+    
+    elif args.import_path:
+        with open(args.import_path, 'rb') as f:
+            stats = memory.import_stream(f)
+        print(f"Imported: {stats}")
+    
     elif args.stats:
         print("L1:", memory.l1.summarize())
         print("L4 Skills:", memory.l4.list_skills()[:5])
@@ -4,9 +4,27 @@ ClawOS 消息队列系统
 实现 Agent 间标准化通信
 """
 
+import asyncio
+import ctypes
+import ctypes.util
+import fcntl
+import gzip
+import hashlib
 import json
+import math
 import os
+import re
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
 import uuid
+import zlib
+from collections import Counter, namedtuple
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from dataclasses import dataclass, asdict
@@ -29,6 +47,9 @@ class Priority(Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+# 出队顺序: 高优先级在前
+PRIORITY_ORDER = [Priority.CRITICAL, Priority.HIGH, Priority.NORMAL, Priority.LOW]
+
 @dataclass
 class AgentRef:
     agent: str
@@ -79,17 +100,367 @@ class Message:
             payload=data["payload"],
             metadata=data["metadata"]
         )
+    
+    def _decode_body(self):
+        """首次访问 payload/metadata 时解析延迟保存的消息体"""
+        body = json.loads(self.__dict__.pop("_body"))
+        self.__dict__["payload"] = body["payload"]
+        self.__dict__["metadata"] = body["metadata"]
+    
+    def __getstate__(self):
+        # pickle 前先解码, 哨兵对象不能跨进程比较
+        if "_body" in self.__dict__:
+            self._decode_body()
+        return self.__dict__
+
+
+# 二进制线格式解码出的消息, payload/metadata 在首次访问前保持为未解析的字节
+_PENDING = object()
+
+
+def _lazy_body_field(name: str) -> property:
+    def getter(self):
+        if self.__dict__[name] is _PENDING:
+            self._decode_body()
+        return self.__dict__[name]
+    
+    def setter(self, value):
+        self.__dict__[name] = value
+    
+    return property(getter, setter)
+
+
+Message.payload = _lazy_body_field("payload")
+Message.metadata = _lazy_body_field("metadata")
+
+
+def _dumps(data: Any) -> bytes:
+    """紧凑 JSON 序列化 (落盘格式)"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 # ============================================================================
-# 消息队列
+# 线格式
 # ============================================================================
+#
+# 二进制格式 (版本 1):
+#   定长头   magic "CQ" | 格式版本 | type | priority | flags | ttl | 时间戳 | head 长度 | body 长度
+#   head     紧凑 JSON 数组 [version, id, traceId, timestamp, from, to]
+#   body     紧凑 JSON {"payload": ..., "metadata": ...}
+#
+# 路由/过期只需要定长头, 无需解析 head 和 body; body 在访问 payload 时才解析。
+# 以 "{" 开头的记录按旧 JSON 格式读取。
 
-class MessageQueue:
-    """基于文件系统的消息队列"""
+WIRE_MAGIC = b"CQ"
+WIRE_VERSION = 1
+
+_WIRE_HEADER = struct.Struct("<2sBBBBidII")
+_TYPE_CODES = {t: i for i, t in enumerate(MessageType)}
+_TYPES = list(MessageType)
+_PRIORITY_CODES = {p: i for i, p in enumerate(Priority)}
+_PRIORITIES = list(Priority)
+
+MessageHeader = namedtuple("MessageHeader", "type priority ttl created_at")
+
+
+def encode_message(message: Message, wire_format: str = "binary") -> bytes:
+    """把消息编码为落盘/传输字节 (wire_format: binary | json)"""
+    if wire_format == "json":
+        return _dumps(message.to_dict())
+    if wire_format != "binary":
+        raise ValueError(f"Unknown wire format: {wire_format}")
     
-    def __init__(self, base_path: str = "~/clawos/blackboard"):
-        self.base_path = Path(base_path).expanduser()
-        self.base_path.mkdir(parents=True, exist_ok=True)
+    frm, to = message.from_agent, message.to_agent
+    head = _dumps([
+        message.version, message.id, message.trace_id, message.timestamp,
+        [frm.agent, frm.tier, frm.session], [to.agent, to.tier, to.session],
+    ])
+    # 未被访问过的延迟消息体原样复用, 转发时不必解析 payload
+    body = message.__dict__.get("_body")
+    if body is None:
+        body = _dumps({"payload": message.payload, "metadata": message.metadata})
+    
+    created_at = datetime.fromisoformat(message.timestamp).timestamp()
+    return _WIRE_HEADER.pack(
+        WIRE_MAGIC, WIRE_VERSION, _TYPE_CODES[message.type],
+        _PRIORITY_CODES[message.priority], 0, message.ttl, created_at,
+        len(head), len(body)
+    ) + head + body
+
+
+def _unpack_wire_header(buf: bytes) -> tuple:
+    """解包二进制定长头; 截断或版本不支持时抛 ValueError"""
+    if len(buf) < _WIRE_HEADER.size:
+        raise ValueError(f"Truncated message: {len(buf)} bytes")
+    fields = _WIRE_HEADER.unpack_from(buf)
+    if fields[1] > WIRE_VERSION:
+        raise ValueError(f"Unsupported wire version: {fields[1]}")
+    return fields
+
+
+def decode_header(buf: bytes) -> MessageHeader:
+    """只解码定长头 (type/priority/ttl/创建时间), 不触碰 head 和 body"""
+    if not buf.startswith(WIRE_MAGIC):
+        data = json.loads(buf)
+        return MessageHeader(
+            MessageType(data["type"]), Priority(data["priority"]), data["ttl"],
+            datetime.fromisoformat(data["timestamp"]).timestamp()
+        )
+    _, _, type_code, priority_code, _, ttl, created_at, _, _ = _unpack_wire_header(buf)
+    return MessageHeader(_TYPES[type_code], _PRIORITIES[priority_code], ttl, created_at)
+
+
+def decode_message(buf: bytes) -> Message:
+    """解码一条消息 (自动识别二进制/JSON 格式), 二进制格式的 payload 延迟解析"""
+    if not buf.startswith(WIRE_MAGIC):
+        return Message.from_dict(json.loads(buf))
+    
+    _, _, type_code, priority_code, _, ttl, _, head_len, body_len = _unpack_wire_header(buf)
+    head_start = _WIRE_HEADER.size
+    body_start = head_start + head_len
+    # body 延迟解析, 截断要在这里发现, 不能等到访问 payload 时
+    if len(buf) < body_start + body_len:
+        raise ValueError(
+            f"Truncated message: {len(buf)} of {body_start + body_len} bytes")
+    msg_version, msg_id, trace_id, timestamp, frm, to = \
+        json.loads(buf[head_start:body_start])
+    
+    message = Message(
+        version=msg_version,
+        id=msg_id,
+        trace_id=trace_id,
+        from_agent=AgentRef(*frm),
+        to_agent=AgentRef(*to),
+        type=_TYPES[type_code],
+        priority=_PRIORITIES[priority_code],
+        timestamp=timestamp,
+        ttl=ttl,
+        payload=_PENDING,
+        metadata=_PENDING
+    )
+    message.__dict__["_body"] = bytes(buf[body_start:body_start + body_len])
+    return message
+
+# ============================================================================
+# 队列指标
+# ============================================================================
+
+class QueueStats:
+    """
+    每个 Agent 的增量队列指标, 存放在 <agent>/queue.stats
+    
+    每个优先级一个定长槽位:
+        depth, enqueued, dequeued, expired       计数器
+        updated_at, enqueue_rate, dequeue_rate   指数衰减速率 (条/秒, 时间常数 RATE_WINDOW)
+        HIST_BUCKETS 个 log2 桶                   租用时的排队时长直方图 (按 HIST_WINDOW 衰减)
+    
+    入队/租用/确认/过期时在文件锁内读改写这个约 1KB 的文件; 读取指标只读它,
+    与积压深度无关。文件首次创建时由后端统计一次 depth 初值。
+    """
+    
+    RATE_WINDOW = 60.0
+    HIST_WINDOW = 600.0
+    # 桶 0: < 1ms; 桶 i: [2^(i-1), 2^i) ms; 最后一桶 >= 2^22 ms (约 70 分钟)
+    HIST_BUCKETS = 24
+    
+    _SLOT = struct.Struct(f"<qQQQddd{HIST_BUCKETS}d")
+    _HIST = 7
+    
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+    
+    def _path(self, agent_id: str) -> Path:
+        return self.base_path / agent_id / "queue.stats"
+    
+    def _empty(self, now: float, depth: int) -> list:
+        return [depth, 0, 0, 0, now, 0.0, 0.0] + [0.0] * self.HIST_BUCKETS
+    
+    def _decay(self, slot: list, now: float):
+        """把速率和直方图衰减到 now"""
+        dt = now - slot[4]
+        if dt <= 0:
+            return
+        rate_decay = math.exp(-dt / self.RATE_WINDOW)
+        slot[5] *= rate_decay
+        slot[6] *= rate_decay
+        hist_decay = math.exp(-dt / self.HIST_WINDOW)
+        for i in range(self._HIST, len(slot)):
+            slot[i] *= hist_decay
+        slot[4] = now
+    
+    @classmethod
+    def _bucket(cls, wait: float) -> int:
+        ms = wait * 1000
+        if ms < 1:
+            return 0
+        return min(cls.HIST_BUCKETS - 1, int(math.log2(ms)) + 1)
+    
+    @staticmethod
+    def quantile(hist: List[float], q: float) -> Optional[float]:
+        """按 log2 直方图估算分位数 (秒), 桶内线性插值; 没有样本时返回 None"""
+        total = sum(hist)
+        if total <= 0:
+            return None
+        target = q * total
+        seen = 0.0
+        for i, count in enumerate(hist):
+            if count <= 0:
+                continue
+            if seen + count >= target:
+                low = 0.0 if i == 0 else 2.0 ** (i - 1)
+                return (low + (2.0 ** i - low) * (target - seen) / count) / 1000
+            seen += count
+        return 2.0 ** (len(hist) - 1) / 1000
+    
+    def update(self, agent_id: str, seed,
+               enqueued: Optional[Dict[Priority, int]] = None,
+               dequeued: Optional[Dict[Priority, int]] = None,
+               expired: Optional[Dict[Priority, int]] = None,
+               waits: Optional[Dict[Priority, List[float]]] = None):
+        """
+        记录一批事件 (在改动 inbox 之后调用)
+        
+        Args:
+            agent_id: Agent ID
+            seed: 文件不存在时调用, 返回 {优先级: 当前待处理数} 作为 depth 初值;
+                  初值已包含本批事件的结果, 因此本批不再改动 depth
+            enqueued / dequeued / expired: {优先级: 条数}
+            waits: {优先级: [租用时的排队秒数]}
+        """
+        enqueued, dequeued = enqueued or {}, dequeued or {}
+        expired, waits = expired or {}, waits or {}
+        now = time.time()
+        size = self._SLOT.size * len(PRIORITY_ORDER)
+        
+        fd = os.open(self._path(agent_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, size, 0)
+            seeded = len(data) != size
+            if seeded:
+                pending = seed()
+                slots = [self._empty(now, pending.get(p, 0)) for p in PRIORITY_ORDER]
+            else:
+                slots = [list(slot) for slot in self._SLOT.iter_unpack(data)]
+            
+            for priority, slot in zip(PRIORITY_ORDER, slots):
+                self._decay(slot, now)
+                added = enqueued.get(priority, 0)
+                removed = dequeued.get(priority, 0) + expired.get(priority, 0)
+                if not seeded:
+                    slot[0] += added - removed
+                slot[1] += added
+                slot[2] += dequeued.get(priority, 0)
+                slot[3] += expired.get(priority, 0)
+                slot[5] += added / self.RATE_WINDOW
+                slot[6] += dequeued.get(priority, 0) / self.RATE_WINDOW
+                for wait in waits.get(priority, ()):
+                    slot[self._HIST + self._bucket(wait)] += 1
+            
+            os.pwrite(fd, b"".join(self._SLOT.pack(*slot) for slot in slots), 0)
+        finally:
+            os.close(fd)
+    
+    def snapshot(self, agent_id: str, seed) -> Dict[Priority, Dict[str, Any]]:
+        """
+        读取各优先级当前 (已衰减到此刻的) 指标
+        
+        只读: 文件不存在时用 seed() 的待处理数作为 depth, 其余计数为 0,
+        不创建文件 (由下一次收发创建)。
+        """
+        try:
+            with open(self._path(agent_id), 'rb') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        
+        now = time.time()
+        if len(data) == self._SLOT.size * len(PRIORITY_ORDER):
+            slots = [list(slot) for slot in self._SLOT.iter_unpack(data)]
+        else:
+            pending = seed()
+            slots = [self._empty(now, pending.get(p, 0)) for p in PRIORITY_ORDER]
+        
+        result = {}
+        for priority, slot in zip(PRIORITY_ORDER, slots):
+            self._decay(slot, now)
+            result[priority] = {
+                # 并发写入方的初值统计可能有微小偏差, 不报告负数
+                "depth": max(0, slot[0]),
+                "enqueued_total": slot[1],
+                "dequeued_total": slot[2],
+                "expired_total": slot[3],
+                "enqueue_rate": slot[5],
+                "dequeue_rate": slot[6],
+                "histogram": slot[self._HIST:],
+            }
+        return result
+
+
+_PROMETHEUS_METRICS = [
+    # (指标名, 类型, 字段, 说明)
+    ("clawos_queue_depth", "gauge", "depth",
+     "Messages waiting or leased in the inbox"),
+    ("clawos_queue_oldest_age_seconds", "gauge", "oldest_age_seconds",
+     "Age of the oldest unprocessed message"),
+    ("clawos_queue_enqueued_total", "counter", "enqueued_total",
+     "Messages written to the inbox"),
+    ("clawos_queue_dequeued_total", "counter", "dequeued_total",
+     "Messages acknowledged"),
+    ("clawos_queue_expired_total", "counter", "expired_total",
+     "Messages dropped after their TTL"),
+    ("clawos_queue_enqueue_rate", "gauge", "enqueue_rate",
+     "Messages enqueued per second (exponentially weighted)"),
+    ("clawos_queue_dequeue_rate", "gauge", "dequeue_rate",
+     "Messages acknowledged per second (exponentially weighted)"),
+]
+
+
+def _prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(metrics: Dict[str, Any]) -> str:
+    """把 MessageQueue.metrics() 的结果渲染为 Prometheus 文本格式 (按 agent/priority 打标签)"""
+    samples = []
+    for agent, summary in sorted(metrics["agents"].items()):
+        for priority, values in summary["priorities"].items():
+            samples.append((f'agent="{_prometheus_label(agent)}",priority="{priority}"', values))
+    
+    lines = []
+    for name, kind, field, help_text in _PROMETHEUS_METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, values in samples:
+            lines.append(f"{name}{{{labels}}} {values[field]:g}")
+    
+    name = "clawos_queue_time_in_queue_seconds"
+    lines.append(f"# HELP {name} Time from send to lease, decaying histogram estimate")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, values in samples:
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+            value = values["time_in_queue_seconds"][key]
+            if value is not None:
+                lines.append(f'{name}{{{labels},quantile="{quantile}"}} {value:g}')
+    
+    return "\n".join(lines) + "\n"
+
+
+# ============================================================================
+# 存储后端
+# ============================================================================
+
+class InboxBackend:
+    """Inbox 存储后端接口"""
+    
+    # 新消息落盘时会被写入/移入的文件后缀, 用于过滤目录变更事件
+    WAKE_SUFFIX = ".json"
+    
+    def __init__(self, base_path: Path, fsync: bool = True):
+        self.base_path = base_path
+        # 每批写入/确认结束时是否 fsync 落盘
+        self.fsync = fsync
+        self.stats = QueueStats(base_path)
     
     def _get_inbox_path(self, agent_id: str) -> Path:
         """获取 Agent 的 inbox 路径"""
@@ -97,12 +468,1472 @@ class MessageQueue:
         inbox.mkdir(parents=True, exist_ok=True)
         return inbox
     
+    @classmethod
+    def owns(cls, inbox: Path) -> bool:
+        """inbox 目录在磁盘上是否是本后端的布局"""
+        raise NotImplementedError
+    
     def _get_processed_path(self, agent_id: str) -> Path:
         """获取已处理消息路径"""
         processed = self.base_path / agent_id / "processed"
         processed.mkdir(parents=True, exist_ok=True)
         return processed
     
+    def append_many(self, agent_id: str, messages: List[Message]) -> None:
+        """把一批消息写入同一个 inbox, 整批只提交一次"""
+        raise NotImplementedError
+    
+    def append(self, message: Message) -> None:
+        """写入一条消息到目标 inbox"""
+        self.append_many(message.to_agent.agent, [message])
+    
+    def read(self, agent_id: str, limit: int,
+             visibility_timeout: float = 0) -> List[Message]:
+        """
+        按优先级、再按时间读取最多 limit 条可投递消息
+        
+        visibility_timeout > 0 时原子地租用 (lease) 这些消息: 租期内其他消费者
+        读不到, 租期内未确认的消息到期后重新可投递; 为 0 时只查看, 不租用。
+        """
+        raise NotImplementedError
+    
+    def ack_many(self, agent_id: str, message_ids: List[str]) -> List[str]:
+        """批量确认消息 (结束租用), 返回实际确认的消息 ID; 已确认或不存在的不算"""
+        raise NotImplementedError
+    
+    def ack(self, agent_id: str, message_id: str) -> bool:
+        """标记消息已处理"""
+        return bool(self.ack_many(agent_id, [message_id]))
+    
+    def watch_paths(self, agent_id: str) -> List[Path]:
+        """新消息到达时会发生变更的目录"""
+        raise NotImplementedError
+    
+    @staticmethod
+    def _fsync_dir(path: Path):
+        """fsync 目录本身, 使其中的新建/重命名持久化"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    @staticmethod
+    def _expires_at(message: Message) -> float:
+        """消息过期时刻 (epoch 秒)"""
+        return datetime.fromisoformat(message.timestamp).timestamp() + message.ttl
+    
+    def agents(self) -> List[str]:
+        """已有 inbox 或 processed 目录的 Agent 列表"""
+        if not self.base_path.exists():
+            return []
+        return sorted(d.name for d in self.base_path.iterdir()
+                      if (d / "inbox").is_dir() or (d / "processed").is_dir())
+    
+    # ---- 指标 ----
+    
+    # pending_counts / oldest_enqueued_at 只读: 不创建目录, 不导入遗留消息
+    
+    def pending_counts(self, agent_id: str) -> Dict[Priority, int]:
+        """各优先级待处理 (未确认) 消息数; 需要扫描, 只用于初始化 QueueStats"""
+        raise NotImplementedError
+    
+    def oldest_enqueued_at(self, agent_id: str) -> Dict[Priority, float]:
+        """各优先级最早一条待处理消息的时间戳 (epoch 秒), 空桶不出现在结果中"""
+        raise NotImplementedError
+    
+    @staticmethod
+    def _list_names(path: Path) -> List[str]:
+        """目录下的文件名; 目录不存在时为空"""
+        try:
+            with os.scandir(path) as it:
+                return [entry.name for entry in it]
+        except FileNotFoundError:
+            return []
+    
+    def _record(self, agent_id: str, **events):
+        """更新队列指标; 指标写入失败不影响收发"""
+        try:
+            self.stats.update(agent_id, lambda: self.pending_counts(agent_id), **events)
+        except OSError as e:
+            print(f"Error updating queue stats for {agent_id}: {e}")
+    
+    # ---- 过期清理与归档 ----
+    
+    def reap_expired(self, agent_id: str) -> int:
+        """
+        把已过期的未处理消息移出 inbox, 只依据过期索引, 不解析消息内容; 返回条数
+        
+        过期消息与已确认消息一样算作已处理, 由 compact 一并归档。
+        """
+        raise NotImplementedError
+    
+    def compact(self, agent_id: str) -> Dict[str, int]:
+        """
+        把已处理 (已确认或已过期) 消息归档到按天压缩的 archive/processed-YYYY-MM-DD.ndjson.gz
+        
+        Returns:
+            {"archived": 归档条数, "bytes_reclaimed": 释放字节, "inodes_reclaimed": 释放文件数}
+        """
+        raise NotImplementedError
+    
+    def _archive_path(self, agent_id: str, day: str) -> Path:
+        archive = self.base_path / agent_id / "archive"
+        archive.mkdir(parents=True, exist_ok=True)
+        return archive / f"processed-{day}.ndjson.gz"
+    
+    def _append_archive(self, agent_id: str, day: str, records: List[bytes]) -> int:
+        """追加一组记录到当天归档 (gzip 多成员追加), 返回归档文件增长的字节数"""
+        path = self._archive_path(agent_id, day)
+        before = path.stat().st_size if path.exists() else 0
+        with gzip.open(path, 'ab') as f:
+            for record in records:
+                f.write(record + b"\n")
+        return path.stat().st_size - before
+
+
+class FileInboxBackend(InboxBackend):
+    """
+    兼容模式: 每条消息一个 JSON 文件
+    
+    消息按优先级分桶存放在 inbox/<priority>/ 下, 文件名为
+    <时间戳>_<过期时刻>_<消息 ID>.json: 目录排序即出队顺序, 文件名本身就是
+    过期索引, 排序和过期判断都无需打开文件。
+    
+    租用通过原子 rename 到 inbox/.leased/<租期>~<优先级>~<原文件名> 实现,
+    并发消费者中只有一个 rename 会成功。
+    """
+    
+    def __init__(self, base_path: Path, fsync: bool = True):
+        super().__init__(base_path, fsync)
+        # (agent_id, message_id) -> 文件路径, 加速同进程内的 ack
+        self._paths: Dict[tuple, Path] = {}
+        self._migrated: set = set()
+    
+    @classmethod
+    def _file_name(cls, message: Message) -> str:
+        ts = datetime.fromisoformat(message.timestamp).timestamp()
+        return f"{ts:017.6f}_{int(cls._expires_at(message)):010d}_{message.id}.json"
+    
+    @staticmethod
+    def _name_expires_at(name: str) -> float:
+        try:
+            return float(name.split("_", 2)[1])
+        except (IndexError, ValueError):
+            return float("inf")
+    
+    @classmethod
+    def owns(cls, inbox: Path) -> bool:
+        return (inbox / ".leased").is_dir() or \
+            any((inbox / priority.value).is_dir() for priority in PRIORITY_ORDER) or \
+            any(inbox.glob("*.json"))
+    
+    def _open_inbox(self, agent_id: str) -> Path:
+        inbox = self._get_inbox_path(agent_id)
+        if agent_id not in self._migrated:
+            self._migrated.add(agent_id)
+            for priority in PRIORITY_ORDER:
+                (inbox / priority.value).mkdir(exist_ok=True)
+            (inbox / ".leased").mkdir(exist_ok=True)
+            self._import_legacy(inbox)
+        return inbox
+    
+    def _retire(self, agent_id: str, msg_file: str) -> bool:
+        """把过期消息文件移入 processed/ (不打开文件), 返回是否由本次移走"""
+        message_id = os.path.basename(msg_file).split("_", 2)[-1]
+        try:
+            os.rename(msg_file, self._get_processed_path(agent_id) / message_id)
+            return True
+        except FileNotFoundError:
+            # 已被其他消费者租用或移走
+            return False
+    
+    def _requeue_expired_leases(self, inbox: Path, now: float):
+        """租期已到仍未确认的消息放回原优先级桶"""
+        with os.scandir(inbox / ".leased") as it:
+            for entry in it:
+                try:
+                    lease_until, priority, name = entry.name.split("~", 2)
+                    if float(lease_until) >= now:
+                        continue
+                    os.rename(entry.path, inbox / priority / name)
+                except (ValueError, FileNotFoundError):
+                    continue
+    
+    def _import_legacy(self, inbox: Path):
+        """把未分桶的遗留 *.json 移入对应优先级桶 (每个进程每个 inbox 只检查一次)"""
+        for msg_file in inbox.glob("*.json"):
+            try:
+                with open(msg_file, 'r', encoding='utf-8') as f:
+                    msg = Message.from_dict(json.load(f))
+                msg_file.rename(inbox / msg.priority.value / self._file_name(msg))
+            except Exception as e:
+                print(f"Error reading message {msg_file}: {e}")
+    
+    def append_many(self, agent_id: str, messages: List[Message]) -> None:
+        inbox = self._open_inbox(agent_id)
+        buckets = set()
+        
+        for message in messages:
+            bucket = inbox / message.priority.value
+            msg_file = bucket / self._file_name(message)
+            # 先写临时文件再改名, 读取方不会看到写了一半的消息
+            tmp = bucket / f".{msg_file.name}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(_dumps(message.to_dict()))
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp, msg_file)
+            buckets.add(bucket)
+        
+        if self.fsync:
+            for bucket in buckets:
+                self._fsync_dir(bucket)
+        self._record(agent_id, enqueued=Counter(m.priority for m in messages))
+    
+    def read(self, agent_id: str, limit: int,
+             visibility_timeout: float = 0) -> List[Message]:
+        inbox = self._open_inbox(agent_id)
+        messages = []
+        expired: Counter = Counter()
+        now = time.time()
+        self._requeue_expired_leases(inbox, now)
+        
+        for priority in PRIORITY_ORDER:
+            if len(messages) >= limit:
+                break
+            
+            for msg_file in sorted((inbox / priority.value).glob("*.json")):
+                if len(messages) >= limit:
+                    break
+                
+                # 过期消息直接移入 processed/, 不打开文件
+                if self._name_expires_at(msg_file.name) < now:
+                    if self._retire(agent_id, msg_file):
+                        expired[priority] += 1
+                    continue
+                
+                if visibility_timeout > 0:
+                    leased = inbox / ".leased" / \
+                        f"{now + visibility_timeout:017.6f}~{priority.value}~{msg_file.name}"
+                    try:
+                        os.rename(msg_file, leased)
+                    except FileNotFoundError:
+                        # 被其他消费者抢先租用
+                        continue
+                    msg_file = leased
+                
+                try:
+                    with open(msg_file, 'rb') as f:
+                        msg = decode_message(f.read())
+                    self._paths[(agent_id, msg.id)] = msg_file
+                    messages.append(msg)
+                except Exception as e:
+                    print(f"Error reading message {msg_file}: {e}")
+        
+        waits: Dict[Priority, List[float]] = {}
+        if visibility_timeout > 0:
+            for msg in messages:
+                waits.setdefault(msg.priority, []).append(
+                    now - datetime.fromisoformat(msg.timestamp).timestamp())
+        if expired or waits:
+            self._record(agent_id, expired=expired, waits=waits)
+        return messages
+    
+    @staticmethod
+    def _bucket_priority(path: Path) -> Priority:
+        """消息文件所在桶对应的优先级 (租用中的文件从文件名解析)"""
+        if path.parent.name == ".leased":
+            return Priority(path.name.split("~", 2)[1])
+        return Priority(path.parent.name)
+    
+    def _find_file(self, inbox: Path, agent_id: str, message_id: str) -> Optional[Path]:
+        src = self._paths.pop((agent_id, message_id), None)
+        if src is not None and src.exists():
+            return src
+        for src in (inbox / ".leased").glob(f"*_{message_id}.json"):
+            return src
+        for priority in PRIORITY_ORDER:
+            for src in (inbox / priority.value).glob(f"*_{message_id}.json"):
+                return src
+        return None
+    
+    def ack_many(self, agent_id: str, message_ids: List[str]) -> List[str]:
+        inbox = self._open_inbox(agent_id)
+        processed = self._get_processed_path(agent_id)
+        buckets = set()
+        acked: Counter = Counter()
+        done = []
+        
+        for message_id in message_ids:
+            src = self._find_file(inbox, agent_id, message_id)
+            if src is None:
+                continue
+            try:
+                src.rename(processed / f"{message_id}.json")
+            except FileNotFoundError:
+                continue
+            buckets.add(src.parent)
+            acked[self._bucket_priority(src)] += 1
+            done.append(message_id)
+        
+        if acked:
+            if self.fsync:
+                self._fsync_dir(processed)
+                for bucket in buckets:
+                    self._fsync_dir(bucket)
+            self._record(agent_id, dequeued=acked)
+        return done
+    
+    def watch_paths(self, agent_id: str) -> List[Path]:
+        inbox = self._open_inbox(agent_id)
+        return [inbox / priority.value for priority in PRIORITY_ORDER]
+    
+    def _pending_names(self, agent_id: str):
+        """产出 (优先级, 文件名) 的待处理消息, 含租用中的; 只列目录"""
+        inbox = self.base_path / agent_id / "inbox"
+        for priority in PRIORITY_ORDER:
+            for name in self._list_names(inbox / priority.value):
+                if name.endswith(".json"):
+                    yield priority, name
+        for name in self._list_names(inbox / ".leased"):
+            parts = name.split("~", 2)
+            if len(parts) == 3 and parts[1] in Priority._value2member_map_:
+                yield Priority(parts[1]), parts[2]
+    
+    def pending_counts(self, agent_id: str) -> Dict[Priority, int]:
+        return Counter(priority for priority, _ in self._pending_names(agent_id))
+    
+    def oldest_enqueued_at(self, agent_id: str) -> Dict[Priority, float]:
+        # 兼容模式没有游标, 需要列出桶目录 (只读文件名, 不打开文件)
+        oldest: Dict[Priority, float] = {}
+        for priority, name in self._pending_names(agent_id):
+            try:
+                ts = float(name.split("_", 1)[0])
+            except ValueError:
+                continue
+            if ts < oldest.get(priority, float("inf")):
+                oldest[priority] = ts
+        return oldest
+    
+    def reap_expired(self, agent_id: str) -> int:
+        inbox = self._open_inbox(agent_id)
+        now = time.time()
+        reaped: Counter = Counter()
+        for priority in PRIORITY_ORDER:
+            with os.scandir(inbox / priority.value) as it:
+                for entry in it:
+                    if entry.name.endswith(".json") and self._name_expires_at(entry.name) < now \
+                            and self._retire(agent_id, entry.path):
+                        reaped[priority] += 1
+        if reaped:
+            self._record(agent_id, expired=reaped)
+        return sum(reaped.values())
+    
+    def compact(self, agent_id: str) -> Dict[str, int]:
+        processed = self._get_processed_path(agent_id)
+        by_day: Dict[str, List[os.DirEntry]] = {}
+        with os.scandir(processed) as it:
+            for entry in it:
+                if entry.name.endswith(".json") and entry.is_file():
+                    day = datetime.fromtimestamp(entry.stat().st_mtime).date().isoformat()
+                    by_day.setdefault(day, []).append(entry)
+        
+        stats = {"archived": 0, "bytes_reclaimed": 0, "inodes_reclaimed": 0}
+        for day, entries in sorted(by_day.items()):
+            records = []
+            freed = 0
+            for entry in entries:
+                with open(entry.path, 'rb') as f:
+                    data = f.read().strip()
+                # 旧版本写入的是缩进格式, 归档时压成一行
+                if b"\n" in data:
+                    data = _dumps(json.loads(data))
+                records.append(data)
+                freed += entry.stat().st_size
+            
+            grown = self._append_archive(agent_id, day, records)
+            for entry in entries:
+                os.unlink(entry.path)
+            
+            stats["archived"] += len(records)
+            stats["bytes_reclaimed"] += freed - grown
+            stats["inodes_reclaimed"] += len(entries)
+        
+        return stats
+
+
+_IndexEntry = namedtuple(
+    "_IndexEntry", "segment offset length state lease_until expires_at id_hash")
+
+
+class _IdMap:
+    """进程内缓存的 ids.map: 文件生成号, 已读到的偏移, 映射, 各桶已收录到的序号"""
+    __slots__ = ("token", "offset", "ids", "next")
+    
+    def __init__(self, token: bytes, offset: int, ids: dict, next: dict):
+        self.token = token
+        self.offset = offset
+        self.ids = ids
+        self.next = next
+
+
+class SegmentLogBackend(InboxBackend):
+    """
+    追加写分段日志: 每个 inbox 由若干 segment 文件、按优先级分桶的定长偏移索引和消费游标组成
+    
+    布局:
+        <agent>/inbox/segments/00000000.log   消息记录 (默认二进制线格式, 可选紧凑 JSON), 以换行分隔
+        <agent>/inbox/<priority>.idx          头部 (起始序号) + 定长索引项 (segment, offset, length, state, ...)
+        <agent>/inbox/<priority>.cur          该桶第一个未处理索引项的序号
+        <agent>/inbox/<priority>.skip         租用跳过位置: 此前没有待投递项, 以及其中最早的租期
+        <agent>/inbox/ids.map                 id 摘要 -> (优先级, 序号), 由索引增量生成, 可随时删除重建
+        <agent>/inbox/.lock                   写入/确认时的进程间锁
+    
+    receive(limit=N) 依次从各优先级桶的跳过位置处顺序读取索引项并按偏移读取记录,
+    代价为 O(N), 与积压深度无关; 同一优先级内按入队顺序出队。游标 (确认进度)
+    与跳过位置 (租用进度) 分开维护: 队头租用中未确认的消息只挡住游标, 不会让
+    之后的 receive 反复扫描它们, 直到其中最早的租期到期。
+    
+    索引项自带过期时刻, 兼作过期索引。compact() 把游标之前已全部处理完的
+    segment 归档后删除, 并丢弃对应的索引项 (头部起始序号随之前移)。
+    
+    租用在持锁状态下原地改写索引项的 state/lease_until, 只扫描定长索引,
+    不读取 segment; 租期过后未确认的项自动重新可投递。
+    """
+    
+    SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+    WAKE_SUFFIX = ".idx"
+    
+    # segment, offset, length, state, lease_until, expires_at, id_hash
+    _ENTRY = struct.Struct("<IQIBdd8s")
+    _LEASE = struct.Struct("<Bd")
+    # 索引文件头: 第一项的序号 (compact 后不再从 0 开始)
+    _HEADER = struct.Struct("<Q8x")
+    _CURSOR = struct.Struct("<Q")
+    # 跳过位置, [游标, 跳过位置) 内租用项的最早租期
+    _SKIP = struct.Struct("<Qd")
+    # ids.map: 头部为随机生成号 (重建后变化), 之后为 (id 摘要, 优先级下标, 序号)
+    _ID_ENTRY = struct.Struct("<8sBQ")
+    _ID_TOKEN_SIZE = 8
+    _STATE_OFFSET = 16
+    
+    READY = 0
+    ACKED = 1
+    EXPIRED = 2
+    LEASED = 3
+    
+    # 一次从索引读取的项数
+    _SCAN_CHUNK = 256
+    
+    def __init__(self, base_path: Path, fsync: bool = True,
+                 wire_format: str = "binary"):
+        super().__init__(base_path, fsync)
+        # 新写入记录的编码; 读取时自动识别, 两种格式可以混存
+        self.wire_format = wire_format
+        # (agent_id, message_id) -> (优先级, 索引序号), 加速同进程内的 ack
+        self._slots: Dict[tuple, tuple] = {}
+        # inbox -> 已加载的 ids.map
+        self._id_maps: Dict[Path, _IdMap] = {}
+        self._migrated: set = set()
+    
+    # ---- 路径与锁 ----
+    
+    def _segment_path(self, inbox: Path, segment: int) -> Path:
+        return inbox / "segments" / f"{segment:08d}.log"
+    
+    @staticmethod
+    def _index_path(inbox: Path, priority: Priority) -> Path:
+        return inbox / f"{priority.value}.idx"
+    
+    @classmethod
+    def owns(cls, inbox: Path) -> bool:
+        return (inbox / "segments").is_dir() or any(inbox.glob("*.idx"))
+    
+    @contextmanager
+    def _locked(self, inbox: Path):
+        """inbox 级别的进程间互斥锁"""
+        with open(inbox / ".lock", 'a+b') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    
+    @staticmethod
+    def _id_hash(message_id: str) -> bytes:
+        return hashlib.blake2b(message_id.encode('utf-8'), digest_size=8).digest()
+    
+    def _read_cursor(self, inbox: Path, priority: Priority) -> int:
+        try:
+            with open(inbox / f"{priority.value}.cur", 'rb') as f:
+                return self._CURSOR.unpack(f.read(self._CURSOR.size))[0]
+        except (FileNotFoundError, struct.error):
+            return 0
+    
+    def _write_cursor(self, inbox: Path, priority: Priority, cursor: int):
+        tmp = inbox / f"{priority.value}.cur.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(self._CURSOR.pack(cursor))
+        os.replace(tmp, inbox / f"{priority.value}.cur")
+    
+    def _read_skip(self, inbox: Path, priority: Priority) -> tuple:
+        """(跳过位置, 最早租期); 文件不存在时从游标开始扫描"""
+        try:
+            with open(inbox / f"{priority.value}.skip", 'rb') as f:
+                return self._SKIP.unpack(f.read(self._SKIP.size))
+        except (FileNotFoundError, struct.error):
+            return 0, 0.0
+    
+    def _write_skip(self, inbox: Path, priority: Priority, skip: int, lease_min: float):
+        tmp = inbox / f"{priority.value}.skip.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(self._SKIP.pack(skip, lease_min))
+        os.replace(tmp, inbox / f"{priority.value}.skip")
+    
+    # ---- 写入 ----
+    
+    def _open_inbox(self, agent_id: str) -> Path:
+        inbox = self._get_inbox_path(agent_id)
+        if agent_id not in self._migrated:
+            self._migrated.add(agent_id)
+            (inbox / "segments").mkdir(exist_ok=True)
+            self._import_legacy(agent_id, inbox)
+        return inbox
+    
+    def _import_legacy(self, agent_id: str, inbox: Path):
+        """把兼容模式遗留的 *.json 消息导入日志 (每个进程每个 inbox 只检查一次)"""
+        legacy = sorted(inbox.glob("*.json"))
+        for priority in PRIORITY_ORDER:
+            legacy.extend(sorted((inbox / priority.value).glob("*.json")))
+        if not legacy:
+            return
+        
+        messages = []
+        for msg_file in legacy:
+            try:
+                with open(msg_file, 'r', encoding='utf-8') as f:
+                    messages.append(Message.from_dict(json.load(f)))
+            except Exception as e:
+                print(f"Error reading message {msg_file}: {e}")
+                continue
+        
+        messages.sort(key=lambda m: m.timestamp)
+        with self._locked(inbox):
+            self._append_locked(inbox, messages)
+        for msg_file in legacy:
+            msg_file.unlink(missing_ok=True)
+    
+    def _read_header(self, f) -> int:
+        """读取已打开索引文件的起始序号"""
+        f.seek(0)
+        header = f.read(self._HEADER.size)
+        return self._HEADER.unpack(header)[0] if len(header) == self._HEADER.size else 0
+    
+    def _entry_pos(self, base: int, slot: int) -> int:
+        return self._HEADER.size + (slot - base) * self._ENTRY.size
+    
+    def _last_segment(self, inbox: Path) -> int:
+        """各桶索引最后一项所在 segment 的最大值"""
+        segment = 0
+        for priority in PRIORITY_ORDER:
+            index_path = self._index_path(inbox, priority)
+            if not index_path.exists():
+                continue
+            size = index_path.stat().st_size - self._HEADER.size
+            size -= size % self._ENTRY.size
+            if size > 0:
+                with open(index_path, 'rb') as f:
+                    f.seek(self._HEADER.size + size - self._ENTRY.size)
+                    segment = max(segment, self._ENTRY.unpack(f.read(self._ENTRY.size))[0])
+        return segment
+    
+    def _append_locked(self, inbox: Path, messages: List[Message]):
+        """
+        在持有锁的前提下追加记录并写索引
+        
+        先写数据后写索引; 整批记录拼成一次 write, 每个文件最多 fsync 一次。
+        """
+        segment = self._last_segment(inbox)
+        entries: Dict[Priority, List[bytes]] = {}
+        
+        seg_file = open(self._segment_path(inbox, segment), 'ab')
+        try:
+            offset = seg_file.tell()
+            pending: List[bytes] = []
+            for message in messages:
+                if offset >= self.SEGMENT_MAX_BYTES:
+                    self._flush_segment(seg_file, pending)
+                    seg_file.close()
+                    segment += 1
+                    seg_file = open(self._segment_path(inbox, segment), 'ab')
+                    offset = 0
+                
+                record = encode_message(message, self.wire_format)
+                pending.append(record + b"\n")
+                entries.setdefault(message.priority, []).append(self._ENTRY.pack(
+                    segment, offset, len(record), self.READY, 0.0,
+                    self._expires_at(message), self._id_hash(message.id)
+                ))
+                offset += len(record) + 1
+            self._flush_segment(seg_file, pending)
+        finally:
+            seg_file.close()
+        
+        for priority, packed in entries.items():
+            with open(self._index_path(inbox, priority), 'ab') as f:
+                if f.tell() == 0:
+                    f.write(self._HEADER.pack(0))
+                f.write(b"".join(packed))
+                if self.fsync:
+                    os.fsync(f.fileno())
+    
+    def _flush_segment(self, seg_file, pending: List[bytes]):
+        if not pending:
+            return
+        seg_file.write(b"".join(pending))
+        seg_file.flush()
+        if self.fsync:
+            os.fsync(seg_file.fileno())
+        pending.clear()
+    
+    def append_many(self, agent_id: str, messages: List[Message]) -> None:
+        inbox = self._open_inbox(agent_id)
+        with self._locked(inbox):
+            self._append_locked(inbox, messages)
+            self._record(agent_id, enqueued=Counter(m.priority for m in messages))
+    
+    # ---- 读取 ----
+    
+    def _iter_entries(self, inbox: Path, priority: Priority, start: int):
+        """从 start 序号开始顺序产出 (序号, 索引项)"""
+        index_path = self._index_path(inbox, priority)
+        if not index_path.exists():
+            return
+        
+        with open(index_path, 'rb') as f:
+            base = self._read_header(f)
+            slot = max(start, base)
+            f.seek(self._entry_pos(base, slot))
+            while True:
+                chunk = f.read(self._ENTRY.size * self._SCAN_CHUNK)
+                usable = len(chunk) - len(chunk) % self._ENTRY.size
+                if not usable:
+                    return
+                for entry in self._ENTRY.iter_unpack(chunk[:usable]):
+                    yield slot, _IndexEntry._make(entry)
+                    slot += 1
+    
+    def _set_states(self, inbox: Path, priority: Priority, slots: List[int],
+                    state: int, lease_until: float = 0.0):
+        """原地改写一批索引项的状态和租期"""
+        packed = self._LEASE.pack(state, lease_until)
+        with open(self._index_path(inbox, priority), 'r+b') as f:
+            base = self._read_header(f)
+            for slot in slots:
+                f.seek(self._entry_pos(base, slot) + self._STATE_OFFSET)
+                f.write(packed)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def _deliverable(self, entry: _IndexEntry, now: float) -> bool:
+        return entry.state == self.READY or \
+            (entry.state == self.LEASED and entry.lease_until < now)
+    
+    def _select(self, inbox: Path, limit: int, now: float,
+                lease_until: Optional[float] = None):
+        """
+        只扫描索引, 选出最多 limit 个可投递项; 顺带标记扫描到的过期项
+        
+        [游标, 跳过位置) 之间只有租用中或已处理的项, 其中最早的租期未到时
+        直接从跳过位置开始扫描。
+        
+        Args:
+            lease_until: 选中项将被租用到的时刻; 给出时计算新的跳过位置
+                         (调用方持锁并写回), 否则只读
+        
+        Returns:
+            ([(优先级, 序号, 索引项)], {优先级: [过期序号]}, {优先级: (跳过位置, 最早租期)})
+        """
+        selected = []
+        expired: Dict[Priority, List[int]] = {}
+        skips: Dict[Priority, tuple] = {}
+        for priority in PRIORITY_ORDER:
+            if len(selected) >= limit:
+                break
+            cursor = self._read_cursor(inbox, priority)
+            skip, lease_min = self._read_skip(inbox, priority)
+            skip = max(skip, cursor)
+            start = cursor if lease_min <= now else skip
+            # 重新扫描队头时, 队头的最早租期由本次扫描重新计算
+            new_min = float("inf") if start == cursor else lease_min
+            end = start
+            for slot, entry in self._iter_entries(inbox, priority, start):
+                if len(selected) >= limit:
+                    break
+                end = slot + 1
+                if not self._deliverable(entry, now):
+                    if entry.state == self.LEASED:
+                        new_min = min(new_min, entry.lease_until)
+                    continue
+                if entry.expires_at < now:
+                    expired.setdefault(priority, []).append(slot)
+                    continue
+                selected.append((priority, slot, entry))
+                if lease_until is not None:
+                    new_min = min(new_min, lease_until)
+            
+            if lease_until is not None:
+                if end < skip:
+                    # 没扫完队头: 保留旧的 (已到期的) 最早租期, 下次继续扫描
+                    new_min = min(new_min, lease_min)
+                # 扫描过的项处理后都不再是 READY
+                skips[priority] = (max(skip, end), new_min)
+        return selected, expired, skips
+    
+    def _expire(self, agent_id: str, inbox: Path, expired: Dict[Priority, List[int]]):
+        for priority, slots in expired.items():
+            self._set_states(inbox, priority, slots, self.EXPIRED)
+            self._advance_cursor(inbox, priority)
+        if expired:
+            self._record(agent_id, expired={p: len(slots) for p, slots in expired.items()})
+    
+    def read(self, agent_id: str, limit: int,
+             visibility_timeout: float = 0) -> List[Message]:
+        inbox = self._open_inbox(agent_id)
+        now = time.time()
+        
+        if visibility_timeout > 0:
+            # 选择 + 租用在同一把锁内完成, 并发消费者拿到的消息互不重叠
+            with self._locked(inbox):
+                selected, expired, skips = self._select(
+                    inbox, limit, now, now + visibility_timeout)
+                self._expire(agent_id, inbox, expired)
+                by_priority: Dict[Priority, List[int]] = {}
+                for priority, slot, _ in selected:
+                    by_priority.setdefault(priority, []).append(slot)
+                for priority, slots in by_priority.items():
+                    self._set_states(inbox, priority, slots, self.LEASED,
+                                     now + visibility_timeout)
+                for priority, (skip, lease_min) in skips.items():
+                    self._write_skip(inbox, priority, skip, lease_min)
+        else:
+            selected, expired, _ = self._select(inbox, limit, now)
+            if expired:
+                with self._locked(inbox):
+                    self._expire(agent_id, inbox, expired)
+        
+        messages = []
+        segments: Dict[int, Any] = {}
+        try:
+            for priority, slot, entry in selected:
+                try:
+                    if entry.segment not in segments:
+                        segments[entry.segment] = open(
+                            self._segment_path(inbox, entry.segment), 'rb')
+                    f = segments[entry.segment]
+                    f.seek(entry.offset)
+                    msg = decode_message(f.read(entry.length))
+                except Exception as e:
+                    print(f"Error reading message {agent_id}@{entry.segment}:{entry.offset}: {e}")
+                    continue
+                
+                self._slots[(agent_id, msg.id)] = (priority, slot)
+                messages.append(msg)
+        finally:
+            for f in segments.values():
+                f.close()
+        
+        if visibility_timeout > 0 and messages:
+            waits: Dict[Priority, List[float]] = {}
+            for msg in messages:
+                waits.setdefault(msg.priority, []).append(
+                    now - datetime.fromisoformat(msg.timestamp).timestamp())
+            self._record(agent_id, waits=waits)
+        return messages
+    
+    # ---- 确认 ----
+    
+    def _id_map(self, inbox: Path) -> Dict[bytes, tuple]:
+        """
+        id 摘要 -> (优先级, 序号) (持锁调用)
+        
+        只读取 ids.map 上次加载之后追加的部分, 再把索引中尚未收录的新项补进
+        文件; 文件被删除或重建 (生成号变化) 时重新加载。
+        """
+        path = inbox / "ids.map"
+        cached = self._id_maps.get(inbox)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            token = os.pread(fd, self._ID_TOKEN_SIZE, 0)
+            if len(token) != self._ID_TOKEN_SIZE:
+                token = os.urandom(self._ID_TOKEN_SIZE)
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, token, 0)
+            if cached is None or cached.token != token:
+                cached = self._id_maps[inbox] = _IdMap(token, self._ID_TOKEN_SIZE, {}, {})
+            
+            data = os.pread(fd, os.fstat(fd).st_size, cached.offset)
+            usable = len(data) - len(data) % self._ID_ENTRY.size
+            for id_hash, index, slot in self._ID_ENTRY.iter_unpack(data[:usable]):
+                priority = PRIORITY_ORDER[index]
+                cached.ids[id_hash] = (priority, slot)
+                cached.next[priority] = max(cached.next.get(priority, 0), slot + 1)
+            cached.offset += usable
+            
+            # 补录: 其他进程写入后还没有人确认过的索引项 (丢弃可能被截断的尾部记录)
+            fresh = []
+            for index, priority in enumerate(PRIORITY_ORDER):
+                for slot, entry in self._iter_entries(inbox, priority, cached.next.get(priority, 0)):
+                    fresh.append(self._ID_ENTRY.pack(entry.id_hash, index, slot))
+                    cached.ids[entry.id_hash] = (priority, slot)
+                    cached.next[priority] = slot + 1
+            if fresh:
+                data = b"".join(fresh)
+                os.pwrite(fd, data, cached.offset)
+                cached.offset += len(data)
+                os.ftruncate(fd, cached.offset)
+                if self.fsync:
+                    os.fsync(fd)
+        finally:
+            os.close(fd)
+        return cached.ids
+    
+    def _read_entries(self, inbox: Path, priority: Priority,
+                      slots: List[int]) -> Dict[int, _IndexEntry]:
+        """按序号读取索引项; 已被 compact 丢弃或超出末尾的序号不出现在结果中"""
+        entries = {}
+        with open(self._index_path(inbox, priority), 'rb') as f:
+            base = self._read_header(f)
+            for slot in slots:
+                if slot < base:
+                    continue
+                f.seek(self._entry_pos(base, slot))
+                data = f.read(self._ENTRY.size)
+                if len(data) == self._ENTRY.size:
+                    entries[slot] = _IndexEntry._make(self._ENTRY.unpack(data))
+        return entries
+    
+    def _find_slot(self, inbox: Path, agent_id: str, message_id: str) -> Optional[tuple]:
+        """消息的 (优先级, 序号) 候选位置, 由调用方核对状态"""
+        location = self._slots.pop((agent_id, message_id), None)
+        if location is not None:
+            return location
+        # 其他进程 receive 的消息: 查 ids.map, 不扫描索引
+        return self._id_map(inbox).get(self._id_hash(message_id))
+    
+    def _advance_cursor(self, inbox: Path, priority: Priority):
+        """游标越过已连续处理完的索引项"""
+        cursor = self._read_cursor(inbox, priority)
+        new_cursor = cursor
+        for slot, entry in self._iter_entries(inbox, priority, cursor):
+            if entry.state in (self.READY, self.LEASED):
+                break
+            new_cursor = slot + 1
+        if new_cursor != cursor:
+            self._write_cursor(inbox, priority, new_cursor)
+    
+    def ack_many(self, agent_id: str, message_ids: List[str]) -> List[str]:
+        inbox = self._open_inbox(agent_id)
+        by_priority: Dict[Priority, List[int]] = {}
+        located: Dict[tuple, str] = {}
+        
+        with self._locked(inbox):
+            candidates: Dict[Priority, Dict[int, bytes]] = {}
+            for message_id in message_ids:
+                location = self._find_slot(inbox, agent_id, message_id)
+                if location is not None:
+                    candidates.setdefault(location[0], {})[location[1]] = self._id_hash(message_id)
+                    located[location] = message_id
+            
+            # 只确认仍待处理的项: 重复 ack 不重复计数
+            for priority, wanted in candidates.items():
+                entries = self._read_entries(inbox, priority, list(wanted))
+                slots = [slot for slot, id_hash in wanted.items()
+                         if slot in entries and entries[slot].id_hash == id_hash
+                         and entries[slot].state in (self.READY, self.LEASED)]
+                if slots:
+                    by_priority[priority] = slots
+            
+            for priority, slots in by_priority.items():
+                self._set_states(inbox, priority, slots, self.ACKED)
+                self._advance_cursor(inbox, priority)
+            if by_priority:
+                self._record(agent_id, dequeued={p: len(slots) for p, slots in by_priority.items()})
+        
+        return [located[(priority, slot)]
+                for priority, slots in by_priority.items() for slot in slots]
+    
+    def watch_paths(self, agent_id: str) -> List[Path]:
+        return [self._open_inbox(agent_id)]
+    
+    # ---- 指标 ----
+    
+    def _pending_entries(self, inbox: Path, priority: Priority):
+        """游标之后仍未处理 (待投递或租用中) 的索引项"""
+        start = self._read_cursor(inbox, priority)
+        for slot, entry in self._iter_entries(inbox, priority, start):
+            if entry.state in (self.READY, self.LEASED):
+                yield slot, entry
+    
+    def pending_counts(self, agent_id: str) -> Dict[Priority, int]:
+        inbox = self.base_path / agent_id / "inbox"
+        return {priority: sum(1 for _ in self._pending_entries(inbox, priority))
+                for priority in PRIORITY_ORDER}
+    
+    def oldest_enqueued_at(self, agent_id: str) -> Dict[Priority, float]:
+        # 游标处就是最早的未处理项: 每个桶读一个索引项和一个记录头
+        inbox = self.base_path / agent_id / "inbox"
+        now = time.time()
+        oldest: Dict[Priority, float] = {}
+        for priority in PRIORITY_ORDER:
+            for _, entry in self._pending_entries(inbox, priority):
+                # 已过期但尚未清理的项不算积压
+                if entry.expires_at < now:
+                    continue
+                try:
+                    with open(self._segment_path(inbox, entry.segment), 'rb') as f:
+                        f.seek(entry.offset)
+                        oldest[priority] = decode_header(f.read(entry.length)).created_at
+                except (OSError, ValueError) as e:
+                    print(f"Error reading message {agent_id}@{entry.segment}:{entry.offset}: {e}")
+                break
+        return oldest
+    
+    # ---- 过期清理与归档 ----
+    
+    def reap_expired(self, agent_id: str) -> int:
+        inbox = self._open_inbox(agent_id)
+        now = time.time()
+        with self._locked(inbox):
+            expired: Dict[Priority, List[int]] = {}
+            for priority in PRIORITY_ORDER:
+                start = self._read_cursor(inbox, priority)
+                slots = [slot for slot, entry in self._iter_entries(inbox, priority, start)
+                         if entry.state == self.READY and entry.expires_at < now]
+                if slots:
+                    expired[priority] = slots
+            self._expire(agent_id, inbox, expired)
+        return sum(len(slots) for slots in expired.values())
+    
+    def compact(self, agent_id: str) -> Dict[str, int]:
+        inbox = self._open_inbox(agent_id)
+        stats = {"archived": 0, "bytes_reclaimed": 0, "inodes_reclaimed": 0}
+        
+        with self._locked(inbox):
+            # 所有桶游标处仍未处理的最小 segment, 以及正在写入的 segment, 都不能动
+            bound = self._last_segment(inbox)
+            cursors = {}
+            for priority in PRIORITY_ORDER:
+                cursors[priority] = self._read_cursor(inbox, priority)
+                for _, entry in self._iter_entries(inbox, priority, cursors[priority]):
+                    bound = min(bound, entry.segment)
+                    break
+            
+            doomed = sorted(
+                int(p.stem) for p in (inbox / "segments").glob("*.log") if int(p.stem) < bound
+            )
+            if not doomed:
+                return stats
+            
+            # 收集待删 segment 中已处理 (已确认或已过期) 的记录位置, 计算各桶新的起始序号
+            done: Dict[int, List[tuple]] = {}
+            new_bases: Dict[Priority, int] = {}
+            for priority in PRIORITY_ORDER:
+                new_base = None
+                for slot, entry in self._iter_entries(inbox, priority, 0):
+                    if slot >= cursors[priority] or entry.segment >= bound:
+                        new_base = slot
+                        break
+                    if entry.state in (self.ACKED, self.EXPIRED):
+                        done.setdefault(entry.segment, []).append((entry.offset, entry.length))
+                    new_base = slot + 1
+                if new_base is not None:
+                    new_bases[priority] = new_base
+            
+            day = datetime.now().date().isoformat()
+            for segment in doomed:
+                path = self._segment_path(inbox, segment)
+                records = []
+                with open(path, 'rb') as f:
+                    for offset, length in sorted(done.get(segment, [])):
+                        f.seek(offset)
+                        record = f.read(length)
+                        # 归档统一为 NDJSON
+                        if record.startswith(WIRE_MAGIC):
+                            record = _dumps(decode_message(record).to_dict())
+                        records.append(record)
+                if records:
+                    stats["bytes_reclaimed"] -= self._append_archive(agent_id, day, records)
+                    stats["archived"] += len(records)
+                stats["bytes_reclaimed"] += path.stat().st_size
+            
+            for priority, new_base in new_bases.items():
+                stats["bytes_reclaimed"] += self._rewrite_index(inbox, priority, new_base)
+            
+            for segment in doomed:
+                self._segment_path(inbox, segment).unlink()
+            stats["inodes_reclaimed"] += len(doomed)
+            # ids.map 中被丢弃的序号不再有效, 删除后由下一次 ack 从新的起始序号重建
+            (inbox / "ids.map").unlink(missing_ok=True)
+        
+        return stats
+    
+    def _rewrite_index(self, inbox: Path, priority: Priority, new_base: int) -> int:
+        """丢弃 new_base 之前的索引项 (原子替换), 返回释放的字节数"""
+        index_path = self._index_path(inbox, priority)
+        with open(index_path, 'rb') as f:
+            base = self._read_header(f)
+            if new_base <= base:
+                return 0
+            f.seek(self._entry_pos(base, new_base))
+            tail = f.read()
+        
+        tmp = index_path.with_suffix(".idx.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(self._HEADER.pack(new_base))
+            f.write(tail)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, index_path)
+        return (new_base - base) * self._ENTRY.size
+
+
+BACKENDS = {
+    "segment": SegmentLogBackend,
+    "file": FileInboxBackend,
+}
+
+
+def detect_backend(inbox: Path) -> Optional[str]:
+    """
+    识别磁盘上 inbox 的存储布局, 只检查目录结构
+    
+    Returns:
+        BACKENDS 中的名称; inbox 不存在或为空时返回 None
+    """
+    if not inbox.is_dir():
+        return None
+    for name, backend in BACKENDS.items():
+        if backend.owns(inbox):
+            return name
+    return None
+
+# ============================================================================
+# 过期清理 / 归档服务
+# ============================================================================
+
+class QueueReaper:
+    """
+    后台清理: 依据过期索引移出过期消息, 并把已处理 (已确认或已过期) 消息滚动
+    归档为按天压缩文件
+    
+    可通过 CLI 单次运行 (--reap) 或以守护进程方式运行 (--reap-daemon)。
+    """
+    
+    # trace 文件保留天数
+    TRACE_RETENTION_DAYS = 7
+    
+    def __init__(self, queue: 'MessageQueue'):
+        self.queue = queue
+    
+    def run_once(self) -> Dict[str, Any]:
+        """清理所有 Agent 一轮, 返回汇总报告"""
+        report: Dict[str, Any] = {
+            "timestamp": datetime.now().isoformat(),
+            "expired": 0,
+            "archived": 0,
+            "bytes_reclaimed": 0,
+            "inodes_reclaimed": 0,
+            "traces_pruned": 0,
+            "agents": {},
+        }
+        
+        backend = self.queue.backend
+        for agent_id in backend.agents():
+            try:
+                agent = {"expired": backend.reap_expired(agent_id)}
+                agent.update(backend.compact(agent_id))
+            except Exception as e:
+                print(f"Error reaping {agent_id}: {e}")
+                continue
+            
+            for key in ("expired", "archived", "bytes_reclaimed", "inodes_reclaimed"):
+                report[key] += agent[key]
+            if any(agent.values()):
+                report["agents"][agent_id] = agent
+        
+        if self.queue.traces is not None:
+            report["traces_pruned"] = self.queue.traces.prune(self.TRACE_RETENTION_DAYS)
+            report["inodes_reclaimed"] += report["traces_pruned"]
+        
+        return report
+    
+    def run_forever(self, interval: float = 300):
+        """守护模式: 每 interval 秒清理一轮"""
+        while True:
+            report = self.run_once()
+            print(json.dumps(report, ensure_ascii=False))
+            time.sleep(interval)
+
+# ============================================================================
+# 新消息等待 (inotify / 退避轮询)
+# ============================================================================
+
+class _InotifyWatcher:
+    """Linux inotify 目录监听, 只在文件名后缀匹配的写入/移入事件上唤醒"""
+    
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    
+    _EVENT = struct.Struct("iIII")
+    _libc = None
+    
+    @classmethod
+    def available(cls) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        if cls._libc is None:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            if not hasattr(libc, "inotify_init1"):
+                return False
+            cls._libc = libc
+        return True
+    
+    def __init__(self, paths: List[Path], suffix: str):
+        self.suffix = suffix.encode()
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        for path in paths:
+            if self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+    
+    def fileno(self) -> int:
+        return self.fd
+    
+    def drain(self) -> bool:
+        """读出所有待处理事件, 返回是否有相关事件"""
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return relevant
+            pos = 0
+            while pos < len(buf):
+                _, _, _, name_len = self._EVENT.unpack_from(buf, pos)
+                pos += self._EVENT.size
+                name = buf[pos:pos + name_len].rstrip(b"\0")
+                pos += name_len
+                if name.endswith(self.suffix):
+                    relevant = True
+    
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready and self.drain():
+                return True
+    
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _PollingWatcher:
+    """非 Linux 平台的退避轮询: 间隔从 MIN 开始逐次翻倍, 上限 MAX"""
+    
+    MIN_INTERVAL = 0.01
+    MAX_INTERVAL = 1.0
+    
+    def __init__(self):
+        self.interval = self.MIN_INTERVAL
+    
+    def next_interval(self, remaining: float) -> float:
+        interval = min(self.interval, remaining)
+        self.interval = min(self.interval * 2, self.MAX_INTERVAL)
+        return interval
+    
+    def wait(self, timeout: float) -> bool:
+        time.sleep(max(0.0, self.next_interval(timeout)))
+        return True
+    
+    def close(self):
+        pass
+
+
+def _make_watcher(backend: InboxBackend, *agent_ids: str):
+    """监听一个或多个 Agent 的 inbox"""
+    if _InotifyWatcher.available():
+        try:
+            paths = [path for agent_id in agent_ids for path in backend.watch_paths(agent_id)]
+            return _InotifyWatcher(paths, backend.WAKE_SUFFIX)
+        except OSError:
+            # watch 数量超限等情况下退回轮询
+            pass
+    return _PollingWatcher()
+
+# ============================================================================
+# Trace 索引
+# ============================================================================
+
+class TraceIndex:
+    """
+    按 traceId 记录消息事件 (send / receive / ack), 用于重建调用链时间线
+    
+    布局: <base>/_traces/<traceId 前两位>/<traceId>.ndjson, 每行一个事件。
+    同一批次里同一 trace 的事件合并为一次追加写。traceId 来自消息 (可能是远端
+    节点转发来的), 不符合 _TRACE_ID 的用其 SHA-256 ("~" 开头) 作文件名, 不会
+    写到 _traces 之外, 也不会与合法的 traceId 撞名。
+    """
+    
+    _TRACE_ID = re.compile(r"[A-Za-z0-9_-]{1,128}")
+    
+    def __init__(self, root: Path):
+        self.root = root
+    
+    def _path(self, trace_id: str) -> Path:
+        if not self._TRACE_ID.fullmatch(trace_id):
+            trace_id = "~" + hashlib.sha256(trace_id.encode('utf-8', 'surrogatepass')).hexdigest()
+        return self.root / trace_id[:2] / f"{trace_id}.ndjson"
+    
+    def record(self, events: List[Dict[str, Any]]):
+        """追加一批事件 (每个事件需带 trace 字段)"""
+        by_trace: Dict[str, List[bytes]] = {}
+        for event in events:
+            by_trace.setdefault(event.pop("trace"), []).append(_dumps(event) + b"\n")
+        
+        for trace_id, lines in by_trace.items():
+            path = self._path(trace_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(b"".join(lines))
+    
+    def timeline(self, trace_id: str) -> List[Dict[str, Any]]:
+        """
+        按发送时间排序的逐跳时间线
+        
+        每跳包含 queue_delay (send → 首次 receive) 和 processing (首次 receive → ack),
+        单位为秒; 尚未发生的阶段为 None。
+        """
+        path = self._path(trace_id)
+        if not path.exists():
+            return []
+        
+        hops: Dict[str, Dict[str, Any]] = {}
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                hop = hops.setdefault(event["id"], {
+                    "id": event["id"], "from": None, "to": None, "type": None,
+                    "sent_at": None, "received_at": None, "acked_at": None,
+                    "deliveries": 0,
+                })
+                kind = event["event"]
+                if kind == "send":
+                    hop.update({"from": event["from"], "to": event["to"],
+                                "type": event["type"], "sent_at": event["t"]})
+                elif kind == "receive":
+                    hop["deliveries"] += 1
+                    if hop["received_at"] is None:
+                        hop["received_at"] = event["t"]
+                elif kind == "ack":
+                    hop["acked_at"] = event["t"]
+        
+        def delay(start, end):
+            return round(end - start, 6) if start is not None and end is not None else None
+        
+        timeline = sorted(hops.values(), key=lambda h: (h["sent_at"] is None, h["sent_at"] or 0))
+        for hop in timeline:
+            hop["queue_delay"] = delay(hop["sent_at"], hop["received_at"])
+            hop["processing"] = delay(hop["received_at"], hop["acked_at"])
+        return timeline
+    
+    def prune(self, max_age_days: float) -> int:
+        """删除超过 max_age_days 未更新的 trace 文件, 返回删除个数"""
+        if not self.root.exists():
+            return 0
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for shard in self.root.iterdir():
+            with os.scandir(shard) as it:
+                for entry in it:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        removed += 1
+        return removed
+
+# ============================================================================
+# 消息队列
+# ============================================================================
+
+class MessageQueue:
+    """
+    基于文件系统的消息队列
+    
+    backend:
+        "segment"  追加写分段日志 + 偏移索引 (默认)
+        "file"     每条消息一个 JSON 文件 (兼容模式)
+    
+    投递语义为至少一次: receive 租用消息 visibility_timeout 秒, ack 结束租用;
+    消费者崩溃或超时未确认的消息会重新投递, 同一 inbox 可以有多个竞争消费者。
+    """
+    
+    DEFAULT_VISIBILITY_TIMEOUT = 300
+    
+    # 阻塞等待时重新检查过期租约的最长间隔
+    LEASE_RECHECK_INTERVAL = 5.0
+    
+    def __init__(self, base_path: str = "~/clawos/blackboard",
+                 backend: str = "segment", fsync: bool = True,
+                 visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+                 trace_index: bool = True,
+                 **backend_options):
+        self.base_path = Path(base_path).expanduser()
+        self.base_path.mkdir(parents=True, exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend: InboxBackend = BACKENDS[backend](self.base_path, fsync, **backend_options)
+        
+        self.traces = TraceIndex(self.base_path / "_traces") if trace_index else None
+        # (agent_id, message_id) -> traceId, 供 ack 记录事件
+        self._received_traces: Dict[tuple, str] = {}
+        # 读取指标用的其他布局的后端实例 (只调用只读方法)
+        self._metric_backends: Dict[str, InboxBackend] = {}
+    
+    # ---- trace 事件 ----
+    
+    def _trace_sent(self, messages: List[Message]):
+        if self.traces is None:
+            return
+        now = time.time()
+        self.traces.record([{
+            "trace": m.trace_id, "event": "send", "id": m.id, "t": now,
+            "from": m.from_agent.agent, "to": m.to_agent.agent, "type": m.type.value,
+        } for m in messages])
+    
+    def _trace_received(self, agent_id: str, messages: List[Message]):
+        if self.traces is None or not messages:
+            return
+        now = time.time()
+        for m in messages:
+            self._received_traces[(agent_id, m.id)] = m.trace_id
+        self.traces.record([{
+            "trace": m.trace_id, "event": "receive", "id": m.id, "t": now, "agent": agent_id,
+        } for m in messages])
+    
+    def _trace_acked(self, agent_id: str, message_ids: List[str], acked: List[str]):
+        """message_ids 为请求确认的 ID, acked 为后端实际确认的; 只为后者记录事件"""
+        if self.traces is None:
+            return
+        now = time.time()
+        events = []
+        acked = set(acked)
+        for message_id in message_ids:
+            # 只有本进程 receive 过的消息才知道 traceId
+            trace_id = self._received_traces.pop((agent_id, message_id), None)
+            if trace_id is not None and message_id in acked:
+                events.append({"trace": trace_id, "event": "ack", "id": message_id,
+                               "t": now, "agent": agent_id})
+        if events:
+            self.traces.record(events)
+    
+    def trace(self, trace_id: str) -> List[Dict[str, Any]]:
+        """
+        查询一条 trace 的完整时间线
+        
+        Args:
+            trace_id: traceId
+        
+        Returns:
+            按发送时间排序的逐跳列表, 含 queue_delay / processing 秒数
+        """
+        if self.traces is None:
+            return []
+        return self.traces.timeline(trace_id)
+    
+    # ---- 指标 ----
+    
+    @staticmethod
+    def _summarize(stats: List[Dict[str, Any]], oldest: List[float], now: float) -> Dict[str, Any]:
+        """合并若干优先级槽位的指标"""
+        hist = [sum(bucket) for bucket in zip(*(s["histogram"] for s in stats))]
+        summary = {key: sum(s[key] for s in stats) for key in (
+            "depth", "enqueued_total", "dequeued_total", "expired_total",
+            "enqueue_rate", "dequeue_rate")}
+        summary["oldest_age_seconds"] = max(0.0, now - min(oldest)) if oldest else 0.0
+        summary["time_in_queue_seconds"] = {
+            "p50": QueueStats.quantile(hist, 0.5),
+            "p95": QueueStats.quantile(hist, 0.95),
+        }
+        return summary
+    
+    def metrics(self, agent_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        队列深度、最早消息等待时长、入队/出队速率和排队时长 p50/p95
+        
+        数据来自 QueueStats 计数器和各桶游标处的索引项, 不扫描 inbox。
+        只读: 按磁盘上的布局选择后端读取, 不导入遗留消息, 也不创建任何文件,
+        因此可以对另一种后端正在使用的黑板运行。
+        
+        Args:
+            agent_id: 只报告该 Agent; None 表示所有 Agent
+        
+        Returns:
+            {"timestamp": ..., "agents": {agent: {..., "priorities": {priority: {...}}}}}
+        """
+        agents = [agent_id] if agent_id else self.backend.agents()
+        report: Dict[str, Any] = {"timestamp": datetime.now().isoformat(), "agents": {}}
+        
+        for agent in agents:
+            backend = self._metrics_backend(agent)
+            oldest = backend.oldest_enqueued_at(agent)
+            stats = backend.stats.snapshot(agent, lambda: backend.pending_counts(agent))
+            now = time.time()
+            
+            priorities = {
+                priority.value: self._summarize(
+                    [stats[priority]], [oldest[priority]] if priority in oldest else [], now)
+                for priority in PRIORITY_ORDER
+            }
+            summary = self._summarize(list(stats.values()), list(oldest.values()), now)
+            summary["priorities"] = priorities
+            report["agents"][agent] = summary
+        
+        return report
+    
+    def _metrics_backend(self, agent_id: str) -> InboxBackend:
+        """与该 Agent inbox 磁盘布局一致的后端"""
+        kind = detect_backend(self.base_path / agent_id / "inbox")
+        if kind is None or isinstance(self.backend, BACKENDS[kind]):
+            return self.backend
+        if kind not in self._metric_backends:
+            self._metric_backends[kind] = BACKENDS[kind](self.base_path, fsync=False)
+        return self._metric_backends[kind]
+    
+    def metrics_prometheus(self, agent_id: Optional[str] = None) -> str:
+        """metrics() 的 Prometheus 文本格式"""
+        return format_prometheus(self.metrics(agent_id))
+    
+    # ---- 收发 ----
+    
     def send(self, message: Message) -> str:
         """
         发送消息到目标 Agent 的 inbox
@@ -113,68 +1944,537 @@ class MessageQueue:
         Returns:
             消息 ID
         """
-        inbox = self._get_inbox_path(message.to_agent.agent)
-        msg_file = inbox / f"{message.id}.json"
+        self.backend.append(message)
+        self._trace_sent([message])
+        return message.id
+    
+    def send_many(self, messages: List[Message]) -> List[str]:
+        """
+        批量发送消息: 按目标 inbox 分组, 每组一次写入、一次提交
         
-        with open(msg_file, 'w', encoding='utf-8') as f:
-            json.dump(message.to_dict(), f, indent=2, ensure_ascii=False)
+        Args:
+            messages: 消息列表
         
-        return message.id
+        Returns:
+            消息 ID 列表 (与输入顺序一致)
+        """
+        by_agent: Dict[str, List[Message]] = {}
+        for message in messages:
+            by_agent.setdefault(message.to_agent.agent, []).append(message)
+        
+        for agent_id, group in by_agent.items():
+            self.backend.append_many(agent_id, group)
+        self._trace_sent(messages)
+        
+        return [message.id for message in messages]
     
-    def receive(self, agent_id: str, limit: int = 10) -> List[Message]:
+    def _read(self, agent_id: str, limit: int, visibility_timeout: float) -> List[Message]:
+        messages = self.backend.read(agent_id, limit, visibility_timeout)
+        # 只查看 (不租用) 不算一次投递
+        if visibility_timeout > 0:
+            self._trace_received(agent_id, messages)
+        return messages
+    
+    def receive(self, agent_id: str, limit: int = 10,
+                timeout: Optional[float] = None,
+                visibility_timeout: Optional[float] = None) -> List[Message]:
         """
-        从 Agent 的 inbox 接收消息
+        从 Agent 的 inbox 接收 (租用) 消息
         
         Args:
             agent_id: Agent ID
             limit: 最大消息数
+            timeout: 最长等待秒数; None/0 表示立即返回, 否则阻塞到有消息或超时
+            visibility_timeout: 租期秒数, 默认取队列配置; 0 表示只查看不租用
         
         Returns:
-            消息列表
+            消息列表 (超时返回空列表)
         """
-        inbox = self._get_inbox_path(agent_id)
-        messages = []
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
         
-        for msg_file in sorted(inbox.glob("*.json"))[:limit]:
-            try:
-                with open(msg_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    msg = Message.from_dict(data)
-                    
-                    # 检查是否过期
-                    if not self._is_expired(msg):
-                        messages.append(msg)
-                    else:
-                        # 删除过期消息
-                        msg_file.unlink()
-            except Exception as e:
-                print(f"Error reading message {msg_file}: {e}")
+        messages = self._read(agent_id, limit, visibility_timeout)
+        if messages or not timeout or timeout <= 0:
+            return messages
         
-        return messages
+        deadline = time.monotonic() + timeout
+        watcher = _make_watcher(self.backend, agent_id)
+        try:
+            while True:
+                # 监听建立后再读一次, 避免漏掉两者之间到达的消息
+                messages = self._read(agent_id, limit, visibility_timeout)
+                if messages:
+                    return messages
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                # 租约到期不会产生文件事件, 定期醒来重查
+                watcher.wait(min(remaining, self.LEASE_RECHECK_INTERVAL))
+        finally:
+            watcher.close()
+    
+    async def subscribe(self, agent_id: str, batch: int = 10):
+        """
+        异步订阅 inbox: async for msg in queue.subscribe(agent_id)
+        
+        消息在调用方处理完 (取下一条) 时确认; 提前 break 的消息不会被确认,
+        租期过后重新投递。读取和确认 (flock 与文件 I/O) 在默认线程池中执行,
+        不阻塞事件循环。
+        
+        Args:
+            agent_id: Agent ID
+            batch: 每次读取的最大消息数
+        """
+        loop = asyncio.get_running_loop()
+        watcher = await loop.run_in_executor(None, _make_watcher, self.backend, agent_id)
+        wakeup = asyncio.Event()
+        if isinstance(watcher, _InotifyWatcher):
+            def on_readable():
+                if watcher.drain():
+                    wakeup.set()
+            loop.add_reader(watcher.fileno(), on_readable)
+        
+        try:
+            while True:
+                wakeup.clear()
+                messages = await loop.run_in_executor(
+                    None, self._read, agent_id, batch, self.visibility_timeout)
+                for msg in messages:
+                    yield msg
+                    await loop.run_in_executor(None, self.ack, agent_id, msg.id)
+                
+                if messages:
+                    if isinstance(watcher, _PollingWatcher):
+                        watcher.interval = watcher.MIN_INTERVAL
+                    continue
+                
+                if isinstance(watcher, _InotifyWatcher):
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), self.LEASE_RECHECK_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(watcher.next_interval(watcher.MAX_INTERVAL))
+        finally:
+            if isinstance(watcher, _InotifyWatcher):
+                loop.remove_reader(watcher.fileno())
+            watcher.close()
     
     def ack(self, agent_id: str, message_id: str):
         """
-        确认消息已处理，移动到 processed 目录
+        确认消息已处理
         
         Args:
             agent_id: Agent ID
             message_id: 消息 ID
         """
-        inbox = self._get_inbox_path(agent_id)
-        processed = self._get_processed_path(agent_id)
+        acked = self.backend.ack_many(agent_id, [message_id])
+        self._trace_acked(agent_id, [message_id], acked)
+    
+    def ack_many(self, agent_id: str, message_ids: List[str]) -> int:
+        """
+        批量确认消息, 整批只提交一次
+        
+        Args:
+            agent_id: Agent ID
+            message_ids: 消息 ID 列表
+        
+        Returns:
+            实际确认的消息数
+        """
+        acked = self.backend.ack_many(agent_id, message_ids)
+        self._trace_acked(agent_id, message_ids, acked)
+        return len(acked)
+
+# ============================================================================
+# 跨节点转发
+# ============================================================================
+#
+# 收件人在远端节点的消息照常写入本地 inbox, 由 MessageRelay 批量取出、压缩后
+# 通过 TCP 或 Unix socket 推给远端的 RelayServer, 后者写入远端同名 inbox。
+#
+# 帧:   magic "CR" | kind | seq | 长度 | 数据
+#   HELLO  发送方 -> 接收方   数据为 {"node": 发送方节点 ID}
+#   ACK    接收方 -> 发送方   seq 为该发送方已提交的最大批次序号
+#   BATCH  发送方 -> 接收方   数据为 zlib 压缩的 (4 字节长度 + 二进制线格式记录)*
+#
+# 发送方先把批次连同序号落盘 (_relay/out/<peer>.pending) 再确认本地消息,
+# 收到 ACK 后删除; 落盘后、确认前崩溃的, 重启时按批次中的消息 ID 补确认。
+# 断线重连时接收方在握手的 ACK 中告知已提交序号, 发送方从该序号之后续传。
+# 接收方按序号去重, 同一批次不会重复写入。
+
+_RELAY_MAGIC = b"CR"
+_RELAY_FRAME = struct.Struct("<2sBQI")
+_RELAY_HELLO = 1
+_RELAY_ACK = 2
+_RELAY_BATCH = 3
+_RELAY_MAX_FRAME = 64 * 1024 * 1024
+# 落盘批次头: 序号, 消息数
+_RELAY_PENDING = struct.Struct("<QI")
+_RELAY_SEQ = struct.Struct("<Q")
+_RECORD_LEN = struct.Struct("<I")
+
+
+def _relay_address(address: str) -> tuple:
+    """"unix:/path" 或 "host:port" -> (地址族, socket 地址)"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _send_frame(sock: socket.socket, kind: int, seq: int, data: bytes = b""):
+    sock.sendall(_RELAY_FRAME.pack(_RELAY_MAGIC, kind, seq, len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("relay connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_frame(sock: socket.socket) -> tuple:
+    """读取一帧, 返回 (kind, seq, 数据)"""
+    magic, kind, seq, length = _RELAY_FRAME.unpack(_recv_exact(sock, _RELAY_FRAME.size))
+    if magic != _RELAY_MAGIC or length > _RELAY_MAX_FRAME:
+        raise ConnectionError("invalid relay frame")
+    return kind, seq, _recv_exact(sock, length)
+
+
+def _pack_batch(messages: List[Message]) -> bytes:
+    records = []
+    for message in messages:
+        # 未解析的 payload 原样转发
+        record = encode_message(message)
+        records.append(_RECORD_LEN.pack(len(record)) + record)
+    return zlib.compress(b"".join(records), 1)
+
+
+def _unpack_batch(data: bytes) -> List[Message]:
+    buf = zlib.decompress(data)
+    messages = []
+    pos = 0
+    while pos < len(buf):
+        (length,) = _RECORD_LEN.unpack_from(buf, pos)
+        pos += _RECORD_LEN.size
+        messages.append(decode_message(buf[pos:pos + length]))
+        pos += length
+    return messages
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class MessageRelay:
+    """
+    把收件人在远端节点的消息从本地 inbox 转发到远端 RelayServer
+    
+    本地 inbox 充当发件箱, 发送方照常 send, 不需要知道收件人在哪个节点。
+    本地消息在批次落盘后才确认, 批次在远端 ACK 后才删除; 批次序号保证
+    断线重传不会在远端重复写入。
+    """
+    
+    BATCH_SIZE = 256
+    CONNECT_TIMEOUT = 5.0
+    # 等待远端 ACK (远端写入并 fsync 一批) 的最长时间
+    ACK_TIMEOUT = 30.0
+    MAX_RETRY_INTERVAL = 30.0
+    
+    def __init__(self, queue: 'MessageQueue', node_id: str, peer: str,
+                 agents: List[str], batch_size: int = BATCH_SIZE):
+        """
+        Args:
+            queue: 本地消息队列
+            node_id: 本节点 ID, 远端按它记录已提交的批次序号
+            peer: 远端 RelayServer 地址, "host:port" 或 "unix:/path"
+            agents: 住在远端节点上的 Agent
+            batch_size: 每批最多转发的消息数
+        """
+        self.queue = queue
+        self.node_id = node_id
+        self.peer = peer
+        self.agents = list(agents)
+        self.batch_size = batch_size
+        
+        state_dir = queue.base_path / "_relay" / "out"
+        state_dir.mkdir(parents=True, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", peer)
+        self._pending_path = state_dir / f"{name}.pending"
+        self._seq_path = state_dir / f"{name}.seq"
+        
+        self._sock: Optional[socket.socket] = None
+        # 最近一次握手时远端已提交的序号
+        self._remote_seq = 0
+        
+        # 上次进程可能在批次落盘后、确认本地消息前退出; 这些消息的租约到期后
+        # 会重新可投递, 被租进新批次 (新序号) 重复转发。租用之前先确认它们
+        pending = self._load_pending()
+        if pending is not None:
+            self._ack_local(_unpack_batch(pending[2]))
+    
+    # ---- 批次 ----
+    
+    def _acked_seq(self) -> int:
+        try:
+            return _RELAY_SEQ.unpack(self._seq_path.read_bytes())[0]
+        except (FileNotFoundError, struct.error):
+            return 0
+    
+    def _load_pending(self) -> Optional[tuple]:
+        """未确认的批次 (序号, 消息数, 数据)"""
+        try:
+            data = self._pending_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        seq, count = _RELAY_PENDING.unpack_from(data)
+        return seq, count, data[_RELAY_PENDING.size:]
+    
+    def _lease(self) -> List[Message]:
+        messages = []
+        for agent_id in self.agents:
+            remaining = self.batch_size - len(messages)
+            if remaining <= 0:
+                break
+            messages.extend(self.queue.receive(agent_id, limit=remaining))
+        return messages
+    
+    def _collect(self, timeout: float) -> Optional[tuple]:
+        """租用一批待转发消息并落盘为新批次, 等到 timeout 仍没有消息时返回 None"""
+        messages = self._lease()
+        if not messages and timeout > 0:
+            watcher = _make_watcher(self.queue.backend, *self.agents)
+            try:
+                # 监听建立后再读一次, 避免漏掉两者之间到达的消息
+                messages = self._lease()
+                if not messages:
+                    watcher.wait(timeout)
+                    messages = self._lease()
+            finally:
+                watcher.close()
+        if not messages:
+            return None
+        
+        # 新批次的序号必须大于远端已提交的序号, 否则会被当作重复批次丢弃
+        seq = max(self._acked_seq(), self._remote_seq) + 1
+        data = _pack_batch(messages)
+        _write_atomic(self._pending_path, _RELAY_PENDING.pack(seq, len(messages)) + data)
+        
+        # 批次已持久化, 本地消息可以确认
+        self._ack_local(messages)
+        return seq, len(messages), data
+    
+    def _ack_local(self, messages: List[Message]):
+        """确认已写入批次的本地消息; 已确认的不重复计数"""
+        by_agent: Dict[str, List[str]] = {}
+        for message in messages:
+            by_agent.setdefault(message.to_agent.agent, []).append(message.id)
+        for agent_id, ids in by_agent.items():
+            self.queue.ack_many(agent_id, ids)
+    
+    def _complete(self, seq: int):
+        _write_atomic(self._seq_path, _RELAY_SEQ.pack(seq))
+        self._pending_path.unlink(missing_ok=True)
+    
+    # ---- 连接 ----
+    
+    def _connect(self) -> socket.socket:
+        if self._sock is not None:
+            return self._sock
+        
+        family, address = _relay_address(self.peer)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.CONNECT_TIMEOUT)
+        try:
+            sock.connect(address)
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _send_frame(sock, _RELAY_HELLO, 0, _dumps({"node": self.node_id}))
+            kind, committed, _ = _recv_frame(sock)
+            if kind != _RELAY_ACK:
+                raise ConnectionError("relay handshake failed")
+            sock.settimeout(self.ACK_TIMEOUT)
+        except OSError:
+            sock.close()
+            raise
+        
+        self._sock = sock
+        self._remote_seq = committed
+        # 上次断线时丢失了 ACK 的批次远端其实已经提交, 不再重发
+        pending = self._load_pending()
+        if pending is not None and pending[0] <= committed:
+            self._complete(pending[0])
+        return sock
+    
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+    
+    # ---- 转发 ----
+    
+    def forward_once(self, timeout: float = 0) -> int:
+        """
+        转发一批消息; 有未确认的批次时先续传它
+        
+        Args:
+            timeout: 没有待转发消息时最长等待秒数
+        
+        Returns:
+            远端确认的消息数
+        
+        Raises:
+            OSError: 连接失败或中断, 批次保留到下次续传
+        """
+        try:
+            sock = self._connect()
+            batch = self._load_pending() or self._collect(timeout)
+            if batch is None:
+                return 0
+            seq, count, data = batch
+            _send_frame(sock, _RELAY_BATCH, seq, data)
+            kind, acked, _ = _recv_frame(sock)
+            if kind != _RELAY_ACK or acked < seq:
+                raise ConnectionError(f"relay batch {seq} not acknowledged")
+        except OSError:
+            self.close()
+            raise
         
-        src = inbox / f"{message_id}.json"
-        dst = processed / f"{message_id}.json"
+        self._complete(seq)
+        return count
+    
+    def run_forever(self, idle_timeout: float = 5.0,
+                    stop: Optional[threading.Event] = None):
+        """
+        持续转发; 连接失败时按指数退避重连
+        
+        Args:
+            idle_timeout: 每次等待新消息的最长秒数
+            stop: 设置后退出循环
+        """
+        retry = 0.1
+        try:
+            while stop is None or not stop.is_set():
+                try:
+                    self.forward_once(idle_timeout)
+                    retry = 0.1
+                except OSError as e:
+                    print(f"Relay to {self.peer} failed: {e}; retrying in {retry:.1f}s")
+                    if stop is not None:
+                        stop.wait(retry)
+                    else:
+                        time.sleep(retry)
+                    retry = min(retry * 2, self.MAX_RETRY_INTERVAL)
+        finally:
+            self.close()
+
+
+class _RelayHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.relay._serve(self.request)
+
+
+class _TCPRelayServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixRelayServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class RelayServer:
+    """
+    接收远端 MessageRelay 转发的消息并写入本地 inbox
+    
+    每个来源节点已提交的批次序号保存在 _relay/in/<node>.seq;
+    序号不大于它的批次只回 ACK, 不再写入。
+    """
+    
+    def __init__(self, queue: 'MessageQueue', address: str):
+        """
+        Args:
+            queue: 本地消息队列
+            address: 监听地址, "host:port" (端口为 0 时自动分配) 或 "unix:/path"
+        """
+        self.queue = queue
+        self._state_dir = queue.base_path / "_relay" / "in"
+        self._state_dir.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
         
-        if src.exists():
-            src.rename(dst)
+        family, bind = _relay_address(address)
+        if family == socket.AF_UNIX:
+            # 上次异常退出留下的 socket 文件
+            Path(bind).unlink(missing_ok=True)
+            self._server = _UnixRelayServer(bind, _RelayHandler)
+            self.address = address
+        else:
+            self._server = _TCPRelayServer(bind, _RelayHandler)
+            host, port = self._server.server_address[:2]
+            self.address = f"{host}:{port}"
+        self._server.relay = self
+    
+    def _lock(self, source: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(source, threading.Lock())
+    
+    def _seq_path(self, source: str) -> Path:
+        return self._state_dir / f"{source}.seq"
+    
+    def committed(self, source: str) -> int:
+        """来源节点已提交的最大批次序号"""
+        try:
+            return _RELAY_SEQ.unpack(self._seq_path(source).read_bytes())[0]
+        except (FileNotFoundError, struct.error):
+            return 0
     
-    def _is_expired(self, message: Message) -> bool:
-        """检查消息是否过期"""
-        msg_time = datetime.fromisoformat(message.timestamp)
-        now = datetime.now(msg_time.tzinfo)
-        age_seconds = (now - msg_time).total_seconds()
-        return age_seconds > message.ttl
+    def _serve(self, sock: socket.socket):
+        try:
+            kind, _, data = _recv_frame(sock)
+            if kind != _RELAY_HELLO:
+                return
+            source = re.sub(r"[^A-Za-z0-9_.-]", "_", json.loads(data)["node"])
+            lock = self._lock(source)
+            _send_frame(sock, _RELAY_ACK, self.committed(source))
+            
+            while True:
+                kind, seq, data = _recv_frame(sock)
+                if kind != _RELAY_BATCH:
+                    return
+                with lock:
+                    committed = self.committed(source)
+                    if seq > committed:
+                        self.queue.send_many(_unpack_batch(data))
+                        _write_atomic(self._seq_path(source), _RELAY_SEQ.pack(seq))
+                        committed = seq
+                _send_frame(sock, _RELAY_ACK, committed)
+        except ConnectionError:
+            # 对端断开, 未确认的批次由对端续传
+            return
+        except (OSError, ValueError, KeyError, struct.error, zlib.error) as e:
+            print(f"Relay connection error: {e}")
+    
+    def serve_forever(self):
+        self._server.serve_forever()
+    
+    def shutdown(self):
+        """停止 serve_forever 并关闭监听 socket"""
+        self._server.shutdown()
+        self._server.server_close()
+        family, bind = _relay_address(self.address)
+        if family == socket.AF_UNIX:
+            Path(bind).unlink(missing_ok=True)
+
 
 # ============================================================================
 # 消息构建器
@@ -183,13 +2483,15 @@ class MessageQueue:
 class MessageBuilder:
     """消息构建器"""
     
-    def __init__(self, from_agent: str, from_tier: str, session: Optional[str] = None):
+    def __init__(self, from_agent: str, from_tier: str, session: Optional[str] = None,
+                 trace_id: Optional[str] = None):
         self.from_agent = AgentRef(
             agent=from_agent,
             tier=from_tier,
             session=session
         )
-        self.trace_id = str(uuid.uuid4())
+        # 沿用上游消息的 traceId 可把 GM → PM → Worker 串成一条调用链
+        self.trace_id = trace_id or str(uuid.uuid4())
     
     def request(self, to_agent: str, to_tier: str, action: str, 
                 params: dict, priority: Priority = Priority.NORMAL,
@@ -291,13 +2593,28 @@ class MessageBuilder:
 # 便捷函数
 # ============================================================================
 
+_default_queue: Optional[MessageQueue] = None
+_default_queue_lock = threading.Lock()
+
+
+def get_queue() -> MessageQueue:
+    """进程内共享的默认队列, 避免便捷函数每次调用都重新初始化"""
+    global _default_queue
+    if _default_queue is None:
+        with _default_queue_lock:
+            if _default_queue is None:
+                _default_queue = MessageQueue()
+    return _default_queue
+
+
 def send_task_request(from_agent: str, from_tier: str, 
                       to_agent: str, to_tier: str,
                       task_type: str, task_description: str,
-                      task_params: dict = None) -> str:
-    """发送任务请求"""
+                      task_params: dict = None,
+                      queue: Optional[MessageQueue] = None) -> str:
+    """发送任务请求 (queue 默认为 get_queue())"""
+    # builder 每次新建: 每个任务请求对应一条新的 trace
     builder = MessageBuilder(from_agent, from_tier)
-    queue = MessageQueue()
     
     msg = builder.request(
         to_agent=to_agent,
@@ -310,7 +2627,7 @@ def send_task_request(from_agent: str, from_tier: str,
         }
     )
     
-    return queue.send(msg)
+    return (queue or get_queue()).send(msg)
 
 
 def send_progress_notification(from_agent: str, from_tier: str,
@@ -319,7 +2636,6 @@ def send_progress_notification(from_agent: str, from_tier: str,
                                current: int, total: int) -> str:
     """发送进度通知"""
     builder = MessageBuilder(from_agent, from_tier)
-    queue = MessageQueue()
     
     msg = builder.notification(
         to_agent=to_agent,
@@ -333,13 +2649,15 @@ def send_progress_notification(from_agent: str, from_tier: str,
         }
     )
     
-    return queue.send(msg)
+    return get_queue().send(msg)
 
 
-def check_inbox(agent_id: str, process: bool = True) -> List[dict]:
-    """检查并返回 inbox 中的消息"""
-    queue = MessageQueue()
-    messages = queue.receive(agent_id)
+def check_inbox(agent_id: str, process: bool = True,
+                queue: Optional[MessageQueue] = None) -> List[dict]:
+    """检查并返回 inbox 中的消息 (queue 默认为 get_queue())"""
+    queue = queue or get_queue()
+    # 只查看时不租用, 消息仍对其他消费者可见
+    messages = queue.receive(agent_id, visibility_timeout=None if process else 0)
     
     result = []
     for msg in messages:
@@ -351,9 +2669,9 @@ def check_inbox(agent_id: str, process: bool = True) -> List[dict]:
             "payload": msg.payload,
             "timestamp": msg.timestamp
         })
-        
-        if process:
-            queue.ack(agent_id, msg.id)
+    
+    if process and messages:
+        queue.ack_many(agent_id, [msg.id for msg in messages])
     
     return result
 
@@ -371,11 +2689,66 @@ if __name__ == "__main__":
     parser.add_argument("--from", dest="from_agent", help="From agent")
     parser.add_argument("--to", dest="to_agent", help="To agent")
     parser.add_argument("--message", help="Message content")
+    parser.add_argument("--trace", help="Show the timeline of a traceId")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="AGENT",
+                        help="Show queue depth/age/throughput (all agents or one)")
+    parser.add_argument("--format", default="json", choices=["json", "prometheus"],
+                        help="Output format for --metrics")
+    parser.add_argument("--reap", action="store_true",
+                        help="Drop expired messages and archive processed/ once")
+    parser.add_argument("--reap-daemon", action="store_true",
+                        help="Run the reaper continuously")
+    parser.add_argument("--interval", type=float, default=300,
+                        help="Reaper interval in seconds (daemon mode)")
+    parser.add_argument("--relay-serve", metavar="ADDRESS",
+                        help="Accept relayed messages on host:port or unix:/path")
+    parser.add_argument("--relay-to", metavar="ADDRESS",
+                        help="Forward messages for --relay-agents to a remote relay")
+    parser.add_argument("--relay-agents", default="",
+                        help="Comma-separated agents that live on the remote node")
+    parser.add_argument("--node", default=socket.gethostname(),
+                        help="This node's ID (used by the remote relay to resume)")
+    parser.add_argument("--base-path", default="~/clawos/blackboard", help="Blackboard root")
+    parser.add_argument("--backend", default="segment", choices=sorted(BACKENDS),
+                        help="Inbox storage backend")
     
     args = parser.parse_args()
     
-    if args.check:
-        messages = check_inbox(args.check, process=False)
+    def open_queue(**options) -> MessageQueue:
+        """所有子命令都用 --base-path / --backend 指定的队列"""
+        return MessageQueue(args.base_path, backend=args.backend, **options)
+    
+    if args.reap or args.reap_daemon:
+        reaper = QueueReaper(open_queue())
+        if args.reap_daemon:
+            reaper.run_forever(args.interval)
+        else:
+            print(json.dumps(reaper.run_once(), indent=2, ensure_ascii=False))
+    
+    elif args.relay_serve:
+        server = RelayServer(open_queue(), args.relay_serve)
+        print(f"Relay listening on {server.address}")
+        server.serve_forever()
+    
+    elif args.relay_to:
+        agents = [a for a in args.relay_agents.split(",") if a]
+        if not agents:
+            parser.error("--relay-to requires --relay-agents")
+        relay = MessageRelay(open_queue(), args.node, args.relay_to, agents)
+        relay.run_forever()
+    
+    elif args.metrics is not None:
+        queue = open_queue(trace_index=False)
+        if args.format == "prometheus":
+            sys.stdout.write(queue.metrics_prometheus(args.metrics or None))
+        else:
+            print(json.dumps(queue.metrics(args.metrics or None), indent=2, ensure_ascii=False))
+    
+    elif args.trace:
+        print(json.dumps(open_queue().trace(args.trace), indent=2, ensure_ascii=False))
+    
+    elif args.check:
+        messages = check_inbox(args.check, process=False, queue=open_queue())
         print(json.dumps(messages, indent=2, ensure_ascii=False))
     
     elif args.send and args.from_agent and args.to_agent:
@@ -385,7 +2758,8 @@ if __name__ == "__main__":
             to_agent=args.to_agent,
             to_tier="pm",
             task_type="test",
-            task_description=args.message or "Test message"
+            task_description=args.message or "Test message",
+            queue=open_queue()
         )
         print(f"Message sent: {msg_id}")
     
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+memory_system 单元测试
+
+运行: python -m pytest code/lib/test_memory_system.py
+"""
+
+import io
+import json
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from memory_system import (
+    HierarchicalMemory, LongTermMemory, MediumTermMemory, MemoryEntry, ProceduralMemory,
+    ShortTermMemory, SQLiteEngine, VectorStore, estimate_tokens
+)
+
+
+def _entry(memory_id: str, content: str = None, importance: float = 0.8) -> MemoryEntry:
+    return MemoryEntry(
+        id=memory_id,
+        content=content or f"memory {memory_id} about {memory_id * 3}",
+        memory_type="knowledge",
+        importance=importance,
+        source="test",
+        timestamp=datetime.now().isoformat(),
+        metadata={}
+    )
+
+
+@pytest.fixture
+def l3(tmp_path):
+    return LongTermMemory(str(tmp_path / "longterm"))
+
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    """各层默认路径都在 ~ 下, 指向临时目录; recall 线程池每个测试独立"""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(HierarchicalMemory, "_recall_pools", {})
+    monkeypatch.setattr(HierarchicalMemory, "_recall_slots", {})
+    return HierarchicalMemory("test")
+
+
+# ==================== 短期记忆 ====================
+
+def _tokens(item: dict) -> int:
+    """与 add_context 相同的估算 (存入的条目已带 timestamp)"""
+    return estimate_tokens(json.dumps(item, ensure_ascii=False))
+
+
+def _notes(stm: ShortTermMemory) -> list:
+    return [item["note"] for item in stm.get_context()]
+
+
+def test_short_term_evicts_oldest_first_by_tokens():
+    stm = ShortTermMemory("s", max_items=100, max_tokens=60)
+    for n in range(20):
+        stm.add_context({"note": n})
+        assert stm.tokens <= stm.max_tokens
+        assert stm.tokens == sum(_tokens(item) for item in stm.get_context())
+
+    notes = _notes(stm)
+    # 淘汰的总是最旧的一段, 剩下的是连续的最新若干条
+    assert notes == list(range(20 - len(notes), 20))
+    assert 1 < len(notes) < 20
+
+    stm = ShortTermMemory("s", max_items=3, max_tokens=10_000)
+    for n in range(5):
+        stm.add_context({"note": n})
+    assert _notes(stm) == [2, 3, 4]
+
+
+def test_short_term_keeps_oversized_newest_item():
+    stm = ShortTermMemory("s", max_items=100, max_tokens=50)
+    stm.add_context({"note": 0})
+    stm.add_context({"note": 1, "text": "长" * 200})
+
+    # 超出预算的单条仍保留 (最新的一条总是保留), 更旧的全部淘汰
+    assert _notes(stm) == [1]
+    assert stm.tokens > stm.max_tokens
+    # 放不进预算时 get_context 不返回它
+    assert stm.get_context(max_tokens=50) == []
+
+    stm.add_context({"note": 2})
+    assert _notes(stm) == [2]
+    assert stm.tokens <= stm.max_tokens
+
+
+def test_short_term_get_context_budget_boundary():
+    stm = ShortTermMemory("s", max_items=100, max_tokens=10_000)
+    for n in range(6):
+        stm.add_context({"note": n, "text": "x" * (n * 7)})
+    items = stm.get_context()
+    newest_three = sum(_tokens(item) for item in items[-3:])
+
+    # 恰好等于最新 3 条之和时全部放得下, 少 1 个 token 就只剩 2 条
+    assert [i["note"] for i in stm.get_context(max_tokens=newest_three)] == [3, 4, 5]
+    assert [i["note"] for i in stm.get_context(max_tokens=newest_three - 1)] == [4, 5]
+    assert stm.get_context(max_tokens=0) == []
+    # 最新一条放不下时返回空, 不跳过它去拿更旧、更小的条目
+    assert stm.get_context(max_tokens=_tokens(items[-1]) - 1) == []
+    assert stm.get_context(max_tokens=10_000) == items
+    # limit 与预算同时生效, 取更严格的一个
+    assert [i["note"] for i in stm.get_context(limit=2, max_tokens=newest_three)] == [4, 5]
+
+
+# ==================== SQLite 连接 ====================
+
+def test_connections_of_finished_threads_are_closed(tmp_path):
+    engine = SQLiteEngine(tmp_path / "test.db")
+    opened = []
+
+    def worker():
+        conn = engine.connection()
+        conn.execute("SELECT 1")
+        opened.append(conn)
+
+    for _ in range(20):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    engine.connection().execute("SELECT 1")
+
+    # 主线程开连接时, 已退出的工作线程的连接都被关闭
+    assert list(engine._connections) == [threading.current_thread()]
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[-1].execute("SELECT 1")
+    engine.close()
+
+
+# ==================== L2 全文检索 ====================
+
+def _fts_ids(l2: MediumTermMemory, query: str) -> list:
+    return [r["entry"].id for r in l2.search(query)]
+
+
+def test_migration_from_v0_backfills_fts_heat_and_hashes(tmp_path):
+    db = tmp_path / "medium.db"
+    with sqlite3.connect(db) as conn:
+        conn.execute("""
+            CREATE TABLE memories (
+                id TEXT PRIMARY KEY, content TEXT, memory_type TEXT, importance REAL,
+                source TEXT, created_at TIMESTAMP, last_accessed TIMESTAMP,
+                access_count INTEGER DEFAULT 0, metadata TEXT
+            )
+        """)
+        now = datetime.now().isoformat()
+        conn.executemany(
+            "INSERT INTO memories VALUES (?, ?, 'knowledge', 0.5, 'test', ?, ?, ?, '{}')",
+            [("a", "gateway timeout notes", now, now, 3),
+             ("b", "网关超时的处理办法", now, now, 0)],
+        )
+    conn.close()
+
+    l2 = MediumTermMemory(str(db))
+
+    assert l2.fts
+    conn = l2.engine.connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == MediumTermMemory.SCHEMA_VERSION
+    rows = {r["id"]: r for r in conn.execute("SELECT * FROM memories")}
+    assert rows["a"]["heat"] > 0 and rows["b"]["heat"] == 0
+    assert all(r["content_hash"] for r in rows.values())
+    assert _fts_ids(l2, "gateway") == ["a"]
+    assert _fts_ids(l2, "超时的") == ["b"]
+
+
+def test_fts_is_created_on_open_when_migration_could_not(tmp_path):
+    db = tmp_path / "medium.db"
+    l2 = MediumTermMemory(str(db))
+    l2.store_memory(_entry("a", "gateway timeout notes"))
+    # 升级时 SQLite 没有 FTS5: user_version 已是最新, 但没有全文索引
+    with l2.engine.transaction() as conn:
+        conn.execute("DROP TABLE memories_fts")
+        for trigger in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER memories_fts_{trigger}")
+
+    reopened = MediumTermMemory(str(db))
+
+    assert reopened.fts
+    results = reopened.search("gateway")
+    assert [r["entry"].id for r in results] == ["a"]
+    assert results[0]["score"] > 0 and "[" in results[0]["snippet"]
+
+
+def test_bm25_ranks_denser_matches_first(tmp_path):
+    l2 = MediumTermMemory(str(tmp_path / "medium.db"))
+    l2.store_memory(_entry("sparse", "notes on the gateway and many other unrelated topics here"))
+    l2.store_memory(_entry("dense", "gateway gateway gateway"))
+    l2.store_memory(_entry("none", "nothing relevant"))
+
+    results = l2.search("gateway")
+
+    assert [r["entry"].id for r in results] == ["dense", "sparse"]
+    assert results[0]["score"] > results[1]["score"] > 0
+
+
+def test_vacuum_keeps_fts_pointing_at_the_right_rows(tmp_path):
+    l2 = MediumTermMemory(str(tmp_path / "medium.db"))
+    for memory_id, content in (("a", "alpha notes"), ("b", "bravo notes"), ("c", "charlie notes")):
+        l2.store_memory(_entry(memory_id, content))
+    with l2.engine.transaction() as conn:
+        conn.execute("DELETE FROM memories WHERE id = 'a'")
+
+    l2.vacuum()
+
+    assert _fts_ids(l2, "charlie") == ["c"]
+    assert _fts_ids(l2, "bravo") == ["b"]
+    assert _fts_ids(l2, "alpha") == []
+
+
+# ==================== 向量存储 ====================
+
+def test_vector_store_appends_and_overrides(tmp_path):
+    store = VectorStore(tmp_path / "vectors")
+    store.add("x", [1.0, 0.0])
+    store.add("y", [0.0, 2.0])
+    store.add("xy", [1.0, 1.0])
+
+    assert len(store) == 3
+    assert store.get("y") == pytest.approx([0.0, 1.0])
+    assert [i for i, _ in store.search([1.0, 0.1], k=2)] == ["x", "xy"]
+
+    # 同一 ID 重复写入以最后一行为准
+    store.add("x", [0.0, -1.0])
+    assert len(store) == 3
+    assert store.search([1.0, 0.1], k=1)[0][0] == "xy"
+    assert store.search([0.0, -1.0], k=1) == [("x", pytest.approx(1.0))]
+    with pytest.raises(ValueError):
+        store.add("z", [1.0, 0.0, 0.0])
+
+
+def test_vector_store_tombstones(tmp_path):
+    store = VectorStore(tmp_path / "vectors")
+    store.add("x", [1.0, 0.0])
+    store.add("y", [0.0, 1.0])
+
+    assert store.remove("x")
+    assert not store.remove("x") and not store.remove("missing")
+    assert "x" not in store and store.get("x") is None
+    assert len(store) == 1
+    assert [i for i, _ in store.search([1.0, 0.0], k=5)] == ["y"]
+
+    store.add("x", [1.0, 0.0])
+    assert store.search([1.0, 0.0], k=1)[0][0] == "x"
+
+
+def test_vector_store_reopens_from_ids_sidecar(tmp_path):
+    store = VectorStore(tmp_path / "vectors")
+    store.add("x", [1.0, 0.0])
+    store.add("y", [0.0, 1.0])
+    store.remove("x")
+    store.add("z", [0.6, 0.8])
+    # 写入中断: 矩阵多出半行, ID 文件多出没有换行的半个 ID
+    with open(store.data_path, "ab") as f:
+        f.write(b"\0" * 4)
+    with open(store.ids_path, "ab") as f:
+        f.write(b"tor")
+
+    reopened = VectorStore(tmp_path / "vectors")
+    assert reopened.dim == 2
+    assert len(reopened) == 2
+    assert "x" not in reopened
+    assert reopened.get("z") == pytest.approx([0.6, 0.8])
+    assert [i for i, _ in reopened.search([0.0, 1.0], k=5)] == ["y", "z"]
+
+
+def test_search_by_vector_returns_entries(l3):
+    l3.store(_entry("x", "about x"), embedding=[1.0, 0.0])
+    l3.store(_entry("y", "about y"), embedding=[0.0, 1.0])
+    l3.store(_entry("none", "no embedding"))
+
+    results = l3.search_by_vector([0.9, 0.1], k=5)
+
+    assert [r["entry"].id for r in results] == ["x", "y"]
+    assert results[0]["entry"].content == "about x"
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_ivf_is_built_in_background_while_search_scans(tmp_path, monkeypatch):
+    np = pytest.importorskip("numpy")
+    monkeypatch.setattr(VectorStore, "IVF_THRESHOLD", 64)
+    store = VectorStore(tmp_path / "vectors")
+    rng = np.random.default_rng(1)
+    for n, vector in enumerate(rng.normal(size=(256, 4))):
+        store.add(f"v{n}", vector.tolist())
+    release = threading.Event()
+    build_ivf = store._build_ivf
+    monkeypatch.setattr(store, "_build_ivf", lambda n: release.wait(10) and build_ivf(n))
+
+    # 索引还没建好: 精确扫描, 不等待 k-means
+    exact = store.search([1.0, 0.0, 0.0, 0.0], k=5, exact=True)
+    assert store.search([1.0, 0.0, 0.0, 0.0], k=5) == exact
+    thread = store._ivf_thread
+    assert thread is not None and store._ivf is None
+
+    release.set()
+    thread.join(10)
+    assert store._ivf is not None and store.ivf_path.exists()
+    assert store.search([1.0, 0.0, 0.0, 0.0], k=1)[0][0] == exact[0][0]
+
+
+# ==================== L3 索引 ====================
+
+def test_merge_updates_index_in_place(l3):
+    for memory_id in ("a", "b", "c"):
+        l3.store(_entry(memory_id, importance=0.5), embedding=[1.0, 0.0])
+
+    merged = l3.merge("a", 0.9, boost=0.05)
+
+    assert merged.importance == pytest.approx(0.95)
+    assert [m["id"] for m in l3.index["memories"]] == ["a", "b", "c"]
+    assert l3.index["memories"][0]["importance"] == pytest.approx(0.95)
+    assert l3.index["memories"][0]["has_embedding"] is True
+
+
+def test_index_positions_survive_remove_and_reload(l3):
+    for memory_id in ("a", "b", "c", "d"):
+        l3.store(_entry(memory_id))
+    l3.remove(["b"])
+    l3.merge("c", 0.9)
+    l3.store(_entry("b"))
+
+    order = [m["id"] for m in l3.index["memories"]]
+    assert order == ["a", "c", "d", "b"]
+    assert all(l3._meta(memory_id)["id"] == memory_id for memory_id in order)
+
+    reloaded = LongTermMemory(str(l3.storage_path))
+    assert [m["id"] for m in reloaded.index["memories"]] == order
+    assert len(reloaded) == 4 and "b" in reloaded
+
+
+def test_concurrent_index_writes_and_near_duplicate_reads(l3):
+    """后台线程增删 L3 时, 近似重复检测和检索不会遍历到正在修改的结构"""
+    stop = threading.Event()
+    errors = []
+
+    def churn():
+        n = 0
+        try:
+            while not stop.is_set():
+                l3.store(_entry(f"w{n}", f"shared topic note number {n % 7}"))
+                if n >= 5:
+                    l3.remove([f"w{n - 5}"])
+                n += 1
+        except Exception as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=churn)
+    worker.start()
+    try:
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            l3.find_near_duplicate("shared topic note number 3")
+            l3.keyword_search(["topic"])
+            assert len(l3.metas()) <= len(l3) + 1
+    finally:
+        stop.set()
+        worker.join()
+
+    assert errors == []
+    assert [m["id"] for m in l3.metas()] == [m["id"] for m in l3.index["memories"]]
+
+
+# ==================== L4 技能清单 ====================
+
+def _write_skill(root: Path, name: str, description: str):
+    (root / name).mkdir(parents=True, exist_ok=True)
+    (root / name / "SKILL.md").write_text(
+        f"---\nname: {name}\ndescription: {description}\n---\nbody\n", encoding="utf-8")
+
+
+def test_skills_manifest_sees_in_place_edits(tmp_path, monkeypatch):
+    monkeypatch.setattr(ProceduralMemory, "CHECK_INTERVAL", 0.0)
+    skills = tmp_path / "skills"
+    _write_skill(skills, "search", "find things")
+    _write_skill(skills, "write", "write things")
+    l4 = ProceduralMemory(str(skills), str(tmp_path / "workflows"))
+    assert l4.skills_manifest()["search"]["description"] == "find things"
+
+    # 原地改写 SKILL.md 不改变技能目录的 mtime
+    dir_mtime = (skills / "search").stat().st_mtime_ns
+    _write_skill(skills, "search", "find things faster")
+    assert (skills / "search").stat().st_mtime_ns == dir_mtime
+
+    manifest = l4.skills_manifest()
+    assert manifest["search"]["description"] == "find things faster"
+    assert manifest["write"]["description"] == "write things"
+
+
+def test_skills_manifest_drops_and_restores_missing_skill_md(tmp_path, monkeypatch):
+    monkeypatch.setattr(ProceduralMemory, "CHECK_INTERVAL", 0.0)
+    skills = tmp_path / "skills"
+    _write_skill(skills, "search", "find things")
+    l4 = ProceduralMemory(str(skills), str(tmp_path / "workflows"))
+    assert l4.list_skills() == ["search"]
+
+    (skills / "search" / "SKILL.md").unlink()
+    assert l4.list_skills() == []
+    _write_skill(skills, "search", "back again")
+    assert l4.skills_manifest()["search"]["description"] == "back again"
+
+
+# ==================== 分层检索 ====================
+
+def test_recall_dedups_l1_hits_against_l2_l3(memory):
+    entry = memory.remember("deploy checklist for the gateway", importance=0.8)
+
+    results = memory.recall("gateway")
+
+    assert len(results) == 1
+    assert results[0]["source"] == "L1"
+    assert results[0]["content"]["entry_id"] == entry.id
+    assert not results.partial
+
+
+def test_recall_relevance_is_absolute(memory):
+    memory.remember("gateway gateway gateway timeout handling", importance=0.5)
+    memory.remember("notes on the gateway and nothing else of note here", importance=0.5)
+    memory.l1.clear()
+
+    results = memory.recall("gateway")
+
+    assert [r["source"] for r in results] == ["L2", "L2"]
+    # 各层最高分不再被拉到 1.0
+    assert all(0 < r["relevance"] < 1 for r in results)
+    assert results[0]["relevance"] > results[1]["relevance"]
+
+    memory.remember("gateway retries and backoff", importance=0.8)
+    memory.l1.clear()
+    l3 = [r for r in memory.recall("gateway missingterm") if r["source"] == "L3"]
+    assert [r["relevance"] for r in l3] == [0.5]
+
+
+def test_recall_skips_tier_whose_queries_are_still_running(memory, monkeypatch):
+    release = threading.Event()
+    started = []
+    recall_l3 = memory._recall_l3
+
+    def stuck_l3(query):
+        started.append(query)
+        release.wait(10)
+        return recall_l3(query)
+
+    monkeypatch.setattr(memory, "_recall_l3", stuck_l3)
+    memory.remember("gateway retries and backoff", importance=0.8)
+    try:
+        for _ in range(HierarchicalMemory.RECALL_WORKERS):
+            result = memory.recall("gateway", timeout=0.05)
+            assert result.partial and result.missing == ["L3"]
+        # L3 的名额都被超时的查询占着: 不排队也不等待, 直接跳过
+        begin = time.monotonic()
+        result = memory.recall("gateway")
+        assert time.monotonic() - begin < 1
+        assert result.missing == ["L3"]
+        assert [r["source"] for r in result] == ["L1"]
+        assert len(started) == HierarchicalMemory.RECALL_WORKERS
+    finally:
+        release.set()
+
+    # 卡住的查询结束后名额归还
+    deadline = time.monotonic() + 5
+    result = memory.recall("gateway", timeout=5)
+    while result.partial and time.monotonic() < deadline:
+        time.sleep(0.01)
+        result = memory.recall("gateway", timeout=5)
+    assert not result.partial
+
+
+# ==================== 快照导出/导入 ====================
+
+def _snapshot(memory: HierarchicalMemory) -> bytes:
+    return b"".join(memory.export_stream())
+
+
+def test_export_import_round_trip(memory, tmp_path, monkeypatch):
+    monkeypatch.setattr(HierarchicalMemory, "SNAPSHOT_CHUNK_RECORDS", 2)
+    for n in range(3):
+        memory.remember(f"medium term note {n}", importance=0.5)
+    memory.record_task("t1", "build", "build the gateway")
+    kept = memory.remember("long term fact about the gateway", importance=0.9)
+    vector = _entry("vec", "embedded fact")
+    memory.l3.store(vector, embedding=[0.6, 0.8])
+    snapshot = _snapshot(memory)
+
+    monkeypatch.setenv("HOME", str(tmp_path / "other"))
+    other = HierarchicalMemory("other")
+    stats = other.import_stream(io.BytesIO(snapshot))
+
+    assert stats["L3"] == 2 and stats["L2"] >= 5
+    assert stats["chunks"] > 1 and stats["skipped_chunks"] == 0
+    assert {m["id"] for m in other.l3.metas()} == {kept.id, vector.id}
+    assert other.l3.vectors.get(vector.id) == pytest.approx([0.6, 0.8])
+    assert {e.id for e in other.l2.search_memories("note")} == \
+        {e.id for e in memory.l2.search_memories("note")}
+    assert not list(other.l2.db_path.parent.glob(".import-*"))
+
+    # 重复导入不改变结果
+    again = other.import_stream(io.BytesIO(snapshot))
+    assert again["L3"] == 0
+    assert len(other.l3) == 2
+
+
+def test_import_resumes_after_truncated_stream(memory, tmp_path, monkeypatch):
+    monkeypatch.setattr(HierarchicalMemory, "SNAPSHOT_CHUNK_RECORDS", 1)
+    for n in range(4):
+        memory.remember(f"long term fact {n}", importance=0.9)
+    snapshot = _snapshot(memory)
+
+    monkeypatch.setenv("HOME", str(tmp_path / "other"))
+    other = HierarchicalMemory("other")
+    with pytest.raises(ValueError):
+        other.import_stream(io.BytesIO(snapshot[:len(snapshot) // 2]))
+    assert list(other.l2.db_path.parent.glob(".import-*"))
+
+    stats = other.import_stream(io.BytesIO(snapshot))
+    assert stats["skipped_chunks"] > 0
+    assert stats["skipped_chunks"] + stats["chunks"] == 8
+    assert len(other.l3) == len(memory.l3) == 4
+    assert not list(other.l2.db_path.parent.glob(".import-*"))
+
+
+def test_import_rejects_corrupt_chunk(memory, tmp_path, monkeypatch):
+    memory.remember("long term fact", importance=0.9)
+    snapshot = bytearray(_snapshot(memory))
+    snapshot[-60] ^= 0xFF
+
+    monkeypatch.setenv("HOME", str(tmp_path / "other"))
+    with pytest.raises(ValueError):
+        HierarchicalMemory("other").import_stream(io.BytesIO(bytes(snapshot)))
+
+
+def _snapshot_peaks(tmp_path: Path, monkeypatch, n: int) -> tuple:
+    """写入 n 条带 embedding 的 L3 记忆, 返回 (导出峰值, 导入峰值) 字节数"""
+    monkeypatch.setenv("HOME", str(tmp_path / f"src{n}"))
+    source = HierarchicalMemory("source")
+    source.l3.import_entries(
+        (_entry(f"m{i}", f"fact {i}"), [float(i % 7), 1.0, 2.0, 3.0])
+        for i in range(n)
+    )
+    path = tmp_path / f"snapshot{n}"
+    monkeypatch.setenv("HOME", str(tmp_path / f"dst{n}"))
+    target = HierarchicalMemory("target")
+
+    tracemalloc.start()
+    try:
+        with open(path, "wb") as f:
+            for frame in source.export_stream():
+                f.write(frame)
+        export_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        with open(path, "rb") as f:
+            stats = target.import_stream(f)
+        import_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert stats["L3"] == n
+    return export_peak, import_peak
+
+
+def test_snapshot_memory_does_not_grow_with_l3(tmp_path, monkeypatch):
+    monkeypatch.setattr(HierarchicalMemory, "SNAPSHOT_CHUNK_RECORDS", 20)
+    monkeypatch.setattr(HierarchicalMemory, "_recall_pools", {})
+    monkeypatch.setattr(HierarchicalMemory, "_recall_slots", {})
+    small = _snapshot_peaks(tmp_path, monkeypatch, 200)
+    large = _snapshot_peaks(tmp_path, monkeypatch, 2000)
+
+    # 索引常驻时 2000 条约多占 3 MB; 流式处理只与数据块大小有关
+    assert large[0] < small[0] * 1.5 + 64 * 1024
+    assert large[1] < small[1] * 1.5 + 64 * 1024
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+message_queue 单元测试
+
+运行: python -m pytest code/lib/test_message_queue.py
+"""
+
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from message_queue import (
+    PRIORITY_ORDER, WIRE_VERSION, MessageBuilder, MessageQueue, MessageRelay, MessageType,
+    Priority, QueueReaper, RelayServer, TraceIndex, decode_header, decode_message, detect_backend,
+    encode_message,
+)
+
+
+def _queue(root: Path, **kwargs) -> MessageQueue:
+    return MessageQueue(str(root), fsync=False, trace_index=False, **kwargs)
+
+
+def _request(to_agent: str = "worker", priority: Priority = Priority.NORMAL, **params):
+    return MessageBuilder("boss", "L1").request(to_agent, "L2", "do", params, priority=priority)
+
+
+def _tree(root: Path) -> list:
+    return sorted(str(p.relative_to(root)) for p in root.rglob("*"))
+
+
+# ==================== 线格式 ====================
+
+def test_wire_round_trip_keeps_every_field():
+    message = MessageBuilder("boss", "L1", session="s-1").request(
+        "worker", "L2", "翻译", {"text": "héllo 世界 🚀", "blob": "x" * 200_000},
+        priority=Priority.HIGH, deadline="2030-01-01T00:00:00")
+    message.metadata["标签"] = ["ä", None, 1.5]
+
+    decoded = decode_message(encode_message(message))
+    assert decoded == message
+    assert decoded.to_dict() == message.to_dict()
+    # 未访问 payload 的消息再次编码时原样复用消息体
+    assert encode_message(decode_message(encode_message(message))) == encode_message(message)
+
+
+def test_header_decodes_without_touching_body():
+    message = _request(text="payload")
+    buf = bytearray(encode_message(message))
+    buf[-5:] = b"\xff" * 5  # 破坏 body
+
+    header = decode_header(bytes(buf))
+    assert (header.type, header.priority, header.ttl) == \
+        (MessageType.REQUEST, Priority.NORMAL, message.ttl)
+    decoded = decode_message(bytes(buf))
+    assert decoded.id == message.id and decoded.to_agent == message.to_agent
+    with pytest.raises(ValueError):
+        decoded.payload
+
+
+def test_wire_rejects_newer_version_and_truncation():
+    buf = encode_message(_request(text="x" * 100))
+    newer = buf[:2] + bytes([WIRE_VERSION + 1]) + buf[3:]
+    for decode in (decode_header, decode_message):
+        with pytest.raises(ValueError, match="version"):
+            decode(newer)
+        with pytest.raises(ValueError, match="Truncated"):
+            decode(buf[:10])
+    with pytest.raises(ValueError, match="Truncated"):
+        decode_message(buf[:-1])
+
+
+def test_legacy_json_records_still_decode():
+    message = _request(text="旧格式")
+    for legacy in (encode_message(message, wire_format="json"),
+                   json.dumps(message.to_dict(), indent=2, ensure_ascii=False).encode("utf-8")):
+        assert decode_message(legacy) == message
+        header = decode_header(legacy)
+        assert header.type == MessageType.REQUEST and header.ttl == message.ttl
+
+
+# ==================== 指标 ====================
+
+def test_metrics_leaves_file_backend_inbox_untouched(tmp_path):
+    """默认 (segment) 后端读取指标时不能导入或改写兼容模式的 inbox"""
+    file_queue = _queue(tmp_path, backend="file")
+    sent = file_queue.send(_request(x=1))
+    before = _tree(tmp_path)
+
+    metrics = _queue(tmp_path).metrics()
+
+    assert _tree(tmp_path) == before
+    assert metrics["agents"]["worker"]["depth"] == 1
+    assert metrics["agents"]["worker"]["oldest_age_seconds"] >= 0
+    assert [m.id for m in file_queue.receive("worker")] == [sent]
+
+
+def test_metrics_does_not_create_files(tmp_path):
+    """没有 queue.stats 的 inbox: 用扫描结果作为 depth, 不创建计数器文件"""
+    queue = _queue(tmp_path)
+    queue.send(_request())
+    (tmp_path / "worker" / "queue.stats").unlink()
+    before = _tree(tmp_path)
+
+    assert queue.metrics()["agents"]["worker"]["depth"] == 1
+    assert _tree(tmp_path) == before
+
+
+def test_detect_backend(tmp_path):
+    _queue(tmp_path / "seg").send(_request())
+    _queue(tmp_path / "file", backend="file").send(_request())
+
+    assert detect_backend(tmp_path / "seg" / "worker" / "inbox") == "segment"
+    assert detect_backend(tmp_path / "file" / "worker" / "inbox") == "file"
+    assert detect_backend(tmp_path / "missing") is None
+
+
+# ==================== 优先级 ====================
+
+@pytest.mark.parametrize("backend", ["segment", "file"])
+def test_receive_pops_by_priority_then_fifo(tmp_path, backend):
+    queue = _queue(tmp_path, backend=backend)
+    order = [Priority.LOW, Priority.CRITICAL, Priority.NORMAL, Priority.LOW, Priority.HIGH,
+             Priority.CRITICAL, Priority.NORMAL, Priority.HIGH, Priority.LOW, Priority.CRITICAL]
+    sent = []
+    for n, priority in enumerate(order):
+        sent.append(_request(n=n, priority=priority))
+        queue.send(sent[-1])
+    # 一半单条发送, 一半批量发送
+    batch = [_request(n=n, priority=p) for n, p in enumerate(order, len(order))]
+    queue.send_many(batch)
+    sent.extend(batch)
+
+    expected = [m.id for p in PRIORITY_ORDER for m in sent if m.priority == p]
+    received = []
+    while True:
+        # 小批量租用, 跨越优先级边界时顺序不变
+        messages = queue.receive("worker", limit=3, visibility_timeout=30)
+        if not messages:
+            break
+        received.extend(m.id for m in messages)
+    assert received == expected
+
+
+# ==================== 租用与确认 ====================
+
+@pytest.mark.parametrize("backend", ["segment", "file"])
+def test_lease_expiry_redelivers(tmp_path, backend):
+    queue = _queue(tmp_path, backend=backend)
+    sent = queue.send(_request())
+
+    assert [m.id for m in queue.receive("worker", visibility_timeout=0.2)] == [sent]
+    # 租用期间不会再次投递
+    assert queue.receive("worker", visibility_timeout=0.2) == []
+    time.sleep(0.3)
+    assert [m.id for m in queue.receive("worker", visibility_timeout=30)] == [sent]
+    assert queue.ack_many("worker", [sent]) == 1
+    time.sleep(0.1)
+    assert queue.receive("worker", visibility_timeout=30) == []
+
+
+def test_leased_head_does_not_block_later_messages(tmp_path):
+    """队头租用未确认时, 之后的 receive 从跳过位置继续, 不重复投递"""
+    queue = _queue(tmp_path)
+    ids = queue.send_many([_request(n=n) for n in range(6)])
+
+    first = [m.id for m in queue.receive("worker", limit=3, visibility_timeout=30)]
+    second = [m.id for m in queue.receive("worker", limit=3, visibility_timeout=30)]
+
+    assert first + second == ids
+    assert queue.receive("worker", visibility_timeout=30) == []
+
+
+def test_redelivery_after_skip_position(tmp_path):
+    queue = _queue(tmp_path)
+    head, tail = queue.send_many([_request(n=0), _request(n=1)])
+
+    assert [m.id for m in queue.receive("worker", limit=1, visibility_timeout=0.2)] == [head]
+    assert [m.id for m in queue.receive("worker", limit=1, visibility_timeout=30)] == [tail]
+    time.sleep(0.3)
+    # 队头租期到期后重新扫描队头
+    assert [m.id for m in queue.receive("worker", visibility_timeout=30)] == [head]
+
+
+def test_double_ack_counts_once(tmp_path):
+    queue = _queue(tmp_path)
+    sent = queue.send(_request())
+    queue.receive("worker", visibility_timeout=30)
+
+    assert queue.ack_many("worker", [sent, sent]) == 1
+    assert queue.ack_many("worker", [sent]) == 0
+    # 另一个实例 (无进程内缓存) 也不能再确认
+    assert _queue(tmp_path).ack_many("worker", [sent]) == 0
+    assert queue.metrics()["agents"]["worker"]["dequeued_total"] == 1
+
+
+def _ack_in_child(root: str, message_id: str, result):
+    result.put(_queue(Path(root)).ack_many("worker", [message_id]))
+
+
+def test_cross_process_ack(tmp_path):
+    queue = _queue(tmp_path)
+    ids = queue.send_many([_request(n=n) for n in range(3)])
+    received = queue.receive("worker", limit=3, visibility_timeout=30)
+    assert [m.id for m in received] == ids
+
+    ctx = multiprocessing.get_context("fork")
+    result = ctx.Queue()
+    child = ctx.Process(target=_ack_in_child, args=(str(tmp_path), ids[1], result))
+    child.start()
+    child.join(10)
+    assert result.get(timeout=1) == 1
+
+    # 子进程补录的 ids.map 让本进程也能确认未缓存的 id
+    assert _queue(tmp_path).ack_many("worker", ids) == 2
+    stats = queue.metrics()["agents"]["worker"]
+    assert stats["depth"] == 0
+    assert stats["dequeued_total"] == 3
+
+
+def test_ack_after_compact(tmp_path):
+    queue = _queue(tmp_path)
+    backend = queue.backend
+    backend.SEGMENT_MAX_BYTES = 1
+    first, second = queue.send(_request(n=0)), queue.send(_request(n=1))
+    queue.receive("worker", limit=2, visibility_timeout=30)
+    assert queue.ack_many("worker", [first]) == 1
+    assert backend.compact("worker")["archived"] == 1
+
+    assert _queue(tmp_path).ack_many("worker", [second]) == 1
+    assert _queue(tmp_path).ack_many("worker", [first]) == 0
+
+
+def _count_fsyncs(monkeypatch) -> list:
+    calls = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: calls.append(fd) or fsync(fd))
+    return calls
+
+
+def test_send_many_and_ack_many_commit_once_per_batch(tmp_path, monkeypatch):
+    queue = MessageQueue(str(tmp_path), fsync=True, trace_index=False)
+    queue.send(_request(n=-1))  # 建好 inbox 和统计文件
+    fsyncs = _count_fsyncs(monkeypatch)
+
+    def commits(call) -> int:
+        before = len(fsyncs)
+        call()
+        return len(fsyncs) - before
+
+    one = commits(lambda: queue.send_many([_request(n=0)]))
+    assert commits(lambda: queue.send_many([_request(n=n) for n in range(40)])) == one
+    # 按收件人分组, 每个 inbox 提交一次
+    two = commits(lambda: queue.send_many([_request(n=0), _request("other", n=0)]))
+    assert two == one + commits(lambda: queue.send_many([_request("other", n=1)]))
+
+    ids = [m.id for m in queue.receive("worker", limit=100, visibility_timeout=30)]
+    assert len(ids) == 43
+    single = commits(lambda: queue.ack_many("worker", ids[:1]))
+    assert commits(lambda: queue.ack_many("worker", ids[1:])) == single
+
+
+@pytest.mark.parametrize("backend", ["segment", "file"])
+def test_ack_many_counts_only_messages_it_acked(tmp_path, backend):
+    queue = _queue(tmp_path, backend=backend)
+    a, b, c = queue.send_many([_request(n=n) for n in range(3)])
+    queue.receive("worker", limit=3, visibility_timeout=30)
+
+    assert queue.ack_many("worker", [a, "no-such-id", b, a]) == 2
+    assert queue.ack_many("worker", [b, c]) == 1
+    assert queue.ack_many("worker", []) == 0
+    assert queue.receive("worker", visibility_timeout=0) == []
+    assert queue.metrics()["agents"]["worker"]["dequeued_total"] == 3
+
+
+# ==================== 过期清理与归档 ====================
+
+def _expired_request(**params):
+    message = _request(**params)
+    message.timestamp = (datetime.now() - timedelta(seconds=message.ttl + 60)).isoformat()
+    return message
+
+
+def test_expired_messages_move_to_processed(tmp_path):
+    queue = _queue(tmp_path, backend="file")
+    processed = tmp_path / "worker" / "processed"
+    reaped, keep = queue.send_many([_expired_request(n=0), _request(n=1)])
+
+    assert queue.backend.reap_expired("worker") == 1
+    assert (processed / f"{reaped}.json").exists()
+    # receive 读到的过期消息同样移入 processed/, 不投递
+    lazy = queue.send(_expired_request(n=2))
+    assert [m.id for m in queue.receive("worker", visibility_timeout=0)] == [keep]
+    assert sorted(p.stem for p in processed.iterdir()) == sorted([reaped, lazy])
+    assert queue.metrics()["agents"]["worker"]["expired_total"] == 2
+
+
+def _archived(root: Path) -> list:
+    records = []
+    for path in sorted((root / "worker" / "archive").glob("processed-*.ndjson.gz")):
+        with gzip.open(path, "rb") as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+@pytest.mark.parametrize("backend", ["segment", "file"])
+def test_reaper_archives_processed_messages_as_gzip_ndjson(tmp_path, backend):
+    queue = _queue(tmp_path, backend=backend)
+    queue.backend.SEGMENT_MAX_BYTES = 1  # 每条消息一个 segment
+    acked = [_request(text="héllo 世界", n=0), _request(n=1)]
+    queue.send_many(acked)
+    queue.ack_many("worker", [m.id for m in queue.receive("worker", limit=2, visibility_timeout=30)])
+    expired, keep = _expired_request(n=2), _request(n=3)
+    queue.send_many([expired, keep])
+
+    report = QueueReaper(queue).run_once()
+    assert report["expired"] == 1 and report["archived"] == 3
+    assert report["inodes_reclaimed"] >= 3
+    # processed/ 的扫描顺序不固定, 按 ID 比较
+    assert sorted(_archived(tmp_path), key=lambda r: r["id"]) == \
+        sorted((m.to_dict() for m in acked + [expired]), key=lambda r: r["id"])
+    assert [m.id for m in queue.receive("worker", visibility_timeout=0)] == [keep.id]
+
+    # 当天归档追加新的 gzip 成员, 之前的记录仍可读出
+    queue.ack_many("worker", [m.id for m in queue.receive("worker", visibility_timeout=30)])
+    queue.send(_request(n=4))
+    assert QueueReaper(queue).run_once()["archived"] == 1
+    assert [r["id"] for r in _archived(tmp_path)][-1] == keep.id
+    assert len(_archived(tmp_path)) == 4
+    assert not list((tmp_path / "worker" / "processed").glob("*.json"))
+
+
+# ==================== 异步订阅 ====================
+
+def test_subscribe_does_not_block_event_loop(tmp_path, monkeypatch):
+    queue = _queue(tmp_path)
+    ids = queue.send_many([_request(n=n) for n in range(3)])
+    loop_threads = set()
+    read = queue._read
+
+    def tracking_read(*args):
+        loop_threads.add(threading.get_ident())
+        return read(*args)
+
+    monkeypatch.setattr(queue, "_read", tracking_read)
+
+    async def consume():
+        received = []
+        async for msg in queue.subscribe("worker"):
+            received.append(msg.id)
+            if len(received) == len(ids):
+                break
+        return received
+
+    assert asyncio.run(consume()) == ids
+    assert threading.get_ident() not in loop_threads
+
+
+# ==================== 遗留消息导入 ====================
+
+def test_segment_backend_imports_file_backend_messages(tmp_path):
+    file_queue = _queue(tmp_path, backend="file")
+    low = file_queue.send(MessageBuilder("boss", "L1").notification(
+        "worker", "L2", "tick", "heartbeat", priority=Priority.LOW))
+    normal = file_queue.send(_request(n=1))
+    critical = file_queue.send(MessageBuilder("boss", "L1").request(
+        "worker", "L2", "stop", {}, priority=Priority.CRITICAL))
+
+    queue = _queue(tmp_path)
+    received = queue.receive("worker", limit=10, visibility_timeout=30)
+
+    assert [m.id for m in received] == [critical, normal, low]
+    inbox = tmp_path / "worker" / "inbox"
+    assert not list(inbox.rglob("*.json"))
+    assert queue.ack_many("worker", [m.id for m in received]) == 3
+    # 再次打开不会重复导入
+    assert _queue(tmp_path).receive("worker", visibility_timeout=0) == []
+
+
+# ==================== 跨节点转发 ====================
+
+@pytest.fixture
+def relay_pair(tmp_path):
+    local = _queue(tmp_path / "local")
+    remote = _queue(tmp_path / "remote")
+    address = f"unix:{tmp_path / 'relay.sock'}"
+    servers = []
+
+    def start():
+        server = RelayServer(remote, address)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    relay = MessageRelay(local, "node-a", address, agents=["worker"])
+    yield local, remote, relay, start
+    relay.close()
+    for server in servers:
+        server.shutdown()
+
+
+def test_relay_resends_batch_after_disconnect(relay_pair, monkeypatch):
+    local, remote, relay, start = relay_pair
+    server = start()
+    ids = local.send_many([_request(n=n) for n in range(3)])
+
+    # 远端写入前断开: 批次留在本地待续传, 本地消息已确认
+    def drop(messages):
+        raise ConnectionError("peer went away")
+
+    monkeypatch.setattr(remote, "send_many", drop)
+    with pytest.raises(OSError):
+        relay.forward_once()
+    monkeypatch.undo()
+    assert local.receive("worker", visibility_timeout=0) == []
+    assert relay._load_pending() is not None
+
+    assert relay.forward_once() == 3
+    assert [m.id for m in remote.receive("worker", limit=10, visibility_timeout=0)] == ids
+    assert relay._load_pending() is None
+    assert server.committed("node-a") == 1
+
+
+def test_relay_does_not_resend_batch_whose_ack_was_lost(relay_pair, monkeypatch):
+    local, remote, relay, start = relay_pair
+    start()
+    ids = local.send_many([_request(n=n) for n in range(2)])
+
+    # 远端已提交, ACK 在断线中丢失
+    def lose_ack(seq):
+        relay.close()
+
+    monkeypatch.setattr(relay, "_complete", lose_ack)
+    relay.forward_once()
+    monkeypatch.undo()
+    assert relay._load_pending() is not None
+
+    # 重连握手时得知批次已提交, 不再重发
+    assert relay.forward_once() == 0
+    assert relay._load_pending() is None
+    assert [m.id for m in remote.receive("worker", limit=10, visibility_timeout=0)] == ids
+
+
+def test_relay_resumes_after_server_restart(relay_pair):
+    local, remote, relay, start = relay_pair
+    server = start()
+    local.send(_request(n=0))
+    assert relay.forward_once() == 1
+
+    server.shutdown()
+    relay.close()
+    later = local.send(_request(n=1))
+    with pytest.raises(OSError):
+        relay.forward_once()
+
+    start()
+    assert relay.forward_once() == 1
+    received = remote.receive("worker", limit=10, visibility_timeout=0)
+    assert [m.id for m in received][-1] == later
+    assert len(received) == 2
+
+
+def test_relay_restart_acks_messages_of_pending_batch(tmp_path, monkeypatch):
+    local = _queue(tmp_path / "local", visibility_timeout=0.2)
+    remote = _queue(tmp_path / "remote")
+    address = f"unix:{tmp_path / 'relay.sock'}"
+    server = RelayServer(remote, address)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ids = local.send_many([_request(n=n) for n in range(2)])
+
+    # 批次落盘后、确认本地消息前进程退出
+    def crash(agent_id, message_ids):
+        raise SystemExit
+
+    relay = MessageRelay(local, "node-a", address, agents=["worker"])
+    monkeypatch.setattr(local, "ack_many", crash)
+    with pytest.raises(SystemExit):
+        relay.forward_once()
+    monkeypatch.undo()
+    relay.close()
+
+    relay = MessageRelay(local, "node-a", address, agents=["worker"])
+    try:
+        time.sleep(0.3)  # 崩溃前的租约到期
+        assert relay.forward_once() == 2
+        assert relay.forward_once() == 0
+    finally:
+        relay.close()
+        server.shutdown()
+    assert [m.id for m in remote.receive("worker", limit=10, visibility_timeout=0)] == ids
+
+
+# ==================== 调用链追踪 ====================
+
+def test_trace_timeline_orders_hops_and_measures_delays(tmp_path):
+    traces = TraceIndex(tmp_path)
+    traces.record([
+        {"trace": "t1", "event": "send", "id": "b", "t": 20.0,
+         "from": "worker", "to": "boss", "type": "response"},
+        {"trace": "t1", "event": "send", "id": "a", "t": 10.0,
+         "from": "boss", "to": "worker", "type": "request"},
+        {"trace": "other", "event": "send", "id": "x", "t": 1.0,
+         "from": "boss", "to": "worker", "type": "request"},
+    ])
+    traces.record([
+        {"trace": "t1", "event": "receive", "id": "a", "t": 12.0, "agent": "worker"},
+        {"trace": "t1", "event": "receive", "id": "a", "t": 15.0, "agent": "worker"},
+        {"trace": "t1", "event": "ack", "id": "a", "t": 18.5, "agent": "worker"},
+        {"trace": "t1", "event": "receive", "id": "b", "t": 21.0, "agent": "boss"},
+    ])
+
+    first, second = traces.timeline("t1")
+    assert (first["id"], first["from"], first["to"]) == ("a", "boss", "worker")
+    # 重新投递不改变首次接收时间
+    assert first["deliveries"] == 2
+    assert first["queue_delay"] == 2.0 and first["processing"] == 6.5
+    assert second["id"] == "b" and second["queue_delay"] == 1.0
+    assert second["acked_at"] is None and second["processing"] is None
+    assert traces.timeline("missing") == []
+
+
+def test_trace_ids_cannot_escape_the_trace_directory(tmp_path):
+    traces = TraceIndex(tmp_path / "_traces")
+    for trace_id in ("../../escaped", "/abs/path", "a" * 129, ""):
+        traces.record([{"trace": trace_id, "event": "ack", "id": "m", "t": 1.0, "agent": "w"}])
+        assert [hop["id"] for hop in traces.timeline(trace_id)] == ["m"]
+
+    assert _tree(tmp_path)[0] == "_traces"
+    assert all(p.startswith("_traces") for p in _tree(tmp_path))
+    assert len(list((tmp_path / "_traces").rglob("*.ndjson"))) == 4
+
+
+def test_trace_prune_removes_stale_files(tmp_path):
+    traces = TraceIndex(tmp_path)
+    assert TraceIndex(tmp_path / "missing").prune(1) == 0
+    for trace_id in ("old", "new"):
+        traces.record([{"trace": trace_id, "event": "ack", "id": "m", "t": 1.0, "agent": "w"}])
+    stale = time.time() - 3 * 86400
+    os.utime(traces._path("old"), (stale, stale))
+
+    assert traces.prune(2) == 1
+    assert traces.timeline("old") == []
+    assert traces.timeline("new") != []
+
+
+def test_ack_traces_only_messages_the_backend_acked(tmp_path):
+    queue = MessageQueue(str(tmp_path), fsync=False)
+    first, second = queue.send_many([_request(n=0), _request(n=1)])
+    trace = {m.id: m.trace_id for m in queue.receive("worker", limit=2, visibility_timeout=30)}
+    # 另一个实例先确认了 second
+    assert _queue(tmp_path).ack_many("worker", [second]) == 1
+
+    assert queue.ack_many("worker", [first, second]) == 1
+    assert queue.trace(trace[first])[0]["acked_at"] is not None
+    assert queue.trace(trace[second])[0]["acked_at"] is None
+
+
+# ==================== 命令行 ====================
+
+def _cli(tmp_path: Path, *args) -> str:
+    env = dict(os.environ, HOME=str(tmp_path / "home"))
+    return subprocess.run(
+        [sys.executable, str(Path(__file__).parent / "message_queue.py"), *args],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+
+
+@pytest.mark.parametrize("backend", ["segment", "file"])
+def test_cli_send_and_check_use_base_path_and_backend(tmp_path, backend):
+    root = tmp_path / "board"
+    options = ["--base-path", str(root), "--backend", backend]
+    out = _cli(tmp_path, *options, "--send", "x", "--from", "boss", "--to", "worker",
+               "--message", "hello")
+    sent = out.split()[-1]
+
+    assert detect_backend(root / "worker" / "inbox") == backend
+    assert not (tmp_path / "home").exists()
+    checked = json.loads(_cli(tmp_path, *options, "--check", "worker"))
+    assert [m["id"] for m in checked] == [sent]
+    assert checked[0]["payload"]["params"]["description"] == "hello"
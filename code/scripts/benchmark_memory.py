@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+ClawOS Memory Benchmark
+Measures store throughput, recall latency, memory footprint and on-disk size
+of lib/memory_system.HierarchicalMemory and services.memory.MemoryManager on
+synthetic Chinese/English corpora.
+
+Each (target, size) case runs in a forked child process against a fresh
+temporary directory, so RSS numbers and disk usage are not polluted by other
+cases or by the real ~/clawos stores.
+
+Usage:
+    python benchmark_memory.py --sizes 1k,100k --output baseline.json
+    python benchmark_memory.py --sizes 1k --baseline baseline.json
+
+Output: JSON report on stdout (or --output). With --baseline, a comparison is
+added under "comparison" and the exit code is 1 if any metric regressed by
+more than --tolerance. Cases are matched by entry count ("1k" and "1000" are
+the same case). The baseline must have been run with the same lang, queries and
+seed and share at least one case with this run; otherwise the benchmark refuses
+to start (exit code 2).
+
+Memory: rss_bytes and peak_rss_bytes cover the whole process. Per tier,
+l1_bytes is the serialized size of L1 and l3_heap_bytes is the Python heap of a
+freshly loaded L3 store, measured with tracemalloc (the OS page cache of its
+files is not included). L2 lives in SQLite, which allocates outside
+tracemalloc, and Python's sqlite3 does not expose per-connection memory use, so
+only l2_cache_limit_bytes is reported: the page-cache ceiling (cache_size x
+page size) of an L2 connection. MemoryManager's L2 opens a connection per call,
+so its cache does not persist between calls.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Iterator
+
+# Configuration
+CODE_ROOT = Path(__file__).parent.parent
+LIB_DIR = CODE_ROOT / "lib"
+SERVICES_DIR = CODE_ROOT / "services"
+
+REPORT_VERSION = 1
+TARGETS = ("hierarchical", "manager")
+DEFAULT_SIZES = "1k"
+DEFAULT_QUERIES = 50
+DEFAULT_TOLERANCE = 0.10
+AGENTS = ("gm", "research-pm", "coding-worker", "alpha-commander",
+          "writing-pm", "qa-worker", "ops-worker", "assistant")
+
+# Run settings that must match for a baseline comparison to mean anything
+CONFIG_KEYS = ("lang", "queries", "seed")
+
+# Metrics compared against a baseline, and whether larger values are better
+COMPARED_METRICS = {
+    "store.per_second": True,
+    "recall.p50_ms": False,
+    "recall.p99_ms": False,
+    "memory.rss_bytes": False,
+    "memory.l3_heap_bytes": False,
+    "disk.total_bytes": False,
+}
+
+# ---------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------
+
+EN_SUBJECTS = ["The gm agent", "The research PM", "Worker coding-3", "Alpha commander",
+               "The QA worker", "The ops worker", "The writing PM", "The assistant"]
+EN_ACTIONS = ["deployed", "reviewed", "refactored", "benchmarked", "rolled back",
+              "escalated", "migrated", "profiled", "archived", "retried"]
+EN_OBJECTS = ["the message queue", "the SQLite index", "the vector store",
+              "the health report", "the relay server", "the skills manifest",
+              "the blackboard inbox", "the nightly sync job", "the session cache",
+              "the GitHub backup", "the risk controller", "the evolution scheduler"]
+EN_QUALIFIERS = ["after a failed health check", "before the nightly sync",
+                 "with a {n} minute timeout", "on the Mac mini node",
+                 "during the weekly evolution run", "for task {n}",
+                 "while the inbox held {n} messages"]
+EN_OUTCOMES = ["latency dropped to {n} ms", "{n} tasks were retried",
+               "the error rate stayed under 1%", "disk usage grew by {n} MB",
+               "the queue drained in {n} seconds", "no regressions were found"]
+
+ZH_SUBJECTS = ["GM", "研究 PM", "编码工人三号", "Alpha 指挥官", "质检工人",
+               "运维工人", "写作 PM", "助理"]
+ZH_ACTIONS = ["部署了", "审查了", "重构了", "压测了", "回滚了", "升级处理了",
+              "迁移了", "分析了", "归档了", "重试了"]
+ZH_OBJECTS = ["消息队列", "SQLite 索引", "向量存储", "健康报告", "转发服务",
+              "技能清单", "黑板收件箱", "夜间同步任务", "会话缓存", "GitHub 备份",
+              "风控模块", "进化调度器"]
+ZH_QUALIFIERS = ["在健康检查失败之后", "在夜间同步之前", "超时时间设为 {n} 分钟",
+                 "在 Mac mini 节点上", "在每周进化期间", "针对任务 {n}",
+                 "当时收件箱积压了 {n} 条消息"]
+ZH_OUTCOMES = ["延迟降到 {n} 毫秒", "重试了 {n} 个任务", "错误率保持在百分之一以下",
+               "磁盘占用增加了 {n} MB", "队列在 {n} 秒内清空", "没有发现性能回退"]
+
+
+def _fill(template: str, rng: random.Random) -> str:
+    return template.format(n=rng.randint(1, 500))
+
+
+def make_sentence(rng: random.Random, lang: str) -> str:
+    """One synthetic memory in the given language ("en" or "zh")."""
+    if lang == "zh":
+        text = (rng.choice(ZH_SUBJECTS) + _fill(rng.choice(ZH_QUALIFIERS), rng) +
+                rng.choice(ZH_ACTIONS) + rng.choice(ZH_OBJECTS) + "，" +
+                _fill(rng.choice(ZH_OUTCOMES), rng) + "。")
+        if rng.random() < 0.3:
+            text += "随后" + rng.choice(ZH_ACTIONS) + rng.choice(ZH_OBJECTS) + "。"
+        return text
+    text = (f"{rng.choice(EN_SUBJECTS)} {rng.choice(EN_ACTIONS)} {rng.choice(EN_OBJECTS)} "
+            f"{_fill(rng.choice(EN_QUALIFIERS), rng)}; {_fill(rng.choice(EN_OUTCOMES), rng)}.")
+    if rng.random() < 0.3:
+        text += f" Then it {rng.choice(EN_ACTIONS)} {rng.choice(EN_OBJECTS)}."
+    return text
+
+
+def corpus(size: int, seed: int, lang: str) -> Iterator[dict[str, Any]]:
+    """Yield `size` synthetic records; `lang` is "en", "zh" or "mixed"."""
+    rng = random.Random(seed)
+    for i in range(size):
+        record_lang = lang if lang != "mixed" else rng.choice(("en", "zh"))
+        yield {
+            "index": i,
+            "agent_id": rng.choice(AGENTS),
+            "lang": record_lang,
+            "text": make_sentence(rng, record_lang),
+            "importance": round(rng.random(), 3),
+            "score": round(rng.uniform(0.2, 1.0), 3),
+        }
+
+
+def queries(count: int, seed: int, lang: str) -> list[dict[str, Any]]:
+    """Recall queries built from corpus vocabulary, so most of them have hits."""
+    rng = random.Random(seed + 1)
+    result = []
+    for _ in range(count):
+        query_lang = lang if lang != "mixed" else rng.choice(("en", "zh"))
+        if query_lang == "zh":
+            text = rng.choice([o for o in ZH_OBJECTS if len(o) >= 3])
+            keywords = [rng.choice(EN_OBJECTS).split()[-1]]
+        else:
+            obj = rng.choice(EN_OBJECTS).split()
+            text = " ".join(obj[1:])
+            keywords = [w.lower() for w in obj[1:]]
+        result.append({"text": text, "keywords": keywords, "agent_id": rng.choice(AGENTS)})
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Measurement helpers
+# ---------------------------------------------------------------------------
+
+def parse_size(text: str) -> int:
+    """'1k' -> 1000, '100k' -> 100000, '1M' -> 1000000."""
+    text = text.strip()
+    multiplier = {"k": 1_000, "K": 1_000, "m": 1_000_000, "M": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("kKmM")) * multiplier)
+
+
+def percentile(samples: list[float], q: float) -> float | None:
+    """Nearest-rank percentile of `samples` (q in 0-100)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def latency_stats(samples: list[float]) -> dict[str, Any]:
+    """Latency summary in milliseconds."""
+    ms = [s * 1000 for s in samples]
+    return {
+        "queries": len(ms),
+        "p50_ms": percentile(ms, 50),
+        "p99_ms": percentile(ms, 99),
+        "mean_ms": sum(ms) / len(ms) if ms else None,
+    }
+
+
+def timed(samples: list[float], func, *args, **kwargs) -> Any:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def current_rss() -> int | None:
+    """Resident set size of this process in bytes (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> int:
+    """Peak RSS in bytes (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def disk_usage(*paths: Path) -> int:
+    """Total size in bytes of the given files and directory trees."""
+    total = 0
+    for path in paths:
+        if path.is_file():
+            total += path.stat().st_size
+        elif path.is_dir():
+            for root, _, files in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def sqlite_files(db_path: Path) -> list[Path]:
+    """A SQLite database plus its WAL and shared-memory files."""
+    return [db_path, Path(f"{db_path}-wal"), Path(f"{db_path}-shm")]
+
+
+def sqlite_cache_limit(conn: sqlite3.Connection) -> int:
+    """Page-cache ceiling of a SQLite connection in bytes."""
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    # Negative cache_size is a limit in KiB, positive a number of pages
+    if cache_size < 0:
+        return -cache_size * 1024
+    return cache_size * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def heap_bytes(factory) -> int:
+    """Python heap still allocated after constructing factory() (tracemalloc)."""
+    tracemalloc.start()
+    try:
+        obj = factory()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del obj
+    return current
+
+
+# ---------------------------------------------------------------------------
+# Benchmark cases
+# ---------------------------------------------------------------------------
+
+def bench_hierarchical(workdir: Path, size: int, query_list: list[dict], seed: int,
+                       lang: str) -> dict[str, Any]:
+    """HierarchicalMemory: remember() for every record, then recall() per query."""
+    # HierarchicalMemory resolves its stores under ~, point it at the workdir
+    os.environ["HOME"] = str(workdir)
+    sys.path.insert(0, str(LIB_DIR))
+    from memory_system import HierarchicalMemory
+
+    memory = HierarchicalMemory("benchmark")
+    rss_before = current_rss()
+
+    start = time.perf_counter()
+    for record in corpus(size, seed, lang):
+        memory.remember(record["text"], "experience", record["importance"], record["agent_id"])
+    store_seconds = time.perf_counter() - start
+    rss_after = current_rss()
+
+    recall, l2, l3 = [], [], []
+    for query in query_list:
+        timed(recall, memory.recall, query["text"])
+        timed(l2, memory.l2.search, query["text"], limit=5)
+        timed(l3, memory.l3.keyword_search, query["text"].split(), limit=5)
+
+    peak = peak_rss()
+    l2_path = memory.l2.db_path
+    l3_path = memory.l3.storage_path
+    l2_cache = sqlite_cache_limit(memory.l2.engine.connection())
+    memory.l2.engine.close()
+    l3_heap = heap_bytes(lambda: type(memory.l3)(str(l3_path)))
+    return {
+        "store": {"seconds": store_seconds, "per_second": size / store_seconds},
+        "recall": {**latency_stats(recall),
+                   "tiers": {"L2": latency_stats(l2), "L3": latency_stats(l3)}},
+        "memory": {
+            "rss_bytes": rss_after,
+            "rss_growth_bytes": rss_after - rss_before if rss_after and rss_before else None,
+            "peak_rss_bytes": peak,
+            "l1_bytes": sum(len(json.dumps(item, ensure_ascii=False).encode())
+                            for item in memory.l1.context),
+            "l2_cache_limit_bytes": l2_cache,
+            "l3_heap_bytes": l3_heap,
+        },
+        "disk": {
+            "L2_bytes": disk_usage(*sqlite_files(l2_path)),
+            "L3_bytes": disk_usage(l3_path),
+            "total_bytes": disk_usage(*sqlite_files(l2_path), l3_path),
+        },
+        "tiers": {"L1": len(memory.l1.context), "L3": len(memory.l3)},
+    }
+
+
+def _import_memory_manager():
+    try:
+        from clawos.services.memory import MemoryManager
+    except ImportError:
+        # Source checkout where code/ is not installed as the clawos package
+        sys.path.insert(0, str(SERVICES_DIR))
+        from memory import MemoryManager
+    return MemoryManager
+
+
+def bench_manager(workdir: Path, size: int, query_list: list[dict], seed: int,
+                  lang: str) -> dict[str, Any]:
+    """MemoryManager: store_task_result() for every record, then L2/L3 lookups per query."""
+    MemoryManager = _import_memory_manager()
+    l2_path = workdir / "l2" / "history.db"
+    l3_path = workdir / "l3"
+    manager = MemoryManager("benchmark", l2_path=l2_path, l3_path=l3_path,
+                            l4_path=workdir / "l4")
+    rss_before = current_rss()
+
+    start = time.perf_counter()
+    for record in corpus(size, seed, lang):
+        manager.store_task_result(
+            {"id": f"task-{record['index']}", "agent_id": record["agent_id"],
+             "type": "benchmark", "description": record["text"]},
+            {"status": "success" if record["score"] > 0.4 else "failure",
+             "output": record["text"], "score": record["score"]},
+        )
+    store_seconds = time.perf_counter() - start
+    rss_after = current_rss()
+
+    recall, l2, l3 = [], [], []
+    for query in query_list:
+        timed(recall, manager.get_full_context, query["agent_id"])
+        timed(l2, manager.get_agent_history, query["agent_id"], 20)
+        timed(l3, manager.retrieve_experiences, query["agent_id"], query["keywords"])
+
+    peak = peak_rss()
+    conn = sqlite3.connect(str(l2_path))
+    try:
+        l2_cache = sqlite_cache_limit(conn)
+    finally:
+        conn.close()
+    l3_heap = heap_bytes(lambda: type(manager.l3)(manager.l3.storage_path))
+    return {
+        "store": {"seconds": store_seconds, "per_second": size / store_seconds},
+        "recall": {**latency_stats(recall),
+                   "tiers": {"L2": latency_stats(l2), "L3": latency_stats(l3)}},
+        "memory": {
+            "rss_bytes": rss_after,
+            "rss_growth_bytes": rss_after - rss_before if rss_after and rss_before else None,
+            "peak_rss_bytes": peak,
+            "l1_bytes": manager.l1.size_estimate(),
+            "l2_cache_limit_bytes": l2_cache,
+            "l3_heap_bytes": l3_heap,
+        },
+        "disk": {
+            "L2_bytes": disk_usage(*sqlite_files(l2_path)),
+            "L3_bytes": disk_usage(l3_path),
+            "total_bytes": disk_usage(*sqlite_files(l2_path), l3_path),
+        },
+        "tiers": {"L1": len(manager.l1)},
+    }
+
+
+BENCHMARKS = {"hierarchical": bench_hierarchical, "manager": bench_manager}
+
+
+def run_case(target: str, size: int, query_count: int, seed: int, lang: str,
+             keep: bool) -> dict[str, Any]:
+    """Run one case in the current process against a fresh temporary directory."""
+    workdir = Path(tempfile.mkdtemp(prefix=f"clawos-bench-{target}-"))
+    try:
+        result = BENCHMARKS[target](workdir, size, queries(query_count, seed, lang), seed, lang)
+        result["entries"] = size
+        if keep:
+            result["workdir"] = str(workdir)
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_isolated(*args) -> dict[str, Any]:
+    """Run a case in a forked child so RSS and module state start clean."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("fork")) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+# ---------------------------------------------------------------------------
+
+def _metric(result: dict[str, Any], path: str) -> float | None:
+    value: Any = result
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value if isinstance(value, (int, float)) else None
+
+
+def _by_entries(sizes: dict[str, Any]) -> dict[int, Any]:
+    """Results keyed by entry count instead of the size string they were run with."""
+    return {parse_size(size): result for size, result in sizes.items()}
+
+
+def baseline_problems(baseline: dict[str, Any], config: dict[str, Any],
+                      cases: list[tuple[str, str]]) -> list[str]:
+    """Reasons `baseline` cannot be compared with a run of `cases` ((target, size) pairs)."""
+    problems = []
+    base_config = baseline.get("config")
+    if base_config is None:
+        problems.append("baseline has no config")
+    else:
+        problems.extend(
+            f"{key} is {base_config.get(key)!r} in the baseline but {config.get(key)!r} here"
+            for key in CONFIG_KEYS if base_config.get(key) != config.get(key)
+        )
+    results = baseline.get("results", {})
+    if not any(parse_size(size) in _by_entries(results.get(target, {}))
+               for target, size in cases):
+        problems.append("baseline has no cases in common with this run")
+    return problems
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any],
+            tolerance: float) -> list[dict[str, Any]]:
+    """
+    Per-metric change against a baseline report; flags regressions beyond tolerance.
+
+    Raises ValueError if the baseline was run with a different config or shares
+    no case with the report.
+    """
+    cases = [(target, size) for target, sizes in report["results"].items() for size in sizes]
+    problems = baseline_problems(baseline, report["config"], cases)
+    if problems:
+        raise ValueError("cannot compare with baseline: " + "; ".join(problems))
+
+    rows = []
+    for target, sizes in report["results"].items():
+        base_sizes = _by_entries(baseline["results"].get(target, {}))
+        for size, result in sizes.items():
+            base = base_sizes.get(parse_size(size))
+            if base is None:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                current, previous = _metric(result, metric), _metric(base, metric)
+                if current is None or not previous:
+                    continue
+                change = (current - previous) / previous
+                worse = -change if higher_is_better else change
+                rows.append({
+                    "case": f"{target}/{size}",
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "change": round(change, 4),
+                    "regression": worse > tolerance,
+                })
+    return rows
+
+
+def format_comparison(rows: list[dict[str, Any]]) -> str:
+    """Human-readable comparison table."""
+    lines = [f"{'case':<22} {'metric':<20} {'baseline':>14} {'current':>14} {'change':>9}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(
+            f"{row['case']:<22} {row['metric']:<20} {row['baseline']:>14.2f} "
+            f"{row['current']:>14.2f} {row['change']:>+8.1%}{flag}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ClawOS memory system benchmark")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="Comma-separated corpus sizes, e.g. 1k,100k,1M")
+    parser.add_argument("--targets", default=",".join(TARGETS),
+                        help=f"Comma-separated targets ({', '.join(TARGETS)})")
+    parser.add_argument("--lang", choices=["mixed", "en", "zh"], default="mixed",
+                        help="Corpus language")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES,
+                        help="Recall queries per case")
+    parser.add_argument("--seed", type=int, default=42, help="Corpus random seed")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Compare against a saved JSON report")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative change counted as a regression (default 0.10)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary stores")
+    args = parser.parse_args()
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    config = {"lang": args.lang, "queries": args.queries, "seed": args.seed}
+
+    baseline = None
+    if args.baseline:
+        # Check before running anything, a mismatched baseline makes the whole run moot
+        baseline = json.loads(Path(args.baseline).read_text())
+        problems = baseline_problems(baseline, config,
+                                     [(target, size) for target in targets for size in sizes])
+        if problems:
+            parser.error("cannot compare with baseline: " + "; ".join(problems))
+
+    report: dict[str, Any] = {
+        "version": REPORT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlite": sqlite3.sqlite_version,
+        },
+        "config": config,
+        "results": {},
+    }
+    for target in targets:
+        for size in sizes:
+            print(f"Running {target} with {size} entries...", file=sys.stderr)
+            result = run_isolated(target, parse_size(size), args.queries, args.seed,
+                                  args.lang, args.keep)
+            report["results"].setdefault(target, {})[size] = result
+
+    status = 0
+    if baseline is not None:
+        rows = compare(report, baseline, args.tolerance)
+        report["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance,
+                                "metrics": rows}
+        print(format_comparison(rows), file=sys.stderr)
+        if any(row["regression"] for row in rows):
+            status = 1
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,7 @@ Output: JSON and Markdown reports to clawos/blackboard/persistence/health-report
 
 import json
 import os
+import sys
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
@@ -16,6 +17,11 @@ from typing import Any
 CLAWOS_ROOT = Path(os.environ.get("CLAWOS_ROOT", Path(__file__).parent.parent))
 BLACKBOARD_ROOT = CLAWOS_ROOT / "blackboard"
 REPORTS_DIR = BLACKBOARD_ROOT / "persistence" / "health-reports"
+LIB_DIR = Path(__file__).parent.parent / "lib"
+
+# Inbox backlog thresholds (see protocols/MESSAGE.md)
+QUEUE_DEPTH_THRESHOLD = 100
+QUEUE_AGE_THRESHOLD_SECONDS = 1800
 
 
 def load_check_result(check_name: str) -> dict[str, Any] | None:
@@ -29,10 +35,43 @@ def load_check_result(check_name: str) -> dict[str, Any] | None:
     return None
 
 
+def load_queue_metrics() -> dict[str, Any] | None:
+    """Read per-agent inbox depth, age and throughput from the queue counters.
+
+    Read-only: the queue picks the backend matching each inbox on disk and
+    never migrates or creates files.
+    """
+    if not BLACKBOARD_ROOT.is_dir():
+        return None
+    sys.path.insert(0, str(LIB_DIR))
+    try:
+        from message_queue import MessageQueue
+
+        queue = MessageQueue(str(BLACKBOARD_ROOT), fsync=False, trace_index=False)
+        return queue.metrics()
+    except Exception:
+        return None
+    finally:
+        sys.path.remove(str(LIB_DIR))
+
+
+def backed_up_queues(queues: dict[str, Any] | None) -> list[str]:
+    """Agents whose inbox exceeds the depth or oldest-message age threshold."""
+    if not queues:
+        return []
+    return [
+        agent
+        for agent, stats in sorted(queues.get("agents", {}).items())
+        if stats["depth"] >= QUEUE_DEPTH_THRESHOLD
+        or stats["oldest_age_seconds"] >= QUEUE_AGE_THRESHOLD_SECONDS
+    ]
+
+
 def calculate_overall_health(
     nodes: dict[str, Any] | None,
     blackboard: dict[str, Any] | None,
     timeouts: dict[str, Any] | None,
+    queues: dict[str, Any] | None = None,
 ) -> dict[str, Any]:
     """Calculate overall system health score."""
 
@@ -73,6 +112,17 @@ def calculate_overall_health(
         health_score -= 15
         issues.append("Timeout check failed")
 
+    # Inbox backlog (informational when metrics are unavailable)
+    backed_up = backed_up_queues(queues)
+    if backed_up:
+        health_score -= min(10, len(backed_up) * 5)
+        for agent in backed_up:
+            stats = queues["agents"][agent]
+            issues.append(
+                f"Inbox backed up: {agent} ({stats['depth']} pending, "
+                f"oldest {stats['oldest_age_seconds'] / 60:.0f} min)"
+            )
+
     health_score = max(0, min(100, health_score))
 
     # Determine status
@@ -103,6 +153,7 @@ def generate_markdown_report(
     nodes: dict[str, Any] | None,
     blackboard: dict[str, Any] | None,
     timeouts: dict[str, Any] | None,
+    queues: dict[str, Any] | None = None,
 ) -> str:
     """Generate a Markdown formatted health report."""
     now = datetime.now(tz=timezone.utc)
@@ -248,6 +299,34 @@ def generate_markdown_report(
         lines.append("*Timeout check data not available*")
         lines.append("")
 
+    # Queues section
+    lines.extend(
+        [
+            f"## 📬 Message Queues",
+            f"",
+        ]
+    )
+
+    if queues and queues.get("agents"):
+        lines.extend(
+            [
+                f"| Agent | Depth | Oldest (s) | In/s | Out/s | p50 (s) | p95 (s) |",
+                f"|-------|-------|------------|------|-------|---------|---------|",
+            ]
+        )
+        for agent, stats in sorted(queues["agents"].items()):
+            wait = stats["time_in_queue_seconds"]
+            p50 = f"{wait['p50']:.2f}" if wait["p50"] is not None else "-"
+            p95 = f"{wait['p95']:.2f}" if wait["p95"] is not None else "-"
+            lines.append(
+                f"| `{agent}` | {stats['depth']} | {stats['oldest_age_seconds']:.0f} "
+                f"| {stats['enqueue_rate']:.2f} | {stats['dequeue_rate']:.2f} | {p50} | {p95} |"
+            )
+        lines.append("")
+    else:
+        lines.append("*Queue metrics not available*")
+        lines.append("")
+
     # Footer
     lines.extend(
         [
@@ -267,9 +346,10 @@ def generate_health_report() -> dict[str, Any]:
     nodes = load_check_result("nodes-check")
     blackboard = load_check_result("blackboard-check")
     timeouts = load_check_result("timeout-check")
+    queues = load_queue_metrics()
 
     # Calculate overall health
-    overall = calculate_overall_health(nodes, blackboard, timeouts)
+    overall = calculate_overall_health(nodes, blackboard, timeouts, queues)
 
     # Build comprehensive report
     report = {
@@ -315,11 +395,17 @@ def generate_health_report() -> dict[str, Any]:
         }
         if timeouts
         else None,
+        "queues": {
+            "backed_up": backed_up_queues(queues),
+            "agents": queues["agents"],
+        }
+        if queues
+        else None,
         "critical_issues": overall["issues"],
     }
 
     # Generate Markdown report
-    markdown = generate_markdown_report(overall, nodes, blackboard, timeouts)
+    markdown = generate_markdown_report(overall, nodes, blackboard, timeouts, queues)
 
     return report, markdown, overall
 
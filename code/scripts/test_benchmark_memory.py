@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Tests for the baseline comparison in benchmark_memory."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from benchmark_memory import baseline_problems, compare, parse_size
+
+CONFIG = {"lang": "mixed", "queries": 50, "seed": 42}
+
+
+def _report(sizes, config=CONFIG, per_second=100.0, l3_heap=1000):
+    result = {"store": {"per_second": per_second},
+              "memory": {"rss_bytes": 1 << 20, "l3_heap_bytes": l3_heap}}
+    return {"config": dict(config), "results": {"hierarchical": {s: result for s in sizes}}}
+
+
+def test_parse_size():
+    assert parse_size("1k") == parse_size("1000") == parse_size("0.001M") == 1000
+
+
+def test_cases_match_by_entry_count():
+    rows = compare(_report(["1k"], per_second=80.0), _report(["1000"]), tolerance=0.1)
+
+    by_metric = {row["metric"]: row for row in rows}
+    assert by_metric["store.per_second"]["regression"]
+    assert by_metric["store.per_second"]["case"] == "hierarchical/1k"
+    assert not by_metric["memory.rss_bytes"]["regression"]
+
+
+def test_memory_footprint_regression():
+    rows = compare(_report(["1k"], l3_heap=2000), _report(["1k"]), tolerance=0.1)
+
+    assert [row["metric"] for row in rows if row["regression"]] == ["memory.l3_heap_bytes"]
+
+
+@pytest.mark.parametrize("key, value", [("lang", "zh"), ("queries", 10), ("seed", 7)])
+def test_config_mismatch_is_rejected(key, value):
+    baseline = _report(["1k"], config={**CONFIG, key: value})
+
+    with pytest.raises(ValueError, match=key):
+        compare(_report(["1k"]), baseline, tolerance=0.1)
+
+
+def test_no_overlapping_cases_is_rejected():
+    with pytest.raises(ValueError, match="no cases in common"):
+        compare(_report(["1k"]), _report(["100k"]), tolerance=0.1)
+    assert baseline_problems(_report(["100k"]), CONFIG, [("manager", "100k")])
+    assert baseline_problems(_report(["100k"]), CONFIG, [("hierarchical", "100000")]) == []
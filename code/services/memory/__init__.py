@@ -25,6 +25,7 @@ Usage:
 """
 
 from .l1_session import L1SessionMemory
+from .l1_shared import SharedSessionMemory
 from .l2_history import L2TaskHistory
 from .l3_vector import L3VectorMemory
 from .l4_github import L4GitHubMemory
@@ -32,6 +33,7 @@ from .memory_manager import MemoryManager
 
 __all__ = [
     "L1SessionMemory",
+    "SharedSessionMemory",
     "L2TaskHistory",
     "L3VectorMemory",
     "L4GitHubMemory",
@@ -2,12 +2,177 @@
 """L1 Session Memory - RAM-based session context (~100MB)
 
 This layer provides fast, in-memory storage for session context.
-Data is lost when the session ends or the process terminates.
+Data is lost when the session ends or the process terminates, unless the
+session is persistent, in which case it is logged to disk (see l1_wal).
 """
 
+from collections import OrderedDict
 from datetime import datetime
-from typing import Any, Optional, Dict
-import json
+from pathlib import Path
+from typing import Any, Iterable, Optional, Dict, List, Set, Tuple
+import math
+import sys
+import time
+
+from .l1_wal import SessionLog
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate serialized size of a value in bytes, without serializing it.
+
+    Strings count one byte per character (three for non-ASCII text), containers
+    the sum of their items plus a small overhead, and unknown objects their
+    ``sys.getsizeof``.
+
+    Args:
+        value: Value to measure
+
+    Returns:
+        Estimated size in bytes
+    """
+    if isinstance(value, str):
+        return len(value) if value.isascii() else len(value) * 3
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if value is None or isinstance(value, bool):
+        return 5
+    if isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, dict):
+        return 2 + sum(estimate_size(k) + estimate_size(v) + 2 for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 2 + sum(estimate_size(v) + 1 for v in value)
+    return sys.getsizeof(value)
+
+
+class _TimingWheel:
+    """Hierarchical timing wheel for key expiry.
+
+    LEVELS wheels of SLOTS slots each; level ``n`` covers ``SLOTS ** (n + 1)``
+    ticks. A key is filed in the level its deadline falls into and moved down
+    a level when the wheel reaches its slot, so scheduling, cancelling and
+    expiring a key are all O(1) amortized. Deadlines beyond the top level are
+    parked in its furthest slot and re-filed when that slot comes up.
+
+    Advancing jumps straight to the next tick whose slot holds keys, so the
+    cost of catching up after an idle period does not grow with its length.
+    """
+
+    SLOT_BITS = 6
+    SLOTS = 1 << SLOT_BITS
+    LEVELS = 4
+
+    def __init__(self, tick: float, now: float):
+        """Initialize the wheel.
+
+        Args:
+            tick: Resolution in seconds
+            now: Current wall-clock time
+        """
+        self.tick = tick
+        self.current = int(now // tick)
+        self.wheels: List[List[Set[str]]] = [
+            [set() for _ in range(self.SLOTS)] for _ in range(self.LEVELS)
+        ]
+        # key -> (level, slot, deadline tick)
+        self._where: Dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key: str, deadline: float) -> None:
+        """(Re)schedule a key to expire at a wall-clock deadline."""
+        self.cancel(key)
+        # The current slot has been processed already; past-due keys go in the next
+        self._place(key, math.ceil(deadline / self.tick), self.current + 1)
+
+    def cancel(self, key: str) -> None:
+        """Forget a key's deadline, if it has one."""
+        where = self._where.pop(key, None)
+        if where is not None:
+            self.wheels[where[0]][where[1]].discard(key)
+
+    def clear(self) -> None:
+        """Forget all deadlines."""
+        for wheel in self.wheels:
+            for slot in wheel:
+                slot.clear()
+        self._where.clear()
+
+    def _place(self, key: str, due: int, earliest: int) -> None:
+        span = self.SLOTS ** self.LEVELS
+        # Never file before ``earliest``, nor beyond the top level's reach
+        target = min(max(due, earliest), self.current + span - 1)
+        delta = target - self.current
+        level = 0
+        while delta >= self.SLOTS ** (level + 1):
+            level += 1
+        slot = (target >> (self.SLOT_BITS * level)) & (self.SLOTS - 1)
+        self.wheels[level][slot].add(key)
+        self._where[key] = (level, slot, due)
+
+    def _next_event(self, target: int) -> int:
+        """First tick in (current, target] at which a non-empty slot comes up.
+
+        Level 0 visits a slot every tick; higher levels only at multiples of
+        their slot span. Each level has SLOTS slots, so at most SLOTS candidate
+        ticks per level are checked.
+
+        Returns:
+            That tick, or ``target`` if every slot until then is empty
+        """
+        best = target
+        for tick in range(self.current + 1, min(best, self.current + self.SLOTS) + 1):
+            if self.wheels[0][tick & (self.SLOTS - 1)]:
+                best = tick
+                break
+        for level in range(1, self.LEVELS):
+            span = self.SLOTS ** level
+            tick = (self.current // span + 1) * span
+            for _ in range(self.SLOTS):
+                if tick >= best:
+                    break
+                if self.wheels[level][(tick >> (self.SLOT_BITS * level)) & (self.SLOTS - 1)]:
+                    best = tick
+                    break
+                tick += span
+        return best
+
+    def advance(self, now: float) -> List[str]:
+        """Move the wheel to ``now``.
+
+        Args:
+            now: Current wall-clock time
+
+        Returns:
+            Keys whose deadline has passed
+        """
+        target = int(now // self.tick)
+        if not self._where:
+            self.current = max(self.current, target)
+            return []
+
+        expired = []
+        while self.current < target:
+            self.current = self._next_event(target)
+            # Cascade higher levels whose slot boundary was reached, top first
+            for level in range(self.LEVELS - 1, 0, -1):
+                if self.current % (self.SLOTS ** level) == 0:
+                    slot = (self.current >> (self.SLOT_BITS * level)) & (self.SLOTS - 1)
+                    keys, self.wheels[level][slot] = self.wheels[level][slot], set()
+                    for key in keys:
+                        # Cascades run before the current slot is expired
+                        self._place(key, self._where[key][2], self.current)
+
+            bucket = self.wheels[0][self.current & (self.SLOTS - 1)]
+            for key in list(bucket):
+                if self._where[key][2] <= self.current:
+                    bucket.discard(key)
+                    del self._where[key]
+                    expired.append(key)
+            if not self._where:
+                self.current = target
+        return expired
 
 
 class L1SessionMemory:
@@ -15,58 +180,195 @@ class L1SessionMemory:
 
     Capacity: ~100MB
     Purpose: Fast access to current session context
-    Persistence: None (RAM only)
+    Persistence: None (RAM only), or an append-only log with ``persist=True``
+
+    Entries are kept in least-recently-used order; ``retrieve`` and
+    ``get_entry`` refresh a key. The size of each entry is estimated once on
+    insert and kept in a side table, so the running total always matches
+    what eviction subtracts. When either the key count or the byte
+    budget is exceeded, least recently used keys are evicted.
+
+    Keys stored with a ``ttl`` carry an ``"expires_at"`` timestamp. An expired
+    key is invisible to ``retrieve``/``__contains__`` immediately and is
+    reclaimed through a timing wheel that every call advances, or by ``expire()``.
+
+    A persistent session appends every store and delete to a write-ahead log
+    under ``wal_dir`` and compacts it when stale records dominate. Stored
+    values must then be JSON-serializable. ``recover`` replays the log after a
+    restart; recovered keys are in order of last write rather than last use.
     """
 
     MAX_SIZE = 100 * 1024 * 1024  # 100MB
     MAX_KEYS = 10000  # Maximum number of keys
-
-    def __init__(self, session_id: str):
+    TTL_TICK = 1.0  # Timing wheel resolution in seconds
+    DEFAULT_WAL_DIR = Path.home() / "clawos/memory/l1"
+
+    def __init__(
+        self,
+        session_id: str,
+        max_size: Optional[int] = None,
+        max_keys: Optional[int] = None,
+        default_ttl: Optional[float] = None,
+        persist: bool = False,
+        wal_dir: Optional[Path] = None,
+    ):
         """Initialize session memory.
 
+        A persistent session picks up the existing log for ``session_id``.
+
         Args:
             session_id: Unique identifier for this session
+            max_size: Optional byte budget (defaults to MAX_SIZE)
+            max_keys: Optional key limit (defaults to MAX_KEYS)
+            default_ttl: Optional TTL in seconds for keys stored without one
+            persist: Log every mutation to disk
+            wal_dir: Optional log directory (defaults to DEFAULT_WAL_DIR)
         """
         self.session_id = session_id
-        self.context: Dict[str, Dict[str, Any]] = {}
+        self.max_size = max_size or self.MAX_SIZE
+        self.max_keys = max_keys or self.MAX_KEYS
+        self.context: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self.created = datetime.now()
         self._size_estimate = 0
+        # key -> estimated size, kept out of the entries callers see
+        self._sizes: Dict[str, int] = {}
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._wheel = _TimingWheel(self.TTL_TICK, time.time())
+        self._log: Optional[SessionLog] = None
+        if persist:
+            self._log = SessionLog(self.wal_path(session_id, wal_dir))
+            self._restore(self._log.replay())
 
-    def store(self, key: str, value: Any, metadata: Optional[Dict] = None) -> bool:
+    @classmethod
+    def wal_path(cls, session_id: str, wal_dir: Optional[Path] = None) -> Path:
+        """Get the log file of a persistent session."""
+        return (wal_dir or cls.DEFAULT_WAL_DIR) / f"{session_id}.wal"
+
+    def store(
+        self,
+        key: str,
+        value: Any,
+        metadata: Optional[Dict] = None,
+        ttl: Optional[float] = None,
+    ) -> bool:
         """Store a value in session context.
 
         Args:
             key: Key to store under
             value: Value to store
             metadata: Optional metadata to attach
+            ttl: Optional lifetime in seconds (defaults to default_ttl)
 
         Returns:
-            True if stored successfully, False if size limit exceeded
+            True if stored successfully, False if the entry alone exceeds the
+            size budget
         """
-        # Estimate size
-        try:
-            value_size = len(json.dumps(value))
-        except (TypeError, ValueError):
-            value_size = 1024  # Default estimate for non-serializable
-
-        entry_size = value_size + len(key) * 2  # Rough estimate
-
-        # Check size limits
-        if self._size_estimate + entry_size > self.MAX_SIZE:
+        now = time.time()
+        self._expire(now)
+        metadata = metadata or {}
+        entry_size = estimate_size(key) + estimate_size(value) + estimate_size(metadata)
+        if entry_size > self.max_size:
             return False
-        if len(self.context) >= self.MAX_KEYS:
-            # Remove oldest entry
-            oldest_key = next(iter(self.context))
-            self.delete(oldest_key)
 
-        self.context[key] = {
+        self._discard(key, log=False)
+        entry = {
             "value": value,
             "timestamp": datetime.now().isoformat(),
-            "metadata": metadata or {},
+            "metadata": metadata,
         }
+        ttl = ttl if ttl is not None else self.default_ttl
+        if ttl is not None:
+            entry["expires_at"] = now + ttl
+            self._wheel.schedule(key, entry["expires_at"])
+        if self._log is not None:
+            self._log.store(key, entry)
+        self.context[key] = entry
+        self._sizes[key] = entry_size
         self._size_estimate += entry_size
+        self._evict()
+        self._maybe_compact()
         return True
 
+    def _discard(self, key: str, log: bool = True) -> Optional[Dict[str, Any]]:
+        """Remove a key and release its accounted size."""
+        entry = self.context.pop(key, None)
+        if entry is not None:
+            self._size_estimate -= self._sizes.pop(key)
+            if "expires_at" in entry:
+                self._wheel.cancel(key)
+            if log and self._log is not None:
+                self._log.delete(key)
+        return entry
+
+    def _restore(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Load exported or logged entries, dropping expired ones.
+
+        Sizes are measured on load; a ``"size"`` field written by older
+        versions is dropped.
+        """
+        now = time.time()
+        for key, entry in entries:
+            if self._expired(entry, now):
+                if self._log is not None:
+                    self._log.delete(key)
+                continue
+            entry = {k: v for k, v in entry.items() if k != "size"}
+            size = (
+                estimate_size(key)
+                + estimate_size(entry.get("value"))
+                + estimate_size(entry.get("metadata", {}))
+            )
+            self.context[key] = entry
+            self._sizes[key] = size
+            self._size_estimate += size
+            if "expires_at" in entry:
+                self._wheel.schedule(key, entry["expires_at"])
+        self._evict()
+
+    def _maybe_compact(self) -> None:
+        if self._log is not None and self._log.needs_compaction():
+            self._log.compact(self.context.items())
+
+    @staticmethod
+    def _expired(entry: Dict[str, Any], now: float) -> bool:
+        return entry.get("expires_at", math.inf) <= now
+
+    def _expire(self, now: float) -> int:
+        """Reclaim keys whose deadline passed since the last call."""
+        count = 0
+        for key in self._wheel.advance(now):
+            entry = self.context.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._discard(key)
+                count += 1
+        self.expirations += count
+        return count
+
+    def expire(self) -> int:
+        """Reclaim all expired keys now.
+
+        Returns:
+            Number of keys reclaimed
+        """
+        return self._expire(time.time())
+
+    def _evict(self) -> None:
+        """Evict least recently used keys until both limits are met."""
+        while self.context and (
+            len(self.context) > self.max_keys or self._size_estimate > self.max_size
+        ):
+            key, entry = self.context.popitem(last=False)
+            self._size_estimate -= self._sizes.pop(key)
+            if "expires_at" in entry:
+                self._wheel.cancel(key)
+            if self._log is not None:
+                self._log.delete(key)
+            self.evictions += 1
+
     def retrieve(self, key: str) -> Optional[Any]:
         """Retrieve a value from session context.
 
@@ -76,7 +378,7 @@ class L1SessionMemory:
         Returns:
             The stored value or None if not found
         """
-        entry = self.context.get(key)
+        entry = self.get_entry(key)
         return entry.get("value") if entry else None
 
     def get_entry(self, key: str) -> Optional[Dict[str, Any]]:
@@ -88,7 +390,20 @@ class L1SessionMemory:
         Returns:
             Full entry dict or None if not found
         """
-        return self.context.get(key)
+        now = time.time()
+        self._expire(now)
+        entry = self.context.get(key)
+        if entry is not None and self._expired(entry, now):
+            # Expired within the current wheel tick
+            self._discard(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.context.move_to_end(key)
+        self.hits += 1
+        return entry
 
     def delete(self, key: str) -> bool:
         """Delete a key from context.
@@ -99,40 +414,81 @@ class L1SessionMemory:
         Returns:
             True if deleted, False if not found
         """
-        if key in self.context:
-            entry = self.context[key]
-            try:
-                size = len(json.dumps(entry))
-            except (TypeError, ValueError):
-                size = 1024
-            self._size_estimate -= size
-            del self.context[key]
-            return True
-        return False
+        deleted = self._discard(key) is not None
+        self._maybe_compact()
+        return deleted
+
+    def ttl(self, key: str) -> Optional[float]:
+        """Get the remaining lifetime of a key.
+
+        Args:
+            key: Key to inspect
+
+        Returns:
+            Seconds until expiry, or None if the key is missing or has no TTL
+        """
+        entry = self.context.get(key)
+        if entry is None or "expires_at" not in entry:
+            return None
+        remaining = entry["expires_at"] - time.time()
+        return remaining if remaining > 0 else None
 
     def clear(self) -> None:
         """Clear all session context."""
         self.context.clear()
+        self._sizes.clear()
+        self._wheel.clear()
         self._size_estimate = 0
+        if self._log is not None:
+            self._log.reset()
+
+    def close(self) -> None:
+        """Flush and release the log of a persistent session."""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
 
     def keys(self) -> list:
-        """Get all keys in context."""
-        return list(self.context.keys())
+        """Get all live keys in context."""
+        now = time.time()
+        self._expire(now)
+        return [k for k, e in self.context.items() if not self._expired(e, now)]
 
     def size_estimate(self) -> int:
         """Get estimated size in bytes."""
         return self._size_estimate
 
+    def stats(self) -> Dict[str, Any]:
+        """Get cache counters.
+
+        Returns:
+            Dict with keys, size, limits, hits, misses, evictions, expirations
+            and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "keys": len(self.context),
+            "size_estimate": self._size_estimate,
+            "max_keys": self.max_keys,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
     def export(self) -> dict:
         """Export session for persistence or transfer.
 
         Returns:
-            Dict with session data
+            Dict with session data; entries are copies, so later changes
+            to the session do not leak into the export
         """
         return {
             "sessionId": self.session_id,
             "created": self.created.isoformat(),
-            "context": self.context,
+            "context": {key: dict(entry) for key, entry in self.context.items()},
             "sizeEstimate": self._size_estimate,
         }
 
@@ -147,16 +503,39 @@ class L1SessionMemory:
             Restored L1SessionMemory instance
         """
         instance = cls(data["sessionId"])
-        instance.context = data.get("context", {})
-        instance._size_estimate = data.get("sizeEstimate", 0)
+        instance._restore(data.get("context", {}).items())
         if "created" in data:
             instance.created = datetime.fromisoformat(data["created"])
         return instance
 
+    @classmethod
+    def recover(
+        cls, session_id: str, wal_dir: Optional[Path] = None, **kwargs
+    ) -> "L1SessionMemory":
+        """Rebuild a persistent session from its log after a restart.
+
+        Only the latest record of each key is decoded. If the session has no
+        log yet, an empty persistent session is returned.
+
+        Args:
+            session_id: Session to recover
+            wal_dir: Optional log directory (defaults to DEFAULT_WAL_DIR)
+            **kwargs: Further constructor arguments (limits, default_ttl)
+
+        Returns:
+            Recovered persistent L1SessionMemory instance
+        """
+        return cls(session_id, persist=True, wal_dir=wal_dir, **kwargs)
+
     def __len__(self) -> int:
-        """Return number of stored keys."""
+        """Return number of stored keys.
+
+        Keys expiring within the current wheel tick may still be counted.
+        """
+        self.expire()
         return len(self.context)
 
     def __contains__(self, key: str) -> bool:
-        """Check if key exists."""
-        return key in self.context
+        """Check if key exists and has not expired."""
+        entry = self.context.get(key)
+        return entry is not None and not self._expired(entry, time.time())
@@ -0,0 +1,767 @@
+#!/usr/bin/env python3
+"""L1 Shared Session Memory - Session context shared by processes on a node
+
+When a PM spawns worker processes, they can all attach to one session
+context held in a ``multiprocessing.shared_memory`` arena instead of each
+building its own L1 or passing context through the blackboard.
+
+Arena layout:
+    header   magic, version, dirty flag, index capacity, data size, data tail,
+             generation, live/tombstone counts, live bytes, created time
+    index    open-addressing hash table, one slot per key:
+             version, key hash, record offset, record length
+    data     append-only records: key length, value length, expires_at,
+             key, JSON-encoded entry
+
+Reads take no lock. Each index slot is a seqlock: writers make its version
+odd while updating it, and readers retry when the version was odd or changed
+under them. Records are never modified in place; an update appends a new
+record and repoints the slot. Compaction, which rewrites the data region and
+index, makes the arena generation odd, and readers retry across it too.
+
+Writes are serialized across processes with ``flock`` on a lock file. A
+writer sets the dirty flag before changing anything and clears it with its
+final header write. A writer that dies mid-update leaves the flag set, and
+maybe a version or the generation odd; the next writer to take the lock
+repairs the arena, as does a reader that keeps retrying.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import fcntl
+import hashlib
+import json
+import struct
+import threading
+import time
+
+MAGIC = b"CL1S"
+VERSION = 1
+
+# magic, version, capacity, data size, tail, generation, count, tombstones,
+# live bytes, created
+_HEADER = struct.Struct("<4sB3xIQQQIIQd")
+_HEADER_SIZE = 64
+_DIRTY_OFFSET = 5  # First padding byte; every header write clears it
+_GENERATION = struct.Struct("<Q")
+_GENERATION_OFFSET = struct.calcsize("<4sB3xIQQ")
+_SLOT = struct.Struct("<IQII")
+_RECORD = struct.Struct("<HId")
+
+EMPTY = 0
+TOMBSTONE = 1
+
+_RETRY = object()
+
+
+def _key_hash(key: bytes) -> int:
+    """64-bit key hash, never colliding with the EMPTY/TOMBSTONE markers."""
+    h = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+    return h if h > TOMBSTONE else h + 2
+
+
+class SharedSessionMemory:
+    """Session memory shared between processes through a shared memory arena.
+
+    Capacity: DEFAULT_SIZE bytes of records, max_keys keys
+    Purpose: One session context for a PM and its workers
+    Persistence: Until ``unlink`` (or reboot)
+
+    Offers the same interface as L1SessionMemory, including TTLs,
+    ``from_export`` and ``recover``. Unlike L1SessionMemory it does not
+    evict: when the arena is full after compaction, ``store`` returns False.
+    Stored values must be JSON-serializable, and it keeps no hit/miss
+    counters.
+
+    The arena outlives the processes using it, so ``recover`` after a crash
+    simply reattaches. Whoever owns the session (usually the PM) calls
+    ``unlink`` when it ends.
+    """
+
+    DEFAULT_SIZE = 64 * 1024 * 1024  # 64MB
+    MAX_KEYS = 10000
+    MAX_LOAD = 0.75  # Live + tombstone slots per index slot
+    SPIN_LIMIT = 1000  # Reader retries before waiting for the write lock
+    DEFAULT_LOCK_DIR = Path.home() / "clawos/memory/l1"
+
+    def __init__(
+        self,
+        session_id: str,
+        size: Optional[int] = None,
+        max_keys: Optional[int] = None,
+        default_ttl: Optional[float] = None,
+        lock_dir: Optional[Path] = None,
+    ):
+        """Attach to the session's arena, creating it if needed.
+
+        Args:
+            session_id: Unique identifier for this session
+            size: Data region size in bytes when creating (defaults to DEFAULT_SIZE)
+            max_keys: Key limit when creating (defaults to MAX_KEYS)
+            default_ttl: Optional TTL in seconds for keys stored without one
+            lock_dir: Optional directory for the write lock file
+
+        Raises:
+            ValueError: If the segment exists but is not an L1 arena
+        """
+        self.session_id = session_id
+        self.default_ttl = default_ttl
+        self.name = self.segment_name(session_id)
+        lock_path = (lock_dir or self.DEFAULT_LOCK_DIR) / f"{self.name}.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(lock_path, "a+b")
+        self._thread_lock = threading.Lock()
+        self._buf = None
+
+        with self._locked():
+            try:
+                self._shm = self._open(create=False)
+            except FileNotFoundError:
+                capacity = 1
+                while capacity * self.MAX_LOAD < (max_keys or self.MAX_KEYS):
+                    capacity *= 2
+                data_size = size or self.DEFAULT_SIZE
+                self._shm = self._open(
+                    create=True, size=_HEADER_SIZE + capacity * _SLOT.size + data_size
+                )
+                _HEADER.pack_into(
+                    self._shm.buf, 0, MAGIC, VERSION, capacity, data_size,
+                    0, 0, 0, 0, 0, time.time(),
+                )
+
+        self._buf = self._shm.buf
+        magic, version, capacity, data_size, *_, created = _HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Shared memory segment {self.name} is not an L1 arena")
+        self.capacity = capacity
+        self.data_size = data_size
+        self.created = datetime.fromtimestamp(created)
+        self._mask = capacity - 1
+        self._index = _HEADER_SIZE
+        self._data = _HEADER_SIZE + capacity * _SLOT.size
+
+    @staticmethod
+    def segment_name(session_id: str) -> str:
+        """Get the shared memory segment name of a session."""
+        return "clawos-l1-" + hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).hexdigest()
+
+    def _open(self, create: bool, size: int = 0) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(name=self.name, create=create, size=size)
+        # The arena's lifetime is managed by unlink(), not by whichever
+        # process happens to exit first
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    @contextmanager
+    def _locked(self):
+        """Serialize a write against other threads and processes.
+
+        Repairs the arena first if the previous writer died mid-update.
+        """
+        with self._thread_lock:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                if self._buf is not None and self._buf[_DIRTY_OFFSET]:
+                    self._repair()
+                yield
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    # ---- lock-free reads ----
+
+    def _generation(self) -> int:
+        return _GENERATION.unpack_from(self._buf, _GENERATION_OFFSET)[0]
+
+    def _backoff(self, spins: int) -> int:
+        """Wait for a writer before a reader retries.
+
+        After SPIN_LIMIT retries the reader blocks on the write lock instead,
+        and repairs whatever a writer that died holding it left behind.
+
+        Returns:
+            The reader's new retry count
+        """
+        if spins < self.SPIN_LIMIT:
+            time.sleep(0)
+            return spins + 1
+        with self._locked():
+            self._repair()
+        return 0
+
+    def _probe(self, key: bytes, h: int):
+        """Find a key's slot and record without locking.
+
+        Returns:
+            (slot, record offset, record length, expires_at), None if the key
+            is absent, or _RETRY if a writer got in the way
+        """
+        buf = self._buf
+        i = h & self._mask
+        for _ in range(self.capacity):
+            pos = self._index + i * _SLOT.size
+            version, slot_hash, offset, length = _SLOT.unpack_from(buf, pos)
+            if version & 1:
+                return _RETRY
+            if slot_hash == EMPTY:
+                return None
+            if slot_hash == h:
+                start = self._data + offset
+                key_len, _, expires_at = _RECORD.unpack_from(buf, start)
+                key_start = start + _RECORD.size
+                if buf[key_start:key_start + key_len] == key:
+                    if _SLOT.unpack_from(buf, pos)[0] != version:
+                        return _RETRY
+                    return i, offset, length, expires_at
+            i = (i + 1) & self._mask
+        return None
+
+    def _read(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """Read a key's encoded entry.
+
+        Returns:
+            (entry bytes, expires_at), or None if the key is absent
+        """
+        key_bytes = key.encode("utf-8")
+        h = _key_hash(key_bytes)
+        buf = self._buf
+        spins = 0
+        while True:
+            generation = self._generation()
+            if generation & 1:
+                spins = self._backoff(spins)
+                continue
+            try:
+                found = self._probe(key_bytes, h)
+                if found is not None and found is not _RETRY:
+                    _, offset, length, expires_at = found
+                    start = self._data + offset + _RECORD.size + len(key_bytes)
+                    value = bytes(buf[start:self._data + offset + length])
+            except (struct.error, ValueError):
+                # Torn read of a slot being rewritten
+                found = _RETRY
+            if found is _RETRY or self._generation() != generation:
+                spins = self._backoff(spins)
+                continue
+            return None if found is None else (value, expires_at)
+
+    def get_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get full entry including timestamp and metadata.
+
+        Args:
+            key: Key to retrieve
+
+        Returns:
+            Full entry dict or None if not found or expired
+        """
+        found = self._read(key)
+        if found is None:
+            return None
+        value, expires_at = found
+        if expires_at and expires_at <= time.time():
+            return None
+        return json.loads(value)
+
+    def retrieve(self, key: str) -> Optional[Any]:
+        """Retrieve a value from session context.
+
+        Args:
+            key: Key to retrieve
+
+        Returns:
+            The stored value or None if not found
+        """
+        entry = self.get_entry(key)
+        return entry.get("value") if entry else None
+
+    def ttl(self, key: str) -> Optional[float]:
+        """Get the remaining lifetime of a key.
+
+        Args:
+            key: Key to inspect
+
+        Returns:
+            Seconds until expiry, or None if the key is missing or has no TTL
+        """
+        found = self._read(key)
+        if found is None or not found[1]:
+            return None
+        remaining = found[1] - time.time()
+        return remaining if remaining > 0 else None
+
+    def _scan(self) -> List[Tuple[str, int, int, float]]:
+        """List (key, record offset, record length, expires_at) of live slots."""
+        buf = self._buf
+        spins = 0
+        while True:
+            generation = self._generation()
+            if generation & 1:
+                spins = self._backoff(spins)
+                continue
+            found = []
+            try:
+                for i in range(self.capacity):
+                    pos = self._index + i * _SLOT.size
+                    _, slot_hash, offset, length = _SLOT.unpack_from(buf, pos)
+                    if slot_hash <= TOMBSTONE:
+                        continue
+                    start = self._data + offset
+                    key_len, _, expires_at = _RECORD.unpack_from(buf, start)
+                    key = str(buf[start + _RECORD.size:start + _RECORD.size + key_len], "utf-8")
+                    found.append((key, offset, length, expires_at))
+            except (struct.error, ValueError):
+                found = None
+            if found is not None and self._generation() == generation:
+                return found
+            spins = self._backoff(spins)
+
+    def keys(self) -> list:
+        """Get all live keys in context."""
+        now = time.time()
+        return [key for key, _, _, expires_at in self._scan() if not expires_at or expires_at > now]
+
+    def __len__(self) -> int:
+        """Return number of stored keys.
+
+        Expired keys not yet reclaimed are still counted.
+        """
+        return self._header()["count"]
+
+    def __contains__(self, key: str) -> bool:
+        """Check if key exists and has not expired."""
+        found = self._read(key)
+        return found is not None and not (found[1] and found[1] <= time.time())
+
+    def size_estimate(self) -> int:
+        """Get size of live records in bytes."""
+        return self._header()["live_bytes"]
+
+    def _header(self) -> Dict[str, Any]:
+        (_, _, capacity, data_size, tail, generation, count, tombstones,
+         live_bytes, created) = _HEADER.unpack_from(self._buf, 0)
+        return {
+            "capacity": capacity,
+            "data_size": data_size,
+            "tail": tail,
+            "generation": generation,
+            "count": count,
+            "tombstones": tombstones,
+            "live_bytes": live_bytes,
+            "created": created,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Get arena counters.
+
+        Returns:
+            Dict with keys, size, arena usage and generation
+        """
+        header = self._header()
+        return {
+            "keys": header["count"],
+            "size_estimate": header["live_bytes"],
+            "max_keys": int(self.capacity * self.MAX_LOAD),
+            "data_size": header["data_size"],
+            "data_used": header["tail"],
+            "tombstones": header["tombstones"],
+            "generation": header["generation"],
+        }
+
+    # ---- serialized writes ----
+
+    def _mark_dirty(self) -> None:
+        """Flag an update in progress until the next header write."""
+        self._buf[_DIRTY_OFFSET] = 1
+
+    def _write_header(self, header: Dict[str, Any]) -> None:
+        _HEADER.pack_into(
+            self._buf, 0, MAGIC, VERSION, header["capacity"], header["data_size"],
+            header["tail"], header["generation"], header["count"],
+            header["tombstones"], header["live_bytes"], header["created"],
+        )
+
+    def _write_slot(self, i: int, slot_hash: int, offset: int, length: int) -> None:
+        pos = self._index + i * _SLOT.size
+        # Already odd if a writer died here; readers are retrying either way
+        version = _SLOT.unpack_from(self._buf, pos)[0] | 1
+        struct.pack_into("<I", self._buf, pos, version)
+        _SLOT.pack_into(self._buf, pos, version, slot_hash, offset, length)
+        struct.pack_into("<I", self._buf, pos, version + 1)
+
+    def _record_matches(self, slot_hash: int, offset: int, length: int) -> bool:
+        """Whether a slot points at a complete record of a key with its hash."""
+        if length < _RECORD.size or offset + length > self.data_size:
+            return False
+        start = self._data + offset
+        key_len, value_len, _ = _RECORD.unpack_from(self._buf, start)
+        if _RECORD.size + key_len + value_len != length:
+            return False
+        key = bytes(self._buf[start + _RECORD.size:start + _RECORD.size + key_len])
+        return _key_hash(key) == slot_hash
+
+    def _repair(self) -> None:
+        """Undo the effects of a writer that died holding the write lock.
+
+        Caller holds the write lock, so any odd version is stale. A slot left
+        mid-update is kept if it points at a complete record with its hash and
+        dropped otherwise. If a slot was torn or the dirty flag is set, the
+        header counters and tail are recounted from the index, since the
+        writer may have died before writing the header. A compaction that
+        died part way has already overwritten the data region, so the arena
+        is cleared.
+        """
+        header = self._header()
+        if header["generation"] & 1:
+            self._reset(header)
+            return
+
+        torn = []
+        for i in range(self.capacity):
+            version, slot_hash, offset, length = _SLOT.unpack_from(
+                self._buf, self._index + i * _SLOT.size
+            )
+            if version & 1:
+                torn.append((i, slot_hash, offset, length))
+        if not torn and not self._buf[_DIRTY_OFFSET]:
+            return
+
+        for i, slot_hash, offset, length in torn:
+            if slot_hash > TOMBSTONE and not self._record_matches(slot_hash, offset, length):
+                slot_hash = TOMBSTONE
+            self._write_slot(i, slot_hash, offset, length)
+
+        header.update(count=0, tombstones=0, live_bytes=0)
+        for i in range(self.capacity):
+            _, slot_hash, offset, length = _SLOT.unpack_from(
+                self._buf, self._index + i * _SLOT.size
+            )
+            if slot_hash == TOMBSTONE:
+                header["tombstones"] += 1
+            elif slot_hash != EMPTY:
+                header["count"] += 1
+                header["live_bytes"] += length
+                # The slot may point at a record appended before the tail moved
+                header["tail"] = max(header["tail"], offset + length)
+        self._write_header(header)
+
+    def _find_slot(self, key: bytes, h: int) -> Tuple[Optional[int], Optional[int]]:
+        """Find a key's slot, or the slot to insert it into (writers only).
+
+        Returns:
+            (existing slot, free slot); one of them is None
+        """
+        i = h & self._mask
+        free = None
+        for _ in range(self.capacity):
+            _, slot_hash, offset, _ = _SLOT.unpack_from(self._buf, self._index + i * _SLOT.size)
+            if slot_hash == EMPTY:
+                return None, i if free is None else free
+            if slot_hash == TOMBSTONE:
+                if free is None:
+                    free = i
+            elif slot_hash == h:
+                start = self._data + offset
+                key_len = _RECORD.unpack_from(self._buf, start)[0]
+                if self._buf[start + _RECORD.size:start + _RECORD.size + key_len] == key:
+                    return i, None
+            i = (i + 1) & self._mask
+        return None, free
+
+    def store(
+        self,
+        key: str,
+        value: Any,
+        metadata: Optional[Dict] = None,
+        ttl: Optional[float] = None,
+    ) -> bool:
+        """Store a value in session context.
+
+        Args:
+            key: Key to store under
+            value: Value to store
+            metadata: Optional metadata to attach
+            ttl: Optional lifetime in seconds (defaults to default_ttl)
+
+        Returns:
+            True if stored successfully, False if the arena is full
+        """
+        ttl = ttl if ttl is not None else self.default_ttl
+        entry = {
+            "value": value,
+            "timestamp": datetime.now().isoformat(),
+            "metadata": metadata or {},
+        }
+        if ttl is not None:
+            entry["expires_at"] = time.time() + ttl
+        return self._put(key, entry)
+
+    def _put(self, key: str, entry: Dict[str, Any]) -> bool:
+        """Append an entry and point the key's slot at it.
+
+        Returns:
+            True if stored, False if the arena is full
+        """
+        expires_at = entry.get("expires_at", 0.0)
+        key_bytes = key.encode("utf-8")
+        value_bytes = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        record = _RECORD.pack(len(key_bytes), len(value_bytes), expires_at) + key_bytes + value_bytes
+        if len(record) > self.data_size:
+            return False
+
+        h = _key_hash(key_bytes)
+        with self._locked():
+            header = self._header()
+            existing, free = self._find_slot(key_bytes, h)
+            inserting = existing is None
+            if (
+                header["tail"] + len(record) > self.data_size
+                or inserting and free is None
+                or inserting and (header["count"] + header["tombstones"] + 1)
+                > self.capacity * self.MAX_LOAD
+            ):
+                # Compaction only reclaims dead bytes and tombstones; skip it
+                # when those cannot make room (expired keys count as live
+                # until expire() or a compaction reclaims them)
+                replaced = 0 if inserting else _SLOT.unpack_from(
+                    self._buf, self._index + existing * _SLOT.size
+                )[3]
+                if (
+                    header["live_bytes"] - replaced + len(record) > self.data_size
+                    or inserting and header["count"] + 1 > self.capacity * self.MAX_LOAD
+                ):
+                    return False
+                self._compact()
+                header = self._header()
+                existing, free = self._find_slot(key_bytes, h)
+                # Compaction may have dropped the key if it had expired
+                inserting = existing is None
+                if (
+                    header["tail"] + len(record) > self.data_size
+                    or inserting and header["count"] + 1 > self.capacity * self.MAX_LOAD
+                ):
+                    return False
+
+            # The record lands past the tail, where no reader looks yet
+            self._mark_dirty()
+            offset = header["tail"]
+            start = self._data + offset
+            self._buf[start:start + len(record)] = record
+            header["tail"] += len(record)
+            header["live_bytes"] += len(record)
+            if inserting:
+                slot_hash = _SLOT.unpack_from(self._buf, self._index + free * _SLOT.size)[1]
+                if slot_hash == TOMBSTONE:
+                    header["tombstones"] -= 1
+                header["count"] += 1
+            else:
+                header["live_bytes"] -= _SLOT.unpack_from(
+                    self._buf, self._index + existing * _SLOT.size
+                )[3]
+            # The header write comes last and clears the dirty flag; a writer
+            # dying before it leaves the counters to the next writer's repair
+            self._write_slot(free if inserting else existing, h, offset, len(record))
+            self._write_header(header)
+        return True
+
+    def _delete_slot(self, i: int, header: Dict[str, Any]) -> None:
+        _, _, offset, length = _SLOT.unpack_from(self._buf, self._index + i * _SLOT.size)
+        self._write_slot(i, TOMBSTONE, offset, length)
+        header["count"] -= 1
+        header["tombstones"] += 1
+        header["live_bytes"] -= length
+
+    def delete(self, key: str) -> bool:
+        """Delete a key from context.
+
+        Args:
+            key: Key to delete
+
+        Returns:
+            True if deleted, False if not found
+        """
+        key_bytes = key.encode("utf-8")
+        with self._locked():
+            existing, _ = self._find_slot(key_bytes, _key_hash(key_bytes))
+            if existing is None:
+                return False
+            header = self._header()
+            self._mark_dirty()
+            self._delete_slot(existing, header)
+            self._write_header(header)
+        return True
+
+    def expire(self) -> int:
+        """Reclaim all expired keys now.
+
+        Returns:
+            Number of keys reclaimed
+        """
+        now = time.time()
+        count = 0
+        with self._locked():
+            header = self._header()
+            self._mark_dirty()
+            for i in range(self.capacity):
+                _, slot_hash, offset, _ = _SLOT.unpack_from(self._buf, self._index + i * _SLOT.size)
+                if slot_hash <= TOMBSTONE:
+                    continue
+                expires_at = _RECORD.unpack_from(self._buf, self._data + offset)[2]
+                if expires_at and expires_at <= now:
+                    self._delete_slot(i, header)
+                    count += 1
+            self._write_header(header)
+        return count
+
+    def _compact(self) -> None:
+        """Rewrite the data region and index with only live, unexpired records.
+
+        Caller holds the write lock. Readers retry until the generation is
+        even again.
+        """
+        self._repair()
+        now = time.time()
+        live = bytearray()
+        placed = []
+        for _, offset, length, expires_at in self._scan():
+            if expires_at and expires_at <= now:
+                continue
+            start = self._data + offset
+            placed.append((len(live), length))
+            live += self._buf[start:start + length]
+
+        header = self._header()
+        header["generation"] |= 1
+        self._write_header(header)
+
+        index_end = self._index + self.capacity * _SLOT.size
+        self._buf[self._index:index_end] = bytes(index_end - self._index)
+        self._buf[self._data:self._data + len(live)] = live
+        for new_offset, length in placed:
+            start = self._data + new_offset
+            key_len = _RECORD.unpack_from(self._buf, start)[0]
+            key = bytes(self._buf[start + _RECORD.size:start + _RECORD.size + key_len])
+            _, free = self._find_slot(key, _key_hash(key))
+            _SLOT.pack_into(self._buf, self._index + free * _SLOT.size, 0, _key_hash(key), new_offset, length)
+
+        header.update(
+            tail=len(live),
+            count=len(placed),
+            tombstones=0,
+            live_bytes=len(live),
+            generation=header["generation"] + 1,
+        )
+        self._write_header(header)
+
+    def compact(self) -> None:
+        """Reclaim space held by overwritten, deleted and expired records."""
+        with self._locked():
+            self._compact()
+
+    def _reset(self, header: Dict[str, Any]) -> None:
+        """Empty the index and data region (caller holds the write lock)."""
+        header["generation"] |= 1
+        self._write_header(header)
+        index_end = self._index + self.capacity * _SLOT.size
+        self._buf[self._index:index_end] = bytes(index_end - self._index)
+        header.update(
+            tail=0, count=0, tombstones=0, live_bytes=0,
+            generation=header["generation"] + 1,
+        )
+        self._write_header(header)
+
+    def clear(self) -> None:
+        """Clear all session context."""
+        with self._locked():
+            self._reset(self._header())
+
+    # ---- lifecycle ----
+
+    def export(self) -> dict:
+        """Export session for persistence or transfer.
+
+        Returns:
+            Dict with session data, in the L1SessionMemory export format
+        """
+        now = time.time()
+        context = {}
+        size = 0
+        for key, _, length, expires_at in self._scan():
+            if expires_at and expires_at <= now:
+                continue
+            entry = self.get_entry(key)
+            if entry is not None:
+                context[key] = entry
+                size += length
+        return {
+            "sessionId": self.session_id,
+            "created": self.created.isoformat(),
+            "context": context,
+            "sizeEstimate": size,
+        }
+
+    @classmethod
+    def from_export(cls, data: dict, **kwargs) -> "SharedSessionMemory":
+        """Restore session from export into its arena.
+
+        Accepts exports of either L1 implementation. Expired entries are
+        dropped; entries that do not fit in the arena are skipped.
+
+        Args:
+            data: Exported session data
+            **kwargs: Further constructor arguments (size, max_keys, lock_dir)
+
+        Returns:
+            Attached SharedSessionMemory instance
+        """
+        instance = cls(data["sessionId"], **kwargs)
+        now = time.time()
+        for key, entry in data.get("context", {}).items():
+            entry = {k: v for k, v in entry.items() if k != "size"}
+            if entry.get("expires_at", now + 1) <= now:
+                continue
+            instance._put(key, entry)
+        if "created" in data:
+            instance.created = datetime.fromisoformat(data["created"])
+            with instance._locked():
+                header = instance._header()
+                header["created"] = instance.created.timestamp()
+                instance._write_header(header)
+        return instance
+
+    @classmethod
+    def recover(cls, session_id: str, **kwargs) -> "SharedSessionMemory":
+        """Reattach to a session's arena after a restart.
+
+        The arena lives in shared memory rather than in the process, so the
+        context is still there unless the session was unlinked or the node
+        rebooted; then an empty arena is created.
+
+        Args:
+            session_id: Session to recover
+            **kwargs: Further constructor arguments (size, max_keys, lock_dir)
+
+        Returns:
+            Attached SharedSessionMemory instance
+        """
+        return cls(session_id, **kwargs)
+
+    def close(self) -> None:
+        """Detach from the arena; other processes keep using it."""
+        if self._shm is not None:
+            self._buf = None
+            self._shm.close()
+            self._shm = None
+        if not self._lock_file.closed:
+            self._lock_file.close()
+
+    def unlink(self) -> None:
+        """Destroy the arena once every process has detached."""
+        shm = self._shm or self._open(create=False)
+        # unlink() unregisters the segment from the resource tracker
+        resource_tracker.register(shm._name, "shared_memory")
+        shm.unlink()
+        self.close()
+
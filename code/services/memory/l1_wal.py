@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""L1 Write-Ahead Log - Memory-mapped append-only log for session memory
+
+Persistent L1 sessions append every store and delete to a per-session log,
+so a restarted agent process can rebuild its context by replaying the log
+instead of recomputing it. Records are written into a memory-mapped file;
+once the write returns, the data lives in the page cache and survives the
+process crashing. Pass ``sync=True`` to also survive an OS crash.
+
+Layout:
+    header   magic ``CL1W`` + format version (8 bytes)
+    record   op, key length, value length, crc32 (12 bytes), key, value
+
+The value of a store record is the JSON-encoded L1 entry. The file is grown
+in chunks ahead of the tail; a zero op marks the end of the log, and a torn
+or corrupt record at the end is dropped on open.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+import fcntl
+import json
+import mmap
+import os
+import struct
+import zlib
+
+MAGIC = b"CL1W"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sB3x")
+_RECORD = struct.Struct("<BxHII")
+
+OP_STORE = 1
+OP_DELETE = 2
+
+
+class SessionLog:
+    """Append-only log of L1 session mutations.
+
+    Tracks the size of each key's latest record, and reports when the log
+    has grown to more than COMPACT_RATIO times the live data so the owner
+    can rewrite it with ``compact``.
+    """
+
+    GROW_BYTES = 4 * 1024 * 1024  # Preallocation step
+    COMPACT_MIN_BYTES = 8 * 1024 * 1024  # Never compact smaller logs
+    COMPACT_RATIO = 2.0
+
+    def __init__(self, path: Path, sync: bool = False):
+        """Open (or create) a session log.
+
+        Args:
+            path: Log file path
+            sync: Flush the mapping to disk after every append
+
+        Raises:
+            RuntimeError: If another process holds the log open
+            ValueError: If the file is not a session log
+        """
+        self.path = Path(path)
+        self.sync = sync
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self._fd)
+            raise RuntimeError(f"Session log {self.path} is in use by another process")
+
+        self._map: Optional[mmap.mmap] = None
+        self._sizes: Dict[str, int] = {}
+        self._live_bytes = 0
+        self.tail = _HEADER.size
+
+        if os.fstat(self._fd).st_size < _HEADER.size:
+            os.ftruncate(self._fd, 0)
+            os.pwrite(self._fd, _HEADER.pack(MAGIC, VERSION), 0)
+        else:
+            magic, version = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+            if magic != MAGIC or version != VERSION:
+                self.close()
+                raise ValueError(f"{self.path} is not a session log")
+        self._remap(max(os.fstat(self._fd).st_size, _HEADER.size + self.GROW_BYTES))
+
+    # ---- mapping ----
+
+    def _remap(self, size: int) -> None:
+        if self._map is not None:
+            self._map.close()
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _reserve(self, length: int) -> None:
+        size = len(self._map)
+        if self.tail + length > size:
+            self._remap(max(self.tail + length, size + max(self.GROW_BYTES, size // 2)))
+
+    # ---- reading ----
+
+    def replay(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Read the log, keeping only each key's latest state.
+
+        Superseded and deleted records are skipped without decoding their
+        values. Stops at the end marker or the first torn record, which is
+        cut off so later appends overwrite it.
+
+        Yields:
+            (key, entry) for every live key, in order of last write
+        """
+        buf = self._map
+        end = len(buf)
+        offset = _HEADER.size
+        latest: Dict[str, Tuple[int, int]] = {}
+        with memoryview(buf) as view:
+            while offset + _RECORD.size <= end:
+                op, key_len, value_len, crc = _RECORD.unpack_from(buf, offset)
+                start = offset + _RECORD.size
+                stop = start + key_len + value_len
+                if op not in (OP_STORE, OP_DELETE) or stop > end:
+                    break
+                if zlib.crc32(view[start:stop]) != crc:
+                    break
+                key = str(view[start:start + key_len], "utf-8")
+                latest.pop(key, None)
+                if op == OP_STORE:
+                    latest[key] = (start + key_len, value_len)
+                offset = stop
+
+        self.tail = offset
+        # Zero whatever follows the valid prefix
+        os.ftruncate(self._fd, offset)
+        self._remap(max(offset + self.GROW_BYTES, len(buf)))
+
+        self._sizes.clear()
+        self._live_bytes = 0
+        for key, (start, value_len) in latest.items():
+            length = _RECORD.size + len(key.encode("utf-8")) + value_len
+            self._sizes[key] = length
+            self._live_bytes += length
+            yield key, json.loads(self._map[start:start + value_len])
+
+    # ---- writing ----
+
+    def _append(self, op: int, key: str, value: bytes) -> int:
+        key_bytes = key.encode("utf-8")
+        payload = key_bytes + value
+        length = _RECORD.size + len(payload)
+        self._reserve(length)
+        _RECORD.pack_into(
+            self._map, self.tail, op, len(key_bytes), len(value), zlib.crc32(payload)
+        )
+        self._map[self.tail + _RECORD.size:self.tail + length] = payload
+        self.tail += length
+        if self.sync:
+            self._map.flush()
+        return length
+
+    def store(self, key: str, entry: Dict[str, Any]) -> None:
+        """Append a store record.
+
+        Args:
+            key: Session key
+            entry: L1 entry dict (must be JSON-serializable)
+        """
+        value = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        length = self._append(OP_STORE, key, value)
+        self._live_bytes += length - self._sizes.get(key, 0)
+        self._sizes[key] = length
+
+    def delete(self, key: str) -> None:
+        """Append a delete record for a key that has a live record."""
+        if key not in self._sizes:
+            return
+        self._append(OP_DELETE, key, b"")
+        self._live_bytes -= self._sizes.pop(key)
+
+    def needs_compaction(self) -> bool:
+        """Whether superseded records dominate the log."""
+        return (
+            self.tail > self.COMPACT_MIN_BYTES
+            and self.tail > self._live_bytes * self.COMPACT_RATIO
+        )
+
+    def compact(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Rewrite the log to hold only the given entries.
+
+        The new log is written next to the old one and renamed over it, so
+        a crash during compaction leaves the old log intact.
+
+        Args:
+            entries: (key, entry) pairs of the live session state
+        """
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        # A compaction that crashed leaves its file behind; never replay it
+        tmp.unlink(missing_ok=True)
+        fresh = SessionLog(tmp)
+        try:
+            for key, entry in entries:
+                fresh.store(key, entry)
+            fresh.flush()
+            os.replace(tmp, self.path)
+        except BaseException:
+            fresh.close()
+            tmp.unlink(missing_ok=True)
+            raise
+
+        # Adopt the new file; the lock moves with the descriptor
+        self.close()
+        self._fd, fresh._fd = fresh._fd, None
+        self._map, fresh._map = fresh._map, None
+        self.tail = fresh.tail
+        self._sizes = fresh._sizes
+        self._live_bytes = fresh._live_bytes
+
+    def reset(self) -> None:
+        """Drop every record."""
+        self.tail = _HEADER.size
+        self._sizes.clear()
+        self._live_bytes = 0
+        self._remap(_HEADER.size)
+        self._map[:] = _HEADER.pack(MAGIC, VERSION)
+        self._remap(_HEADER.size + self.GROW_BYTES)
+
+    def flush(self) -> None:
+        """Flush appended records to disk."""
+        if self._map is not None:
+            self._map.flush()
+            os.fsync(self._fd)
+
+    def close(self) -> None:
+        """Flush, trim the preallocated space and release the log."""
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            os.ftruncate(self._fd, self.tail)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __len__(self) -> int:
+        """Return number of live keys."""
+        return len(self._sizes)
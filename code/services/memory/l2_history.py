@@ -7,6 +7,7 @@ Uses SQLite for efficient querying and indexing.
 
 import sqlite3
 import json
+import sys
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional, Dict, Any
@@ -19,9 +20,17 @@ class L2TaskHistory:
     Capacity: ~1GB
     Purpose: Long-term task and decision history
     Persistence: SQLite database file
+
+    agent_stats is maintained by triggers on the tasks table: each insert,
+    update or delete adjusts the agent's counters and running score sum and
+    count, so recording a task costs the same however long the history is.
+    The triggers do not depend on connection settings, so writers using
+    INSERT OR REPLACE, upserts or plain updates keep the stats exact.
+    ``rebuild_stats`` recomputes the table from scratch.
     """
 
     DEFAULT_DB_PATH = Path.home() / "clawos/memory/l2/history.db"
+    SCHEMA_VERSION = 2
 
     def __init__(self, db_path: Optional[Path] = None):
         """Initialize task history.
@@ -76,7 +85,16 @@ class L2TaskHistory:
                     total_tasks INTEGER DEFAULT 0,
                     successful_tasks INTEGER DEFAULT 0,
                     avg_score REAL DEFAULT 0,
-                    last_activity TEXT
+                    last_activity TEXT,
+                    score_sum REAL DEFAULT 0,
+                    score_count INTEGER DEFAULT 0
+                );
+                
+                CREATE TABLE IF NOT EXISTS tasks_replaced (
+                    id TEXT PRIMARY KEY,
+                    agent_id TEXT NOT NULL,
+                    status TEXT,
+                    score REAL
                 );
                 
                 CREATE INDEX IF NOT EXISTS idx_tasks_agent ON tasks(agent_id);
@@ -86,8 +104,89 @@ class L2TaskHistory:
                 CREATE INDEX IF NOT EXISTS idx_decisions_agent ON decisions(agent_id);
                 CREATE INDEX IF NOT EXISTS idx_decisions_task ON decisions(task_id);
             """)
+
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                # Stats used to be recounted by record_task, double-counting
+                # replaced tasks; add running sums and rebuild them once
+                columns = {
+                    row["name"] for row in conn.execute("PRAGMA table_info(agent_stats)")
+                }
+                if "score_sum" not in columns:
+                    conn.execute("ALTER TABLE agent_stats ADD COLUMN score_sum REAL DEFAULT 0")
+                if "score_count" not in columns:
+                    conn.execute(
+                        "ALTER TABLE agent_stats ADD COLUMN score_count INTEGER DEFAULT 0"
+                    )
+                self._rebuild_stats(conn)
+            if version < 2:
+                # Version 1 relied on PRAGMA recursive_triggers to subtract
+                # rows removed by REPLACE; swap in the connection-independent
+                # triggers
+                for trigger in ("insert", "delete", "update"):
+                    conn.execute(f"DROP TRIGGER IF EXISTS tasks_stats_{trigger}")
+                if version == 1:
+                    self._rebuild_stats(conn)
+
+            conn.executescript(self._STATS_TRIGGERS)
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
             conn.commit()
 
+    # Add (sign 1) or remove (sign -1) one task row's contribution to its
+    # agent's stats; avg_score is derived from the running sum and count.
+    # The stats row is created without OR IGNORE, which the outer
+    # statement's conflict clause would override inside a trigger
+    _STATS_DELTA = """
+        INSERT INTO agent_stats (agent_id) SELECT {agent}
+        WHERE {agent} IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM agent_stats WHERE agent_id = {agent});
+        UPDATE agent_stats SET
+            total_tasks = total_tasks + {sign},
+            successful_tasks = successful_tasks + {sign} * ({status} IS 'completed'),
+            score_sum = score_sum + {sign} * COALESCE({score}, 0),
+            score_count = score_count + {sign} * ({score} IS NOT NULL),
+            avg_score = CASE
+                WHEN score_count + {sign} * ({score} IS NOT NULL) > 0
+                THEN (score_sum + {sign} * COALESCE({score}, 0))
+                     / (score_count + {sign} * ({score} IS NOT NULL))
+                ELSE 0 END,
+            last_activity = {last_activity}
+        WHERE agent_id = {agent};
+    """
+    _NEW = {"agent": "NEW.agent_id", "status": "NEW.status", "score": "NEW.score"}
+    _OLD = {"agent": "OLD.agent_id", "status": "OLD.status", "score": "OLD.score"}
+    _REPLACED = {
+        column: f"(SELECT {name} FROM tasks_replaced WHERE id = NEW.id)"
+        for column, name in (("agent", "agent_id"), ("status", "status"), ("score", "score"))
+    }
+    _NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+    # BEFORE INSERT remembers the row an insert may replace. Only the AFTER
+    # INSERT of a REPLACE still finds it: an upsert's update, and the delete
+    # trigger (if recursive_triggers is on) remove it first, and an ignored
+    # insert fires no AFTER trigger
+    _STATS_TRIGGERS = f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_stats_replace BEFORE INSERT ON tasks BEGIN
+            DELETE FROM tasks_replaced WHERE id = NEW.id;
+            INSERT INTO tasks_replaced (id, agent_id, status, score)
+            SELECT id, agent_id, status, score FROM tasks WHERE id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tasks_stats_insert AFTER INSERT ON tasks BEGIN
+            {_STATS_DELTA.format(**_REPLACED, sign=-1, last_activity="last_activity")}
+            DELETE FROM tasks_replaced WHERE id = NEW.id;
+            {_STATS_DELTA.format(**_NEW, sign=1, last_activity=_NOW)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS tasks_stats_delete AFTER DELETE ON tasks BEGIN
+            {_STATS_DELTA.format(**_OLD, sign=-1, last_activity="last_activity")}
+            DELETE FROM tasks_replaced WHERE id = OLD.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tasks_stats_update
+        AFTER UPDATE OF agent_id, status, score ON tasks BEGIN
+            {_STATS_DELTA.format(**_OLD, sign=-1, last_activity="last_activity")}
+            {_STATS_DELTA.format(**_NEW, sign=1, last_activity=_NOW)}
+            DELETE FROM tasks_replaced WHERE id = OLD.id;
+        END;
+    """
+
     def record_task(self, task: Dict[str, Any]) -> None:
         """Record a task in history.
 
@@ -95,11 +194,23 @@ class L2TaskHistory:
             task: Task dict with id, agent_id, type, description, status, etc.
         """
         with self._get_connection() as conn:
+            # Upsert rather than REPLACE so an existing task is updated in
+            # place and the stats triggers move its contribution
             conn.execute(
                 """
-                INSERT OR REPLACE INTO tasks 
+                INSERT INTO tasks
                 (id, agent_id, type, description, status, score, created, completed, result, metadata)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    agent_id = excluded.agent_id,
+                    type = excluded.type,
+                    description = excluded.description,
+                    status = excluded.status,
+                    score = excluded.score,
+                    created = excluded.created,
+                    completed = excluded.completed,
+                    result = excluded.result,
+                    metadata = excluded.metadata
             """,
                 (
                     task["id"],
@@ -114,54 +225,48 @@ class L2TaskHistory:
                     json.dumps(task.get("metadata")) if task.get("metadata") else None,
                 ),
             )
-
-            # Update agent stats
-            self._update_agent_stats(conn, task.get("agent_id"), task.get("status"))
             conn.commit()
 
-    def _update_agent_stats(
-        self, conn: sqlite3.Connection, agent_id: str, status: Optional[str]
-    ):
-        """Update agent statistics."""
-        if not agent_id:
-            return
-
-        # Get current stats
-        row = conn.execute(
-            "SELECT * FROM agent_stats WHERE agent_id = ?", (agent_id,)
-        ).fetchone()
-
-        if row:
-            total = row["total_tasks"] + 1
-            successful = row["successful_tasks"] + (1 if status == "completed" else 0)
-
-            # Calculate new average score
-            score_row = conn.execute(
-                "SELECT AVG(score) as avg FROM tasks WHERE agent_id = ? AND score IS NOT NULL",
-                (agent_id,),
-            ).fetchone()
-            avg_score = score_row["avg"] if score_row["avg"] is not None else 0
+    def rebuild_stats(self) -> int:
+        """Recompute agent_stats from the tasks table.
 
-            conn.execute(
-                """
-                UPDATE agent_stats 
-                SET total_tasks = ?, successful_tasks = ?, avg_score = ?, last_activity = ?
-                WHERE agent_id = ?
-            """,
-                (total, successful, avg_score, datetime.now().isoformat(), agent_id),
-            )
-        else:
-            conn.execute(
-                """
-                INSERT INTO agent_stats (agent_id, total_tasks, successful_tasks, last_activity)
-                VALUES (?, 1, ?, ?)
-            """,
-                (
-                    agent_id,
-                    1 if status == "completed" else 0,
-                    datetime.now().isoformat(),
-                ),
-            )
+        Maintenance command for databases whose stats drifted, e.g. after
+        tasks were edited with triggers dropped. Keeps last_activity.
+
+        Returns:
+            Number of agents with stats
+        """
+        with self._get_connection() as conn:
+            count = self._rebuild_stats(conn)
+            conn.commit()
+            return count
+
+    def _rebuild_stats(self, conn: sqlite3.Connection) -> int:
+        """Recompute agent_stats in the caller's transaction."""
+        conn.execute("DELETE FROM tasks_replaced")
+        conn.execute(
+            "DELETE FROM agent_stats WHERE agent_id NOT IN (SELECT agent_id FROM tasks)"
+        )
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO agent_stats
+            (agent_id, total_tasks, successful_tasks, avg_score, last_activity,
+             score_sum, score_count)
+            SELECT t.agent_id,
+                   COUNT(*),
+                   SUM(t.status IS 'completed'),
+                   COALESCE(AVG(t.score), 0),
+                   COALESCE(
+                       (SELECT last_activity FROM agent_stats s WHERE s.agent_id = t.agent_id),
+                       MAX(COALESCE(t.completed, t.created))
+                   ),
+                   COALESCE(SUM(t.score), 0),
+                   COUNT(t.score)
+            FROM tasks t
+            GROUP BY t.agent_id
+        """
+        )
+        return conn.execute("SELECT COUNT(*) FROM agent_stats").fetchone()[0]
 
     def record_decision(self, decision: Dict[str, Any]) -> None:
         """Record a decision in history.
@@ -335,3 +440,30 @@ class L2TaskHistory:
         with self._get_connection() as conn:
             conn.execute("VACUUM")
             conn.commit()
+
+
+def main():
+    """Maintenance entry point for the task history database."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="L2 Task History maintenance")
+    parser.add_argument("--db", type=Path, help="Database path (default: ~/clawos/memory/l2/history.db)")
+    parser.add_argument("--rebuild-stats", action="store_true", help="Recompute agent_stats from tasks")
+    parser.add_argument("--vacuum", action="store_true", help="Vacuum the database")
+    args = parser.parse_args()
+
+    history = L2TaskHistory(args.db)
+
+    if args.rebuild_stats:
+        count = history.rebuild_stats()
+        print(f"Rebuilt stats for {count} agents")
+    if args.vacuum:
+        history.vacuum()
+        print(f"Vacuumed {history.db_path} ({history.get_db_size()} bytes)")
+    if not (args.rebuild_stats or args.vacuum):
+        parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,6 +15,7 @@ import json
 import uuid
 
 from .l1_session import L1SessionMemory
+from .l1_shared import SharedSessionMemory
 from .l2_history import L2TaskHistory
 from .l3_vector import L3VectorMemory
 from .l4_github import L4GitHubMemory
@@ -35,6 +36,9 @@ class MemoryManager:
         # Retrieve context
         history = manager.get_agent_history("gm")
         experiences = manager.retrieve_experiences("gm", ["task", "completed"])
+
+        # Free the session context when the session is over
+        manager.end_session()
     """
 
     def __init__(
@@ -43,6 +47,7 @@ class MemoryManager:
         l2_path: Optional[Path] = None,
         l3_path: Optional[Path] = None,
         l4_path: Optional[Path] = None,
+        shared_l1: bool = False,
     ):
         """Initialize memory manager.
 
@@ -51,11 +56,17 @@ class MemoryManager:
             l2_path: Optional custom L2 database path
             l3_path: Optional custom L3 storage path
             l4_path: Optional custom L4 repository path
+            shared_l1: Keep session context in shared memory, visible to
+                every process on the node that uses the same session_id;
+                the owning process frees it with ``end_session``
         """
         self.session_id = session_id
 
         # Initialize all layers
-        self.l1 = L1SessionMemory(session_id)
+        if shared_l1:
+            self.l1 = SharedSessionMemory(session_id)
+        else:
+            self.l1 = L1SessionMemory(session_id)
         self.l2 = L2TaskHistory(l2_path)
         self.l3 = L3VectorMemory(l3_path)
         self.l4 = L4GitHubMemory(l4_path)
@@ -92,6 +103,26 @@ class MemoryManager:
         """Clear session context (L1 only)."""
         self.l1.clear()
 
+    def close(self) -> None:
+        """Release this process's hold on session context (L1).
+
+        A shared L1 is only detached; other processes of the session keep
+        using it until the owner calls ``end_session``.
+        """
+        self.l1.close()
+
+    def end_session(self) -> None:
+        """End the session and free its context (L1).
+
+        A shared L1 is destroyed for every process of the session, so only
+        the process that owns the session (usually the PM) should call this.
+        """
+        if isinstance(self.l1, SharedSessionMemory):
+            self.l1.unlink()
+        else:
+            self.l1.clear()
+            self.l1.close()
+
     # === L2 History Operations ===
 
     def record_task(self, task: Dict[str, Any]) -> None:
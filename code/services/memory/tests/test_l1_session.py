@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Tests for L1 session memory."""
+
+import math
+import random
+
+from clawos.services.memory.l1_session import L1SessionMemory, _TimingWheel
+
+
+def test_export_returns_copies():
+    session = L1SessionMemory("s")
+    session.store("k", "v", metadata={"tag": "a"})
+
+    exported = session.export()
+    exported["context"]["k"]["value"] = "changed"
+    exported["context"]["extra"] = {"value": 1}
+    session.store("k2", "v2")
+
+    assert session.retrieve("k") == "v"
+    assert "extra" not in session
+    assert "k2" not in exported["context"]
+
+
+def test_export_import_round_trip():
+    session = L1SessionMemory("s")
+    session.store("a", {"nested": [1, 2]}, metadata={"m": 1})
+    session.store("b", "text", ttl=3600)
+
+    restored = L1SessionMemory.from_export(session.export())
+
+    assert restored.session_id == "s"
+    assert restored.created == session.created
+    assert restored.keys() == session.keys()
+    assert restored.retrieve("a") == {"nested": [1, 2]}
+    assert restored.size_estimate() == session.size_estimate()
+    assert 0 < restored.ttl("b") <= 3600
+
+
+def test_wheel_catches_up_after_idle_without_ticking(monkeypatch):
+    wheel = _TimingWheel(1.0, 0.0)
+    wheel.schedule("soon", 5.0)
+    wheel.schedule("day", 86_400.0)
+    wheel.schedule("later", 200_000.0)
+    steps = []
+    next_event = wheel._next_event
+    monkeypatch.setattr(wheel, "_next_event", lambda target: steps.append(1) or next_event(target))
+
+    assert sorted(wheel.advance(86_400.5)) == ["day", "soon"]
+    assert len(steps) < 20
+    assert len(wheel) == 1
+    assert wheel.advance(200_000.0) == ["later"]
+
+
+def test_wheel_expires_keys_like_a_sorted_scan():
+    rng = random.Random(7)
+    wheel = _TimingWheel(1.0, 0.0)
+    deadlines = {}
+    now = 0.0
+    for _ in range(300):
+        for _ in range(rng.randrange(4)):
+            key = f"k{rng.randrange(500)}"
+            deadlines[key] = now + rng.choice([1, 30, 500, 5_000, 300_000]) * rng.random() + 1
+            wheel.schedule(key, deadlines[key])
+        now += rng.choice([0.5, 3, 70, 4_000, 90_000])
+        due = {k for k, d in deadlines.items() if math.ceil(d) <= int(now)}
+        assert set(wheel.advance(now)) == due
+        for key in due:
+            del deadlines[key]
+    assert len(wheel) == len(deadlines)
+
+
+def test_wheel_expires_past_due_key_on_next_tick():
+    wheel = _TimingWheel(1.0, 100.0)
+    wheel.schedule("late", 50.0)
+    wheel.schedule("now", 100.0)
+
+    assert sorted(wheel.advance(101.0)) == ["late", "now"]
+    assert len(wheel) == 0
+
+
+def test_entries_do_not_expose_internal_size():
+    session = L1SessionMemory("s")
+    session.store("k", "v", metadata={"tag": "a"})
+
+    assert set(session.get_entry("k")) == {"value", "timestamp", "metadata"}
+    assert "size" not in session.export()["context"]["k"]
+
+    # Exports from versions that stored the size with the entry still load
+    legacy = session.export()
+    legacy["context"]["k"]["size"] = 999
+    restored = L1SessionMemory.from_export(legacy)
+    assert "size" not in restored.get_entry("k")
+    assert restored.size_estimate() == session.size_estimate()
+    restored.delete("k")
+    assert restored.size_estimate() == 0
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Tests for the shared-memory L1 arena."""
+
+import fcntl
+import os
+import struct
+import uuid
+
+import pytest
+
+from clawos.services.memory import l1_shared
+from clawos.services.memory.l1_shared import SharedSessionMemory
+
+
+@pytest.fixture
+def arena(tmp_path):
+    session = SharedSessionMemory(
+        f"test-{uuid.uuid4().hex}", size=4096, max_keys=8, lock_dir=tmp_path
+    )
+    yield session
+    session.unlink()
+
+
+def _slot_of(arena, key):
+    existing, _ = arena._find_slot(key.encode("utf-8"), l1_shared._key_hash(key.encode("utf-8")))
+    return arena._index + existing * l1_shared._SLOT.size
+
+
+def test_compaction_reclaims_overwritten_records(arena):
+    for n in range(100):
+        assert arena.store("k", "x" * 100, metadata={"n": n})
+    arena.store("gone", "y")
+    arena.delete("gone")
+    arena.compact()
+
+    assert arena.retrieve("k") == "x" * 100
+    assert arena.get_entry("k")["metadata"] == {"n": 99}
+    stats = arena.stats()
+    assert stats["keys"] == 1
+    assert stats["data_used"] == stats["size_estimate"]
+    assert stats["tombstones"] == 0
+    assert stats["generation"] > 0 and stats["generation"] % 2 == 0
+
+
+def test_compaction_drops_expired_keys(arena):
+    arena.store("old", "v", ttl=-1)
+    arena.store("live", "v")
+    arena.compact()
+
+    assert arena.keys() == ["live"]
+    assert len(arena) == 1
+
+
+def test_full_arena_fails_without_compacting(arena, monkeypatch):
+    while arena.store(f"k{len(arena)}", "x" * 200):
+        pass
+    compactions = []
+    compact = arena._compact
+    monkeypatch.setattr(arena, "_compact", lambda: compactions.append(1) or compact())
+
+    assert not arena.store("another", "x" * 200)
+    assert compactions == []
+    # Overwriting frees the replaced record, so compaction can make room
+    assert arena.store("k0", "y" * 200)
+    assert arena.retrieve("k0") == "y" * 200
+
+
+def test_index_full_fails_without_compacting(arena, monkeypatch):
+    max_keys = arena.stats()["max_keys"]
+    for n in range(max_keys):
+        assert arena.store(f"k{n}", n)
+    compactions = []
+    monkeypatch.setattr(arena, "_compact", lambda: compactions.append(1))
+
+    assert not arena.store("one-more", 0)
+    assert compactions == []
+
+
+def test_reader_repairs_slot_left_odd_by_dead_writer(arena, monkeypatch):
+    arena.store("k", "v")
+    pos = _slot_of(arena, "k")
+    version = struct.unpack_from("<I", arena._buf, pos)[0]
+    struct.pack_into("<I", arena._buf, pos, version + 1)
+    monkeypatch.setattr(SharedSessionMemory, "SPIN_LIMIT", 3)
+
+    assert arena.retrieve("k") == "v"
+    assert struct.unpack_from("<I", arena._buf, pos)[0] % 2 == 0
+    assert arena.store("k", "w")
+    assert arena.retrieve("k") == "w"
+
+
+def test_writer_dying_mid_update_does_not_wedge_readers(arena, tmp_path, monkeypatch):
+    arena.store("k", "v")
+    pid = os.fork()
+    if pid == 0:
+        # Take the write lock, start a slot update and die holding the lock
+        child = SharedSessionMemory(arena.session_id, lock_dir=tmp_path)
+        child._thread_lock.acquire()
+        fcntl.flock(child._lock_file.fileno(), fcntl.LOCK_EX)
+        pos = _slot_of(child, "k")
+        struct.pack_into("<I", child._buf, pos, struct.unpack_from("<I", child._buf, pos)[0] | 1)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    monkeypatch.setattr(SharedSessionMemory, "SPIN_LIMIT", 10)
+
+    assert arena.retrieve("k") == "v"
+    assert arena.keys() == ["k"]
+
+
+def test_repair_drops_slot_pointing_at_torn_record(arena, monkeypatch):
+    arena.store("a", 1)
+    arena.store("b", 2)
+    pos = _slot_of(arena, "b")
+    version, slot_hash, offset, length = l1_shared._SLOT.unpack_from(arena._buf, pos)
+    l1_shared._SLOT.pack_into(arena._buf, pos, version + 1, slot_hash, offset + 3, length)
+    monkeypatch.setattr(SharedSessionMemory, "SPIN_LIMIT", 3)
+
+    assert arena.retrieve("b") is None
+    assert arena.retrieve("a") == 1
+    assert arena.stats()["keys"] == 1
+
+
+def test_dead_compaction_clears_arena(arena, monkeypatch):
+    arena.store("k", "v")
+    header = arena._header()
+    header["generation"] += 1
+    arena._write_header(header)
+    monkeypatch.setattr(SharedSessionMemory, "SPIN_LIMIT", 3)
+
+    assert arena.keys() == []
+    assert arena.stats()["generation"] % 2 == 0
+    assert arena.store("k", "v2")
+    assert arena.retrieve("k") == "v2"
+
+
+def test_export_import_round_trip(arena, tmp_path):
+    arena.store("a", {"n": 1}, metadata={"m": True})
+    arena.store("b", "text", ttl=3600)
+
+    data = arena.export()
+    assert "size" not in data["context"]["a"]
+    assert data["sizeEstimate"] == arena.size_estimate()
+    other = SharedSessionMemory(f"test-{uuid.uuid4().hex}", size=4096, lock_dir=tmp_path)
+    try:
+        for key, entry in data["context"].items():
+            other.store(key, entry["value"], entry["metadata"])
+        assert other.export()["context"].keys() == data["context"].keys()
+        assert other.retrieve("a") == {"n": 1}
+        assert other.get_entry("a")["metadata"] == {"m": True}
+    finally:
+        other.unlink()
+
+
+def _in_child(run):
+    """Run ``run`` in a forked child; return its exit status."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(run() or 0)
+        finally:
+            os._exit(1)
+    _, status = os.waitpid(pid, 0)
+    return os.WEXITSTATUS(status)
+
+
+def test_second_process_sees_first_process_writes(arena, tmp_path):
+    def write():
+        child = SharedSessionMemory(arena.session_id, lock_dir=tmp_path)
+        child.store("from-child", {"n": 1}, metadata={"pid": os.getpid()})
+        child.close()
+
+    assert _in_child(write) == 0
+    assert arena.retrieve("from-child") == {"n": 1}
+    assert arena.keys() == ["from-child"]
+
+    arena.store("from-parent", "hello")
+
+    def read():
+        child = SharedSessionMemory(arena.session_id, lock_dir=tmp_path)
+        return 0 if child.retrieve("from-parent") == "hello" and len(child) == 2 else 2
+
+    assert _in_child(read) == 0
+
+
+@pytest.mark.parametrize("dies_in", ["_write_slot", "_write_header"])
+def test_next_writer_repairs_counters_of_dead_writer(arena, tmp_path, dies_in):
+    arena.store("a", 1)
+
+    def write():
+        child = SharedSessionMemory(arena.session_id, lock_dir=tmp_path)
+        setattr(child, dies_in, lambda *args: os._exit(0))
+        child.store("b", 2)
+
+    _in_child(write)
+    assert arena.store("c", 3)
+
+    expected = {"a", "c"} if dies_in == "_write_slot" else {"a", "b", "c"}
+    assert set(arena.keys()) == expected
+    stats = arena.stats()
+    assert stats["keys"] == len(expected)
+    assert stats["size_estimate"] == arena.export()["sizeEstimate"]
+    assert arena.store("d", 4)
+    assert arena.retrieve("c") == 3 and arena.retrieve("d") == 4
+
+
+def test_ttl_from_export_and_recover(arena, tmp_path):
+    arena.store("a", "text", ttl=3600)
+    arena.store("b", "forever")
+    assert 0 < arena.ttl("a") <= 3600
+    assert arena.ttl("b") is None and arena.ttl("missing") is None
+
+    data = arena.export()
+    data["context"]["gone"] = {"value": 1, "metadata": {}, "expires_at": 1.0}
+    data["sessionId"] = f"test-{uuid.uuid4().hex}"
+    data["created"] = "2020-01-01T00:00:00"
+    restored = SharedSessionMemory.from_export(data, size=4096, lock_dir=tmp_path)
+    try:
+        assert sorted(restored.keys()) == ["a", "b"]
+        assert restored.get_entry("b") == arena.get_entry("b")
+        assert 0 < restored.ttl("a") <= 3600
+        restored.close()
+
+        restored = SharedSessionMemory.recover(data["sessionId"], lock_dir=tmp_path)
+        assert restored.retrieve("b") == "forever"
+        assert restored.created.isoformat() == "2020-01-01T00:00:00"
+    finally:
+        restored.unlink()
+
+
+def test_manager_end_session_unlinks_shared_arena(tmp_path, monkeypatch):
+    from multiprocessing import shared_memory
+
+    from clawos.services.memory import MemoryManager
+
+    monkeypatch.setattr(SharedSessionMemory, "DEFAULT_LOCK_DIR", tmp_path)
+    monkeypatch.setattr(SharedSessionMemory, "DEFAULT_SIZE", 4096)
+    session_id = f"test-{uuid.uuid4().hex}"
+    manager = MemoryManager(
+        session_id, l2_path=tmp_path / "l2.db", l3_path=tmp_path / "l3",
+        l4_path=tmp_path / "l4", shared_l1=True,
+    )
+    manager.set_context("k", "v")
+
+    manager.end_session()
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=SharedSessionMemory.segment_name(session_id))
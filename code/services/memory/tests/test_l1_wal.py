@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Tests for the L1 write-ahead log and persistent session recovery."""
+
+import os
+
+import pytest
+
+from clawos.services.memory.l1_session import L1SessionMemory
+from clawos.services.memory.l1_wal import SessionLog
+
+
+def _crash(write):
+    """Run ``write`` in a child that exits without closing the log."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            write()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def test_recover_after_crash(tmp_path):
+    def write():
+        session = L1SessionMemory("s", persist=True, wal_dir=tmp_path)
+        session.store("a", 1)
+        session.store("b", {"x": [1, 2]}, metadata={"m": True})
+        session.store("a", 2)
+        session.delete("b")
+        session.store("c", "kept")
+
+    _crash(write)
+    session = L1SessionMemory.recover("s", wal_dir=tmp_path)
+
+    assert session.keys() == ["a", "c"]
+    assert session.retrieve("a") == 2
+    session.close()
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    path = tmp_path / "s.wal"
+    log = SessionLog(path)
+    log.store("a", {"value": 1})
+    log.store("b", {"value": 2})
+    torn_at = log.tail
+    log.store("c", {"value": 3})
+    end = log.tail
+    log.close()
+    # Lose the last bytes of the final record
+    with open(path, "r+b") as f:
+        f.truncate(end - 3)
+
+    log = SessionLog(path)
+    assert dict(log.replay()) == {"a": {"value": 1}, "b": {"value": 2}}
+    assert log.tail == torn_at
+    # New appends overwrite the torn record
+    log.store("d", {"value": 4})
+    log.close()
+
+    log = SessionLog(path)
+    assert dict(log.replay()) == {"a": {"value": 1}, "b": {"value": 2}, "d": {"value": 4}}
+    log.close()
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    path = tmp_path / "s.wal"
+    log = SessionLog(path)
+    log.store("a", {"value": 1})
+    corrupt_at = log.tail
+    log.store("b", {"value": 2})
+    log.store("c", {"value": 3})
+    log.close()
+    with open(path, "r+b") as f:
+        f.seek(corrupt_at + 14)
+        f.write(b"\xff")
+
+    log = SessionLog(path)
+    assert dict(log.replay()) == {"a": {"value": 1}}
+    log.close()
+
+
+def test_log_is_exclusive(tmp_path):
+    log = SessionLog(tmp_path / "s.wal")
+    pid = os.fork()
+    if pid == 0:
+        try:
+            SessionLog(tmp_path / "s.wal")
+        except RuntimeError:
+            os._exit(0)
+        os._exit(1)
+    _, status = os.waitpid(pid, 0)
+    log.close()
+    assert os.WEXITSTATUS(status) == 0
+
+
+def test_compaction_keeps_live_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(SessionLog, "COMPACT_MIN_BYTES", 1024)
+    session = L1SessionMemory("s", persist=True, wal_dir=tmp_path)
+    for n in range(200):
+        session.store("k", "x" * 50, metadata={"n": n})
+    session.store("other", 1)
+    size = session._log.tail
+    session.close()
+
+    assert size < 200 * 50
+    recovered = L1SessionMemory.recover("s", wal_dir=tmp_path)
+    assert recovered.get_entry("k")["metadata"] == {"n": 199}
+    assert recovered.retrieve("other") == 1
+    recovered.close()
+
+
+def test_compaction_ignores_stale_temp_file(tmp_path):
+    # Left behind by a compaction that crashed before the rename
+    stale = SessionLog(tmp_path / ".s.wal.tmp")
+    stale.store("a", {"value": 1})
+    stale.store("ghost", {"value": "resurrected"})
+    stale.close()
+
+    def write():
+        log = SessionLog(tmp_path / "s.wal")
+        log.store("a", {"value": 1})
+        log.compact([("a", {"value": 1})])
+
+    # Crash before close trims the file to the tail
+    _crash(write)
+    log = SessionLog(tmp_path / "s.wal")
+    assert dict(log.replay()) == {"a": {"value": 1}}
+    log.close()
+    assert not (tmp_path / ".s.wal.tmp").exists()
+
+
+def test_rejects_foreign_file(tmp_path):
+    path = tmp_path / "s.wal"
+    path.write_bytes(b"not a log at all")
+    with pytest.raises(ValueError):
+        SessionLog(path)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Tests for L2 task history and its incrementally maintained agent_stats."""
+
+import sqlite3
+
+import pytest
+
+from clawos.services.memory.l2_history import L2TaskHistory
+
+# Schema written by the original L2TaskHistory, before agent_stats kept
+# running sums and before user_version was set
+BASELINE_SCHEMA = """
+    CREATE TABLE tasks (
+        id TEXT PRIMARY KEY,
+        agent_id TEXT NOT NULL,
+        type TEXT,
+        description TEXT,
+        status TEXT,
+        score REAL,
+        created TEXT NOT NULL,
+        completed TEXT,
+        result TEXT,
+        metadata TEXT
+    );
+    CREATE TABLE decisions (
+        id TEXT PRIMARY KEY,
+        task_id TEXT,
+        agent_id TEXT NOT NULL,
+        decision TEXT NOT NULL,
+        reasoning TEXT,
+        outcome TEXT,
+        created TEXT NOT NULL,
+        FOREIGN KEY (task_id) REFERENCES tasks(id)
+    );
+    CREATE TABLE agent_stats (
+        agent_id TEXT PRIMARY KEY,
+        total_tasks INTEGER DEFAULT 0,
+        successful_tasks INTEGER DEFAULT 0,
+        avg_score REAL DEFAULT 0,
+        last_activity TEXT
+    );
+"""
+
+
+def _stats(history, agent_id):
+    stats = history.get_agent_stats(agent_id)
+    return stats["total_tasks"], stats["successful_tasks"], pytest.approx(stats["avg_score"])
+
+
+def _task(task_id, agent_id="gm", status="completed", score=None):
+    return {"id": task_id, "agent_id": agent_id, "status": status, "score": score,
+            "created": "2026-01-01T00:00:00"}
+
+
+@pytest.fixture
+def history(tmp_path):
+    return L2TaskHistory(tmp_path / "history.db")
+
+
+def _foreign(history, recursive_triggers):
+    conn = sqlite3.connect(str(history.db_path))
+    conn.execute(f"PRAGMA recursive_triggers = {'ON' if recursive_triggers else 'OFF'}")
+    return conn
+
+
+def test_record_task_updates_stats(history):
+    history.record_task(_task("t1", score=1.0))
+    history.record_task(_task("t2", status="failed", score=0.0))
+    history.record_task(_task("t1", score=0.5))
+
+    assert _stats(history, "gm") == (2, 1, 0.25)
+
+
+@pytest.mark.parametrize("recursive_triggers", [False, True])
+def test_foreign_replace_does_not_double_count(history, recursive_triggers):
+    history.record_task(_task("t1", score=1.0))
+    conn = _foreign(history, recursive_triggers)
+    conn.execute(
+        "INSERT OR REPLACE INTO tasks (id, agent_id, status, score, created) "
+        "VALUES ('t1', 'gm', 'failed', 0.0, 'now')"
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO tasks (id, agent_id, status, score, created) "
+        "VALUES ('t2', 'gm', 'completed', 1.0, 'now')"
+    )
+    conn.commit()
+    conn.close()
+
+    assert _stats(history, "gm") == (2, 1, 0.5)
+
+
+def test_foreign_replace_moving_task_between_agents(history):
+    history.record_task(_task("t1", agent_id="a", score=1.0))
+    conn = _foreign(history, False)
+    conn.execute(
+        "REPLACE INTO tasks (id, agent_id, status, created) VALUES ('t1', 'b', 'completed', 'now')"
+    )
+    conn.commit()
+    conn.close()
+
+    assert _stats(history, "a") == (0, 0, 0.0)
+    assert _stats(history, "b") == (1, 1, 0.0)
+
+
+def test_ignored_insert_and_delete(history):
+    history.record_task(_task("t1", score=1.0))
+    conn = _foreign(history, False)
+    conn.execute(
+        "INSERT OR IGNORE INTO tasks (id, agent_id, status, created) VALUES ('t1', 'gm', 'failed', 'now')"
+    )
+    conn.commit()
+    assert _stats(history, "gm") == (1, 1, 1.0)
+
+    conn.execute("DELETE FROM tasks WHERE id = 't1'")
+    conn.commit()
+    conn.close()
+    assert _stats(history, "gm") == (0, 0, 0.0)
+
+
+def test_stats_match_rebuild(history):
+    for n in range(20):
+        history.record_task(_task(f"t{n % 7}", agent_id=f"a{n % 3}",
+                                  status="completed" if n % 2 else "failed", score=n / 20))
+    conn = _foreign(history, False)
+    conn.execute("UPDATE tasks SET score = NULL WHERE id = 't3'")
+    conn.execute("REPLACE INTO tasks (id, agent_id, created) VALUES ('t4', 'a0', 'now')")
+    conn.commit()
+    conn.close()
+    incremental = {a: _stats(history, a) for a in ("a0", "a1", "a2")}
+
+    history.rebuild_stats()
+
+    assert {a: _stats(history, a) for a in ("a0", "a1", "a2")} == incremental
+
+
+def test_upgrade_from_baseline_schema(tmp_path):
+    db_path = tmp_path / "history.db"
+    conn = sqlite3.connect(str(db_path))
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO tasks (id, agent_id, status, score, created) VALUES (?, ?, ?, ?, ?)",
+        [("t1", "gm", "completed", 1.0, "2026-01-01"), ("t2", "gm", "failed", 0.0, "2026-01-02")],
+    )
+    # The old record_task counted replaced tasks again
+    conn.execute(
+        "INSERT INTO agent_stats VALUES ('gm', 5, 4, 0.9, '2026-01-03T00:00:00')"
+    )
+    conn.commit()
+    conn.close()
+
+    history = L2TaskHistory(db_path)
+
+    assert _stats(history, "gm") == (2, 1, 0.5)
+    assert history.get_agent_stats("gm")["last_activity"] == "2026-01-03T00:00:00"
+    conn = sqlite3.connect(str(db_path))
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == L2TaskHistory.SCHEMA_VERSION
+    conn.close()
+    history.record_task(_task("t3", score=0.5))
+    assert _stats(history, "gm") == (3, 2, 0.5)
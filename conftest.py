@@ -0,0 +1,61 @@
+"""
+Repository-wide pytest setup
+
+code/ is the ``clawos`` package: it is deployed under that name and modules
+import each other as ``clawos.services...``. A checkout has no ``clawos``
+directory, so code/ is registered under that name before any test is collected,
+and tests import from ``clawos``.
+
+The directory name also clashes with the stdlib ``code`` module:
+
+- pytest would import every ``__init__.py`` on the way to a test by its file
+  path, as ``code.services...``. Package directories under code/ are therefore
+  collected as plain directories.
+- With the repo root on sys.path (``python -m pytest`` from the root, or
+  services/evolution_scheduler's own sys.path setup), ``import code`` would
+  find code/. The stdlib module is loaded explicitly instead.
+"""
+
+import importlib.machinery
+import importlib.util
+import sys
+import sysconfig
+from pathlib import Path
+
+import pytest
+
+CODE_DIR = Path(__file__).resolve().parent / "code"
+
+
+def _is_code_dir(module) -> bool:
+    return Path(getattr(module, "__file__", None) or "").resolve().parent == CODE_DIR
+
+
+def _load(name: str, spec) -> None:
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+
+def _register_clawos():
+    if not _is_code_dir(sys.modules.get("clawos")):
+        _load("clawos", importlib.util.spec_from_file_location(
+            "clawos", CODE_DIR / "__init__.py", submodule_search_locations=[str(CODE_DIR)]
+        ))
+
+
+def _pin_stdlib_code():
+    if "code" not in sys.modules or _is_code_dir(sys.modules["code"]):
+        stdlib = sysconfig.get_paths()["stdlib"]
+        _load("code", importlib.machinery.PathFinder.find_spec("code", [stdlib]))
+
+
+_pin_stdlib_code()
+_register_clawos()
+
+
+def pytest_collect_directory(path, parent):
+    path = path.resolve()
+    if (path == CODE_DIR or CODE_DIR in path.parents) and (path / "__init__.py").is_file():
+        return pytest.Dir.from_parent(parent, path=path)
+    return None